@@ -0,0 +1,525 @@
+import rdt
+import os
+import json
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from rdt import file_transfer
+from rdt.log import get_logger
+from .client import SERVER_ADDR, CACHE_DIR, HEARTBEAT_INTERVAL, MAX_BUSY_RETRIES
+from .message_cache import MessageCache
+
+PUMP_INTERVAL = 0.02  # How often the socket is serviced (retransmissions, ACKs) while anything is unacknowledged
+REPLY_TIMEOUT = 5.0  # Seconds without any reply, with requests delivered and waiting for one, before they are given up
+EVENT_QUEUE_SIZE = 256  # Events not yet read from events(); past this the oldest are dropped
+
+class AsyncClient:
+    """The commands of Client as coroutines, for bots and UIs that run many of them at once on one thread.
+
+    Requests are not sent one round-trip at a time: each one goes out as soon as it is awaited, on the
+    same RDT session. Every request carries an id that the server echoes around its replies, which is
+    what they are matched on. The server replies in the order the requests arrived, so a reply also
+    settles the requests sent before it that are still waiting: theirs was dropped. A request the server
+    answers "busy" is sent again after the wait it asks for, behind everything sent meanwhile.
+
+    The socket is serviced by a task of the event loop (started by the first command), woken when a
+    packet arrives and every PUMP_INTERVAL while something is unacknowledged. Events pushed by the server
+    come out of events(). The simulated network delay of the RDT layer still blocks the loop while it runs.
+    """
+    def __init__(self, username):
+        self.username = username
+        self.log = logging.LoggerAdapter(get_logger("client"), {"user": username})
+        self.socket = rdt.RDTSocket()
+        self.socket.datagram_handler = self._handle_datagram
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        self.cache = MessageCache(os.path.join(CACHE_DIR, f"{username}.sqlite3"))
+        self.listings = {}  # command -> (version, items) of the shared listings
+        self.pending = OrderedDict()  # request id -> PendingRequest waiting for a reply, in the order they were sent
+        self.next_id = 0
+        self.upload = None  # PendingRequest for the server's verdict on the chunks being sent (upload replies have no id)
+        self.last_reply = 0  # When a reply last arrived (or the first request started waiting)
+        self.events_queue = asyncio.Queue()
+        self.dropped_events = 0
+        self.wakeup = asyncio.Event()
+        self.started = None  # Task connecting the socket and then servicing it
+        self.pump = None
+        self.reader = False  # Whether the loop wakes us up when a packet arrives (otherwise we poll)
+        self.heartbeat = None
+        self.upload_lock = asyncio.Lock()  # The server keeps one upload per client
+        self.log_message("Async client started")
+
+    def log_message(self, message, *args, level=logging.DEBUG):
+        self.log.log(level, message, *args)
+
+    async def __aenter__(self):
+        await self._start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def _start(self):
+        if self.started is None:
+            self.started = asyncio.ensure_future(self._connect())
+        await asyncio.shield(self.started)
+
+    async def _connect(self):
+        # The handshake is the only blocking step: it runs before the socket is used by anything else
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self.socket.connect, SERVER_ADDR)
+        try:
+            loop.add_reader(self.socket.fileno(), self.wakeup.set)
+            self.reader = True
+        except NotImplementedError:
+            # Event loops without add_reader (the Windows proactor): the pump polls instead
+            pass
+        self.pump = asyncio.ensure_future(self._pump())
+
+    async def close(self):
+        """Stop the heartbeat and the pump, fail what is still waiting for a reply and close the socket"""
+        self._stop_heartbeat()
+        if self.started is not None and not self.started.done():
+            await asyncio.gather(self.started, return_exceptions=True)
+        if self.pump is not None:
+            self.pump.cancel()
+            await asyncio.gather(self.pump, return_exceptions=True)
+            self.pump = None
+        if self.reader:
+            asyncio.get_running_loop().remove_reader(self.socket.fileno())
+            self.reader = False
+        self._fail_pending()
+        if self.socket.connection is not None:
+            self.socket.close()
+        self.cache.close()
+
+    async def _pump(self):
+        while True:
+            try:
+                self._service()
+            except Exception as e:
+                self.log_message("Error handling a reply: %s", e, level=logging.WARNING)
+            self.wakeup.clear()
+            timer = None
+            if self.pending or self.upload or self.socket.sending or not self.reader:
+                timer = asyncio.get_running_loop().call_later(PUMP_INTERVAL, self.wakeup.set)
+            try:
+                await self.wakeup.wait()
+            finally:
+                if timer is not None:
+                    timer.cancel()
+
+    def _service(self):
+        while True:
+            data, _ = self.socket.recvfrom_nowait()
+            if data is None:
+                break
+            self._handle_reply(data)
+        if self.socket.sending:
+            # What was sent has not all reached the server: the replies cannot have been sent yet. The
+            # RDT layer gives up on the session itself when the server stops acknowledging
+            self.last_reply = time.time()
+        elif (self.pending or self.upload) and time.time() - self.last_reply > REPLY_TIMEOUT:
+            self.log_message("Error: No reply from server in %ss, giving up %s requests.", REPLY_TIMEOUT,
+                             len(self.pending) + (self.upload is not None), level=logging.WARNING)
+            self._fail_pending()
+
+    def _handle_reply(self, data):
+        self.last_reply = time.time()
+        try:
+            reply = json.loads(data.decode())
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            self.log_message("Error: Ignoring malformed reply.", level=logging.WARNING)
+            return
+        if not isinstance(reply, dict) or "id" not in reply or "reply" not in reply:
+            # Only the replies to file chunks come without an id
+            if self.upload is None:
+                self.log_message("Error: Ignoring a reply to no request.", level=logging.WARNING)
+                return
+            upload, self.upload = self.upload, None
+            if not upload.future.done():
+                upload.future.set_result([reply])
+            return
+        request = self.pending.get(reply["id"])
+        if request is None:
+            self.log_message("Error: Ignoring a reply to no request (%s).", reply["id"], level=logging.WARNING)
+            return
+        # Replies come in the order the requests were sent: those still waiting before this one lost theirs
+        while next(iter(self.pending)) != reply["id"]:
+            _, skipped = self.pending.popitem(last=False)
+            self.log_message("Error: Reply to request %s was lost.", skipped.id, level=logging.WARNING)
+            if not skipped.future.done():
+                skipped.future.set_result(None)
+        reply = reply["reply"]
+        # Over its rate limit the server answers {"busy": true, "retry_after": s} without handling the request
+        if isinstance(reply, dict) and reply.get("busy") and request.retries < MAX_BUSY_RETRIES:
+            del self.pending[request.id]
+            request.retries += 1
+            self.log_message("Server busy, sending the request again in %.3fs", reply["retry_after"], level=logging.WARNING)
+            asyncio.get_running_loop().call_later(reply["retry_after"], self._resend, request)
+            return
+        request.replies.append(reply)
+        if request.until is None or request.until(reply):
+            del self.pending[request.id]
+            if not request.future.done():
+                request.future.set_result(request.replies)
+
+    def _resend(self, request):
+        if not request.future.done():
+            asyncio.ensure_future(self._send_pending(request))
+
+    async def _send_pending(self, request):
+        if not await self._send_queued(request.data):
+            if not request.future.done():
+                request.future.set_result(None)
+            return
+        self._waiting(request)
+
+    def _waiting(self, request):
+        if not self.pending and self.upload is None:
+            self.last_reply = time.time()
+        self.pending[request.id] = request
+        self.wakeup.set()
+
+    def _fail_pending(self):
+        waiting = list(self.pending.values())
+        if self.upload is not None:
+            waiting.append(self.upload)
+        self.pending.clear()
+        self.upload = None
+        for request in waiting:
+            if not request.future.done():
+                request.future.set_result(None)
+
+    async def _send_queued(self, data):
+        # The session queues up to MAX_SESSION_BACKLOG unacknowledged messages; past that we wait for the
+        # pump to drain it, giving up if it does not within REPLY_TIMEOUT
+        started = time.time()
+        while self.socket.send_nowait(data) is False:
+            if self.socket.connection is None or time.time() - started > REPLY_TIMEOUT:
+                return False
+            self.wakeup.set()
+            await asyncio.sleep(PUMP_INTERVAL)
+        self.wakeup.set()
+        return True
+
+    async def _request(self, request, until=None):
+        """Send a request and return its replies (decoded JSON): one, or as many as it takes for until(reply)
+        to be true. None if it could not be sent or no reply came."""
+        self.next_id += 1
+        replies = await self._exchange(self.next_id, json.dumps(dict(request, id=self.next_id)).encode(), until)
+        if replies is None:
+            self.log_message("Error: No reply from server to %s.", request["command"], level=logging.WARNING)
+        return replies
+
+    async def _exchange(self, request_id, data, until=None):
+        await self._start()
+        if not await self._send_queued(data):
+            return None
+        request = PendingRequest(request_id, data, asyncio.get_running_loop().create_future(), until)
+        self._waiting(request)
+        return await request.future
+
+    async def _recv_json(self, request):
+        replies = await self._request(request)
+        return None if replies is None else replies[0]
+
+    async def _recv_status(self, request):
+        # Commands that change state reply with true/false
+        return await self._recv_json(request) is True
+
+    async def _recv_list(self, request):
+        response = await self._recv_json(request)
+        if response is not None and not isinstance(response, list):
+            self.log_message("Error: Response is not a list.", level=logging.WARNING)
+            return None
+        return response
+
+    async def _send_only(self, request):
+        # Commands with no reply (login, logout): done once the server acknowledged them, as with
+        # Client._send, so what is sent afterwards (by us or anyone else) finds them handled
+        await self._start()
+        if not await self._send_queued(json.dumps(request).encode()):
+            return False
+        mark = self.socket.send_mark()
+        while True:
+            acked = self.socket.is_acked(mark)
+            if acked is not False or self.socket.connection is None:
+                # None: the RDT layer gave up on the session before the server acknowledged it
+                return acked is True
+            self.wakeup.set()
+            await asyncio.sleep(PUMP_INTERVAL)
+
+    async def login(self):
+        self.log_message("Logging in as %s", self.username)
+        if not await self._send_only({"command": "login", "user": self.username}):
+            self.log_message("Failed to login: Connection error", level=logging.WARNING)
+            return False
+        if self.heartbeat is None or self.heartbeat.done():
+            self.heartbeat = asyncio.ensure_future(self._heartbeat_loop())
+        return True
+
+    async def logout(self):
+        self._stop_heartbeat()
+        self.log_message("Logging out: %s", self.username)
+        if not await self._send_only({"command": "logout", "user": self.username}):
+            self.log_message("Failed to logout: Connection error", level=logging.WARNING)
+            return False
+        return True
+
+    async def _heartbeat_loop(self):
+        # Heartbeats are unreliable datagrams: a lost one is covered by the next, well before the server's timeout
+        heartbeat = json.dumps({"command": "heartbeat", "user": self.username}).encode()
+        while self.socket.connection is not None:
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+            if self.socket.connection is None:
+                return
+            self.socket.send_datagram(heartbeat)
+
+    def _stop_heartbeat(self):
+        if self.heartbeat is not None:
+            self.heartbeat.cancel()
+            self.heartbeat = None
+
+    def _handle_datagram(self, data, addr):
+        try:
+            event = json.loads(data.decode())
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            self.log_message("Error: Ignoring malformed event.", level=logging.WARNING)
+            return
+        if self.events_queue.qsize() >= EVENT_QUEUE_SIZE:
+            self.events_queue.get_nowait()
+            self.dropped_events += 1
+        self.events_queue.put_nowait(event)
+
+    async def events(self):
+        """Events pushed by the server (such as presence changes), as they arrive: `async for event in client.events()`"""
+        await self._start()
+        while True:
+            yield await self.events_queue.get()
+
+    async def list_cinners(self):
+        self.log_message("Requesting list of all users")
+        return await self._list_versioned("list:cinners")
+
+    async def list_online(self):
+        self.log_message("Requesting online users")
+        return await self._recv_list({"command": "list:online", "user": self.username})
+
+    async def list_friends(self):
+        self.log_message("Requesting friend list")
+        return await self._recv_list({"command": "list:friends", "user": self.username})
+
+    async def list_mygroups(self):
+        self.log_message("Requesting my groups")
+        return await self._recv_list({"command": "list:mygroups", "user": self.username})
+
+    async def list_groups(self):
+        self.log_message("Requesting available groups")
+        return await self._list_versioned("list:groups")
+
+    async def _list_versioned(self, command):
+        # As in Client: sent with the version we have, "not modified" is answered from self.listings
+        version, items = self.listings.get(command, ("", None))
+        response = await self._recv_json({"command": command, "user": self.username, "version": version})
+        if response is None:
+            return None
+        if not isinstance(response, dict) or "version" not in response:
+            self.log_message("Error: Unexpected listing response.", level=logging.WARNING)
+            return None
+        if response.get("not_modified"):
+            # A concurrent call may have stored a newer listing meanwhile; ours is the one the version was for
+            return list(items)
+        if not isinstance(response.get("items"), list):
+            self.log_message("Error: Response is not a list.", level=logging.WARNING)
+            return None
+        self.listings[command] = (response["version"], response["items"])
+        return list(response["items"])
+
+    async def follow(self, friend_name):
+        self.log_message("Following user: %s", friend_name)
+        return await self._recv_status({"command": "follow", "user": self.username, "friend": friend_name})
+
+    async def unfollow(self, friend_name):
+        self.log_message("Unfollowing user: %s", friend_name)
+        return await self._recv_status({"command": "unfollow", "user": self.username, "friend": friend_name})
+
+    async def create_group(self, group_name):
+        self.log_message("Creating group: %s", group_name)
+        return await self._recv_status({"command": "create_group", "user": self.username, "group": group_name})
+
+    async def delete_group(self, group_name):
+        self.log_message("Deleting group: %s", group_name)
+        return await self._recv_status({"command": "delete_group", "user": self.username, "group": group_name})
+
+    async def join_group(self, group_name, group_key):
+        self.log_message("Joining group: %s", group_name)
+        return await self._recv_status({"command": "join", "user": self.username, "group": group_name, "key": group_key})
+
+    async def leave_group(self, group_name):
+        self.log_message("Leaving group: %s", group_name)
+        return await self._recv_status({"command": "leave", "user": self.username, "group": group_name})
+
+    async def ban_user(self, user_name):
+        self.log_message("Banning user: %s", user_name)
+        return await self._recv_status({"command": "ban", "user": self.username, "target": user_name})
+
+    async def stats(self):
+        # Admin only: the server answers False to anyone else
+        self.log_message("Requesting server metrics")
+        response = await self._recv_json({"command": "stats", "user": self.username})
+        if not isinstance(response, dict) or response.get("busy"):
+            self.log_message("Error: Not allowed to read server metrics.", level=logging.WARNING)
+            return None
+        return response
+
+    async def chat_group(self, group_name, group_key, message):
+        self.log_message("TO GROUP '%s': %s", group_name, message)
+        return await self._recv_status({"command": "chat_group", "user": self.username, "group": group_name,
+                                        "key": group_key, "message": message})
+
+    async def chat_friend(self, friend_name, message):
+        self.log_message("TO USER '%s': %s", friend_name, message)
+        return await self._recv_status({"command": "chat_friend", "user": self.username, "friend": friend_name,
+                                        "message": message})
+
+    async def list_messages(self, chat_name):
+        self.log_message("Getting messages for: %s", chat_name)
+        return await self._recv_list({"command": "list:messages", "user": self.username, "chat": chat_name})
+
+    async def sync_messages(self, chat_name):
+        """As Client.sync_messages: (new messages, rebuilt) for the chat, stored in the cache; None on errors"""
+        new_messages, rebuilt = [], False
+        while True:
+            epoch, since = self.cache.high_water(chat_name)
+            self.log_message("Syncing messages for: %s after #%s", chat_name, since)
+            response = await self._recv_json({"command": "list:messages", "user": self.username, "chat": chat_name,
+                                              "since": since, "epoch": epoch})
+            if response is None:
+                return None
+            if not isinstance(response, dict) or not isinstance(response.get("messages"), list):
+                self.log_message("Error: Unexpected sync response.", level=logging.WARNING)
+                return None
+
+            if response["epoch"] != epoch:
+                new_messages, rebuilt = [], True
+            self.cache.store(chat_name, response["epoch"], response["messages"])
+            new_messages.extend(response["messages"])
+            if not response.get("more"):
+                return new_messages, rebuilt
+
+    async def inbox(self):
+        """Every chat of the user with its unread count and last message, most recent first"""
+        self.log_message("Requesting inbox")
+        return await self._recv_list({"command": "inbox", "user": self.username})
+
+    async def search(self, query, chat_name=None, before=None):
+        """As Client.search: {"hits": [...], "more": bool}, newest first"""
+        request = {"command": "search", "user": self.username, "query": query}
+        if chat_name is not None:
+            request["chat"] = chat_name
+        if before is not None:
+            request["before"] = before
+        self.log_message("Searching for: %s", query)
+        response = await self._recv_json(request)
+        if response is None:
+            return None
+        if not isinstance(response, dict) or not isinstance(response.get("hits"), list):
+            self.log_message("Error: Unexpected search response.", level=logging.WARNING)
+            return None
+        return response
+
+    async def fetch_offline(self):
+        """As Client.fetch_offline: direct messages sent to us while we were offline, oldest first"""
+        messages, cursor = [], 0
+        while True:
+            self.log_message("Fetching offline messages after #%s", cursor)
+            # The server answers with a window of replies; the last one has "window_end"
+            replies = await self._request({"command": "offline", "user": self.username, "ack": cursor},
+                                          until=lambda reply: isinstance(reply, dict) and reply.get("window_end"))
+            if replies is None:
+                return None
+            window = []
+            for response in replies:
+                if not isinstance(response, dict) or not isinstance(response.get("messages"), list):
+                    self.log_message("Error: Unexpected offline messages response.", level=logging.WARNING)
+                    return None
+                window.extend(response["messages"])
+            if not window:
+                return messages
+            messages.extend(window)
+            cursor = window[-1]["number"]
+
+    def cached_messages(self, chat_name):
+        """The history of the chat as far as it was synced, without touching the network"""
+        return self.cache.get(chat_name)
+
+    async def send_file(self, path):
+        try:
+            size = os.path.getsize(path)
+            sha256 = file_transfer.file_digest(path)
+        except OSError as e:
+            self.log_message("Error: Cannot read %s: %s", path, e, level=logging.WARNING)
+            return False
+
+        name = os.path.basename(path)
+        request = {"command": "send_file", "user": self.username, "name": name, "size": size,
+                   "sha256": sha256, "chunk_size": file_transfer.FILE_CHUNK_SIZE}
+        async with self.upload_lock:
+            self.log_message("Sending file: %s (%s bytes)", name, size)
+            offset = None
+            while True:
+                # As in Client.send_file: each pass starts with the metadata, answered with where to resume
+                response = await self._recv_json(request)
+                if not isinstance(response, dict) or response.get("busy"):
+                    self.log_message("Error: Server refused upload of %s.", name, level=logging.WARNING)
+                    return False
+                if "ok" in response:
+                    return response["ok"] is True
+                if offset is not None and response["offset"] <= offset:
+                    self.log_message("Error: Upload of %s is not progressing, giving up.", name, level=logging.WARNING)
+                    return False
+                offset = response["offset"]
+
+                response = await self._send_chunks(path, offset, name)
+                if response is None:
+                    return False
+                if "resend" in response:
+                    self.log_message("Server asked to resend %s from chunk %s", name, response["resend"])
+                    continue
+                if response.get("ok") is not True:
+                    self.log_message("Error: Integrity check of %s failed.", name, level=logging.WARNING)
+                    return False
+                return True
+
+    async def _send_chunks(self, path, offset, name):
+        # Chunks go through the session's send queue; when it is full we wait for it to drain. The server
+        # answers a pass once: its verdict after the last chunk, or a request to resend as soon as a chunk
+        # is damaged, and then the rest of the pass need not be sent
+        upload = self.upload = PendingRequest(None, None, asyncio.get_running_loop().create_future())
+        for chunk in (chunk for batch in file_transfer.iter_chunk_batches(path, offset) for chunk in batch):
+            if upload.future.done():
+                break
+            if not await self._send_queued(chunk):
+                self.log_message("Error: Upload of %s interrupted, it will resume from where it stopped.", name, level=logging.WARNING)
+                if self.upload is upload:
+                    self.upload = None
+                return None
+        replies = await upload.future
+        response = None if replies is None else replies[0]
+        if not isinstance(response, dict):
+            self.log_message("Error: Unexpected upload response for %s.", name, level=logging.WARNING)
+            return None
+        return response
+
+class PendingRequest:
+    """A request sent and still waiting for its reply (or replies)"""
+    __slots__ = ("id", "data", "future", "until", "replies", "retries")
+
+    def __init__(self, id, data, future, until=None):
+        self.id = id
+        self.data = data
+        self.future = future
+        self.until = until  # For commands answered with several replies: true on the last one
+        self.replies = []
+        self.retries = 0
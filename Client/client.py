@@ -1,183 +1,477 @@
 import rdt
+import os
 import json
+import time
+import logging
+import threading
+from rdt import file_transfer
+from rdt.log import get_logger
+from .message_cache import MessageCache
 
 SERVER_ADDR = ("localhost", 5001)
+CACHE_DIR = "./Cache"  # Local message caches, one sqlite file per user
+HEARTBEAT_INTERVAL = 5.0  # How often a logged in client tells the server it is still there
+MAX_BUSY_RETRIES = 3  # A request the server answers "busy" is sent again after the wait it asks for, this many times
+
+def busy_retry_after(response):
+    """The wait asked for by a "busy" reply, or None if the reply is anything else (or None)"""
+    if response is None:
+        return None
+    try:
+        reply = json.loads(response.decode())
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        return None
+    # Replies to requests sent with an id come wrapped: {"id": ..., "reply": ...}
+    if isinstance(reply, dict) and "id" in reply and "reply" in reply:
+        reply = reply["reply"]
+    if isinstance(reply, dict) and reply.get("busy"):
+        return reply["retry_after"]
+    return None
 
 class Client:
     def __init__(self, username):
         self.username = username
+        self.log = logging.LoggerAdapter(get_logger("client"), {"user": username})
         self.socket = rdt.RDTSocket()
         self.socket.connect(SERVER_ADDR)
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        self.cache = MessageCache(os.path.join(CACHE_DIR, f"{username}.sqlite3"))
+        self.listings = {}  # command -> (version, items) of the shared listings
+        self.heartbeat_stop = threading.Event()
+        self.heartbeat_thread = None
+        self.last_request = None  # Sent again if the server answers it with "busy"
         self.log_message("Client started")
             
-    def log_message(self, message, color=None):
-        formatted_message = f"Client {self.username}: {message}"
-        print(f"\033[33m{formatted_message}\033[0m")
+    def log_message(self, message, *args, level=logging.DEBUG):
+        # Per-request messages are DEBUG, so they cost nothing unless tracing is on (see rdt/log.py)
+        self.log.log(level, message, *args)
+
+    def _send(self, data):
+        self.last_request = data
+        return self.socket.send(data)
+
+    def _recv(self):
+        # Over its rate limit the server answers {"busy": true, "retry_after": s} without handling the request
+        response = self.socket.recv()
+        for _ in range(MAX_BUSY_RETRIES):
+            retry_after = busy_retry_after(response)
+            if retry_after is None:
+                break
+            self.log_message("Server busy, sending the request again in %.3fs", retry_after, level=logging.WARNING)
+            time.sleep(retry_after)
+            if self.socket.send(self.last_request) is False:
+                return None
+            response = self.socket.recv()
+        return response
+
+    def _recv_status(self):
+        # Commands that change state reply with true/false. Reading that reply keeps
+        # requests and responses paired and lets our ACK ride on the next request.
+        response = self._recv()
+        if response is None:
+            self.log_message("Error: Received None from server.", level=logging.WARNING)
+            return False
+        return json.loads(response.decode()) is True
 
     def login(self):
         data = json.dumps({"command": "login", "user": self.username})
-        self.log_message(f"Logging in as {self.username}")
-        if self.socket.send(data.encode()) is False:
-            self.log_message("Failed to login: Connection error")
+        self.log_message("Logging in as %s", self.username)
+        if self._send(data.encode()) is False:
+            self.log_message("Failed to login: Connection error", level=logging.WARNING)
             return False
+        self._start_heartbeat()
         return True
 
     def logout(self):
+        self._stop_heartbeat()
         data = json.dumps({"command": "logout", "user": self.username})
-        self.log_message(f"Logging out: {self.username}")
-        if self.socket.send(data.encode()) is False:
-            self.log_message("Error during logout: Connection error")
+        self.log_message("Logging out: %s", self.username)
+        if self._send(data.encode()) is False:
+            self.log_message("Error during logout: Connection error", level=logging.WARNING)
             return False
         return True
 
     def list_cinners(self):
-        data = json.dumps({"command": "list:cinners", "user": self.username})
         self.log_message("Requesting list of all users")
-        if self.socket.send(data.encode()) is False:
-            self.log_message("Error: Failed to send data to server.")
+        return self._list_versioned("list:cinners")
+
+    def list_online(self):
+        data = json.dumps({"command": "list:online", "user": self.username})
+        self.log_message("Requesting online users")
+        if self._send(data.encode()) is False:
+            self.log_message("Error: Failed to send data to server.", level=logging.WARNING)
             return None
-        response = self.socket.recv()
+        response = self._recv()
         if response is None:
-            self.log_message("Error: Received None from server.")
+            self.log_message("Error: Received None from server.", level=logging.WARNING)
             return None
         response = json.loads(response.decode())
         if not isinstance(response, list):
-            self.log_message("Error: Response is not a list.")
+            self.log_message("Error: Response is not a list.", level=logging.WARNING)
             return None
         return response
 
+    def poll_events(self, timeout=0):
+        """Events pushed by the server (such as presence changes), waiting up to `timeout` seconds for the first"""
+        events = []
+        while True:
+            data, _ = self.socket.recv_datagram(timeout if not events else 0)
+            if data is None:
+                return events
+            try:
+                events.append(json.loads(data.decode()))
+            except (json.JSONDecodeError, UnicodeDecodeError):
+                self.log_message("Error: Ignoring malformed event.", level=logging.WARNING)
+
+    def _start_heartbeat(self):
+        if self.heartbeat_thread and self.heartbeat_thread.is_alive():
+            return
+        self.heartbeat_stop.clear()
+        self.heartbeat_thread = threading.Thread(target=self._heartbeat_loop, daemon=True)
+        self.heartbeat_thread.start()
+
+    def _stop_heartbeat(self):
+        self.heartbeat_stop.set()
+
+    def _heartbeat_loop(self):
+        # Heartbeats are unreliable datagrams: a lost one is covered by the next, well before the server's timeout
+        heartbeat = json.dumps({"command": "heartbeat", "user": self.username}).encode()
+        while not self.heartbeat_stop.wait(HEARTBEAT_INTERVAL):
+            if self.socket.connection is None:
+                return
+            try:
+                self.socket.send_datagram(heartbeat)
+            except (OSError, AttributeError):
+                # The socket was closed under us
+                return
+
     def list_friends(self):
         data = json.dumps({"command": "list:friends", "user": self.username})
         self.log_message("Requesting friend list")
-        if self.socket.send(data.encode()) is False:
-            self.log_message("Error: Failed to send data to server.")
+        if self._send(data.encode()) is False:
+            self.log_message("Error: Failed to send data to server.", level=logging.WARNING)
             return None
-        response = self.socket.recv()
+        response = self._recv()
         if response is None:
-            self.log_message("Error: Received None from server.")
+            self.log_message("Error: Received None from server.", level=logging.WARNING)
             return None
         response = json.loads(response.decode())
         if not isinstance(response, list):
-            self.log_message("Error: Response is not a list.")
+            self.log_message("Error: Response is not a list.", level=logging.WARNING)
             return None
         return response
 
     def list_mygroups(self):
         data = json.dumps({"command": "list:mygroups", "user": self.username})
         self.log_message("Requesting my groups")
-        if self.socket.send(data.encode()) is False:
-            self.log_message("Error: Failed to send data to server.")
+        if self._send(data.encode()) is False:
+            self.log_message("Error: Failed to send data to server.", level=logging.WARNING)
             return None
-        response = self.socket.recv()
+        response = self._recv()
         if response is None:
-            self.log_message("Error: Received None from server.")
+            self.log_message("Error: Received None from server.", level=logging.WARNING)
             return None
         response = json.loads(response.decode())
         if not isinstance(response, list):
-            self.log_message("Error: Response is not a list.")
+            self.log_message("Error: Response is not a list.", level=logging.WARNING)
             return None
         return response
 
     def list_groups(self):
-        data = json.dumps({"command": "list:groups", "user": self.username})
         self.log_message("Requesting available groups")
-        if self.socket.send(data.encode()) is False:
-            self.log_message("Error: Failed to send data to server.")
+        return self._list_versioned("list:groups")
+
+    def _list_versioned(self, command):
+        # Shared listings are sent with the version we already have; an unchanged
+        # listing comes back as "not modified" and is answered from self.listings.
+        version, items = self.listings.get(command, ("", None))
+        data = json.dumps({"command": command, "user": self.username, "version": version})
+        if self._send(data.encode()) is False:
+            self.log_message("Error: Failed to send data to server.", level=logging.WARNING)
             return None
-        response = self.socket.recv()
+        response = self._recv()
         if response is None:
-            self.log_message("Error: Received None from server.")
+            self.log_message("Error: Received None from server.", level=logging.WARNING)
             return None
         response = json.loads(response.decode())
-        if not isinstance(response, list):
-            self.log_message("Error: Response is not a list.")
+        if not isinstance(response, dict) or "version" not in response:
+            self.log_message("Error: Unexpected listing response.", level=logging.WARNING)
             return None
-        return response
+        if response.get("not_modified"):
+            return list(items)
+        if not isinstance(response.get("items"), list):
+            self.log_message("Error: Response is not a list.", level=logging.WARNING)
+            return None
+        self.listings[command] = (response["version"], response["items"])
+        return list(response["items"])
 
     def follow(self, friend_name):
         data = json.dumps({"command": "follow", "user": self.username, "friend": friend_name})
-        self.log_message(f"Following user: {friend_name}")
-        if self.socket.send(data.encode()) is False:
-            self.log_message(f"Error: Failed to follow {friend_name}.")
+        self.log_message("Following user: %s", friend_name)
+        if self._send(data.encode()) is False:
+            self.log_message("Error: Failed to follow %s.", friend_name, level=logging.WARNING)
             return False
-        return True
+        return self._recv_status()
 
     def unfollow(self, friend_name):
         data = json.dumps({"command": "unfollow", "user": self.username, "friend": friend_name})
-        self.log_message(f"Unfollowing user: {friend_name}")
-        if self.socket.send(data.encode()) is False:
-            self.log_message(f"Error: Failed to unfollow {friend_name}.")
+        self.log_message("Unfollowing user: %s", friend_name)
+        if self._send(data.encode()) is False:
+            self.log_message("Error: Failed to unfollow %s.", friend_name, level=logging.WARNING)
             return False
-        return True
+        return self._recv_status()
 
     def create_group(self, group_name):
         data = json.dumps({"command": "create_group", "user": self.username, "group": group_name})
-        self.log_message(f"Creating group: {group_name}")
-        if self.socket.send(data.encode()) is False:
-            self.log_message(f"Error: Failed to create group {group_name}.")
+        self.log_message("Creating group: %s", group_name)
+        if self._send(data.encode()) is False:
+            self.log_message("Error: Failed to create group %s.", group_name, level=logging.WARNING)
             return False
-        return True
+        return self._recv_status()
 
     def delete_group(self, group_name):
         data = json.dumps({"command": "delete_group", "user": self.username, "group": group_name})
-        self.log_message(f"Deleting group: {group_name}")
-        if self.socket.send(data.encode()) is False:
-            self.log_message(f"Error: Failed to delete group {group_name}.")
+        self.log_message("Deleting group: %s", group_name)
+        if self._send(data.encode()) is False:
+            self.log_message("Error: Failed to delete group %s.", group_name, level=logging.WARNING)
             return False
-        return True
+        return self._recv_status()
 
     def join_group(self, group_name, group_key):
         data = json.dumps({"command": "join", "user": self.username, "group": group_name, "key": group_key})
-        self.log_message(f"Joining group: {group_name}")
-        if self.socket.send(data.encode()) is False:
-            self.log_message(f"Error: Failed to join group {group_name}.")
+        self.log_message("Joining group: %s", group_name)
+        if self._send(data.encode()) is False:
+            self.log_message("Error: Failed to join group %s.", group_name, level=logging.WARNING)
             return False
-        return True
+        return self._recv_status()
 
     def leave_group(self, group_name):
         data = json.dumps({"command": "leave", "user": self.username, "group": group_name})
-        self.log_message(f"Leaving group: {group_name}")
-        if self.socket.send(data.encode()) is False:
-            self.log_message(f"Error: Failed to leave group {group_name}.")
+        self.log_message("Leaving group: %s", group_name)
+        if self._send(data.encode()) is False:
+            self.log_message("Error: Failed to leave group %s.", group_name, level=logging.WARNING)
             return False
-        return True
+        return self._recv_status()
 
     def ban_user(self, user_name):
         data = json.dumps({"command": "ban", "user": self.username, "target": user_name})
-        self.log_message(f"Banning user: {user_name}")
-        if self.socket.send(data.encode()) is False:
-            self.log_message(f"Error: Failed to ban user {user_name}.")
+        self.log_message("Banning user: %s", user_name)
+        if self._send(data.encode()) is False:
+            self.log_message("Error: Failed to ban user %s.", user_name, level=logging.WARNING)
             return False
-        return True
+        return self._recv_status()
+
+    def stats(self):
+        # Admin only: the server answers False to anyone else
+        data = json.dumps({"command": "stats", "user": self.username})
+        self.log_message("Requesting server metrics")
+        if self._send(data.encode()) is False:
+            self.log_message("Error: Failed to send data to server.", level=logging.WARNING)
+            return None
+        response = self._recv()
+        if response is None:
+            self.log_message("Error: Received None from server.", level=logging.WARNING)
+            return None
+        response = json.loads(response.decode())
+        if not isinstance(response, dict) or response.get("busy"):
+            self.log_message("Error: Not allowed to read server metrics.", level=logging.WARNING)
+            return None
+        return response
 
     def chat_group(self, group_name, group_key, message):
         data = json.dumps({"command": "chat_group", "user": self.username, "group": group_name, "key": group_key, "message": message})
-        self.log_message(f"TO GROUP '{group_name}': {message}")
-        if self.socket.send(data.encode()) is False:
-            self.log_message(f"Error: Failed to send message to group {group_name}.")
+        self.log_message("TO GROUP '%s': %s", group_name, message)
+        if self._send(data.encode()) is False:
+            self.log_message("Error: Failed to send message to group %s.", group_name, level=logging.WARNING)
             return False
-        return True
+        return self._recv_status()
 
     def chat_friend(self, friend_name, message):
         data = json.dumps({"command": "chat_friend", "user": self.username, "friend": friend_name, "message": message})
-        self.log_message(f"TO USER '{friend_name}': {message}")
-        if self.socket.send(data.encode()) is False:
-            self.log_message(f"Error: Failed to send message to {friend_name}.")
+        self.log_message("TO USER '%s': %s", friend_name, message)
+        if self._send(data.encode()) is False:
+            self.log_message("Error: Failed to send message to %s.", friend_name, level=logging.WARNING)
             return False
-        return True
+        return self._recv_status()
 
     def list_messages(self, chat_name):
         data = json.dumps({"command": "list:messages", "user": self.username, "chat": chat_name})
-        self.log_message(f"Getting messages for: {chat_name}")
-        if self.socket.send(data.encode()) is False:
-            self.log_message(f"Error: Failed to request messages for {chat_name}.")
+        self.log_message("Getting messages for: %s", chat_name)
+        if self._send(data.encode()) is False:
+            self.log_message("Error: Failed to request messages for %s.", chat_name, level=logging.WARNING)
             return None
-        response = self.socket.recv()
+        response = self._recv()
         if response is None:
-            self.log_message("Error: Received None from server.")
+            self.log_message("Error: Received None from server.", level=logging.WARNING)
             return None
         response = json.loads(response.decode())
         if not isinstance(response, list):
-            self.log_message("Error: Response is not a list.")
+            self.log_message("Error: Response is not a list.", level=logging.WARNING)
+            return None
+        return response
+
+    def sync_messages(self, chat_name):
+        """Fetch only the messages newer than the cached ones and store them in the cache.
+
+        Returns (new messages, rebuilt), where rebuilt means the cache for the chat was started over
+        (first sync or server restart) and the new messages are the whole history; None on errors.
+        """
+        new_messages, rebuilt = [], False
+        while True:
+            epoch, since = self.cache.high_water(chat_name)
+            data = json.dumps({"command": "list:messages", "user": self.username, "chat": chat_name,
+                               "since": since, "epoch": epoch})
+            self.log_message("Syncing messages for: %s after #%s", chat_name, since)
+            if self._send(data.encode()) is False:
+                self.log_message("Error: Failed to request messages for %s.", chat_name, level=logging.WARNING)
+                return None
+            response = self._recv()
+            if response is None:
+                self.log_message("Error: Received None from server.", level=logging.WARNING)
+                return None
+            response = json.loads(response.decode())
+            if not isinstance(response, dict) or not isinstance(response.get("messages"), list):
+                self.log_message("Error: Unexpected sync response.", level=logging.WARNING)
+                return None
+
+            if response["epoch"] != epoch:
+                new_messages, rebuilt = [], True
+            self.cache.store(chat_name, response["epoch"], response["messages"])
+            new_messages.extend(response["messages"])
+            if not response.get("more"):
+                return new_messages, rebuilt
+
+    def inbox(self):
+        """Every chat of the user with its unread count and last message, most recent first"""
+        data = json.dumps({"command": "inbox", "user": self.username})
+        self.log_message("Requesting inbox")
+        if self._send(data.encode()) is False:
+            self.log_message("Error: Failed to send data to server.", level=logging.WARNING)
+            return None
+        response = self._recv()
+        if response is None:
+            self.log_message("Error: Received None from server.", level=logging.WARNING)
+            return None
+        response = json.loads(response.decode())
+        if not isinstance(response, list):
+            self.log_message("Error: Response is not a list.", level=logging.WARNING)
+            return None
+        return response
+
+    def search(self, query, chat_name=None, before=None):
+        """Messages containing every word of the query, newest first: {"hits": [...], "more": bool}.
+
+        Only chats the user can read are searched (or just chat_name). Pass the id of the last hit as
+        `before` to get the next page.
+        """
+        request = {"command": "search", "user": self.username, "query": query}
+        if chat_name is not None:
+            request["chat"] = chat_name
+        if before is not None:
+            request["before"] = before
+        self.log_message("Searching for: %s", query)
+        if self._send(json.dumps(request).encode()) is False:
+            self.log_message("Error: Failed to send data to server.", level=logging.WARNING)
+            return None
+        response = self._recv()
+        if response is None:
+            self.log_message("Error: Received None from server.", level=logging.WARNING)
+            return None
+        response = json.loads(response.decode())
+        if not isinstance(response, dict) or not isinstance(response.get("hits"), list):
+            self.log_message("Error: Unexpected search response.", level=logging.WARNING)
             return None
         return response
+
+    def fetch_offline(self):
+        """Direct messages sent to us while we were offline, oldest first, each with the chat it was sent to.
+
+        The server sends them a window of replies at a time; each request acknowledges what the previous
+        window delivered, so the server can forget it. None on errors (what was not acknowledged yet is
+        sent again on the next call).
+        """
+        messages, cursor = [], 0
+        while True:
+            data = json.dumps({"command": "offline", "user": self.username, "ack": cursor})
+            self.log_message("Fetching offline messages after #%s", cursor)
+            if self._send(data.encode()) is False:
+                self.log_message("Error: Failed to send data to server.", level=logging.WARNING)
+                return None
+            response = self._recv()
+            while True:
+                if response is None:
+                    self.log_message("Error: Received None from server.", level=logging.WARNING)
+                    return None
+                response = json.loads(response.decode())
+                if not isinstance(response, dict) or not isinstance(response.get("messages"), list):
+                    self.log_message("Error: Unexpected offline messages response.", level=logging.WARNING)
+                    return None
+                messages.extend(response["messages"])
+                if response["window_end"]:
+                    break
+                response = self.socket.recv()
+
+            if not response["messages"]:
+                # Nothing left past what we acknowledged with this request
+                return messages
+            cursor = response["messages"][-1]["number"]
+
+    def cached_messages(self, chat_name):
+        """The history of the chat as far as it was synced, without touching the network"""
+        return self.cache.get(chat_name)
+
+    def send_file(self, path):
+        try:
+            size = os.path.getsize(path)
+            sha256 = file_transfer.file_digest(path)
+        except OSError as e:
+            self.log_message("Error: Cannot read %s: %s", path, e, level=logging.WARNING)
+            return False
+
+        name = os.path.basename(path)
+        data = json.dumps({"command": "send_file", "user": self.username, "name": name, "size": size,
+                           "sha256": sha256, "chunk_size": file_transfer.FILE_CHUNK_SIZE})
+        self.log_message("Sending file: %s (%s bytes)", name, size)
+        offset = None
+        while True:
+            # Every pass starts with the metadata: the server answers where to resume from
+            if self._send(data.encode()) is False:
+                self.log_message("Error: Failed to start upload of %s.", name, level=logging.WARNING)
+                return False
+
+            response = self._recv()
+            if response is None:
+                self.log_message("Error: Received None from server.", level=logging.WARNING)
+                return False
+            response = json.loads(response.decode())
+            if not isinstance(response, dict) or response.get("busy"):
+                self.log_message("Error: Server refused upload of %s.", name, level=logging.WARNING)
+                return False
+            if "ok" in response:
+                return response["ok"] is True
+
+            if offset is not None and response["offset"] <= offset:
+                self.log_message("Error: Upload of %s is not progressing, giving up.", name, level=logging.WARNING)
+                return False
+            offset = response["offset"]
+            if offset:
+                self.log_message("Resuming %s from chunk %s", name, offset)
+
+            for batch in file_transfer.iter_chunk_batches(path, offset):
+                if self.socket.send_window(batch) is False:
+                    self.log_message("Error: Upload of %s interrupted, it will resume from where it stopped.", name, level=logging.WARNING)
+                    return False
+
+            response = self._recv()
+            if response is None:
+                self.log_message("Error: Received None from server.", level=logging.WARNING)
+                return False
+            response = json.loads(response.decode())
+            if isinstance(response, dict) and "resend" in response:
+                # A chunk arrived damaged: the next pass resumes from it
+                self.log_message("Server asked to resend %s from chunk %s", name, response["resend"])
+                continue
+            if not isinstance(response, dict) or response.get("ok") is not True:
+                self.log_message("Error: Integrity check of %s failed.", name, level=logging.WARNING)
+                return False
+            return True
@@ -0,0 +1,103 @@
+import time
+import sqlite3
+import threading
+
+# Limits of the local cache; least recently opened chats are evicted first
+MAX_CACHE_BYTES = 5 * 1024 * 1024
+MAX_CACHED_CHATS = 50
+
+class MessageCache:
+    """Chat histories kept in a local sqlite file, so they survive restarts and only new messages are fetched.
+
+    Each chat remembers the highest message id it holds (its high-water mark) and the server epoch those
+    ids belong to. The cache may be read from the UI thread while the network worker writes to it.
+    """
+    def __init__(self, path, max_bytes=MAX_CACHE_BYTES, max_chats=MAX_CACHED_CHATS):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_chats = max_chats
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS chats (
+                chat TEXT PRIMARY KEY,
+                epoch TEXT,
+                high_water INTEGER NOT NULL DEFAULT 0,
+                bytes INTEGER NOT NULL DEFAULT 0,
+                last_used REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS messages (
+                chat TEXT NOT NULL,
+                id INTEGER NOT NULL,
+                sender TEXT,
+                content TEXT,
+                timestamp TEXT,
+                PRIMARY KEY (chat, id)
+            );
+        """)
+        self.db.commit()
+
+    def high_water(self, chat):
+        """(epoch, highest message id) cached for the chat, or (None, 0) if nothing is cached"""
+        with self.lock:
+            row = self.db.execute("SELECT epoch, high_water FROM chats WHERE chat = ?", (chat,)).fetchone()
+        return row if row else (None, 0)
+
+    def get(self, chat):
+        """The cached history of the chat, oldest first"""
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT id, sender, content, timestamp FROM messages WHERE chat = ? ORDER BY id", (chat,)
+            ).fetchall()
+            self.db.execute("UPDATE chats SET last_used = ? WHERE chat = ?", (time.time(), chat))
+            self.db.commit()
+        return [{"id": id, "sender": sender, "content": content, "timestamp": timestamp}
+                for id, sender, content, timestamp in rows]
+
+    def store(self, chat, epoch, messages):
+        """Add messages fetched from the server. Messages from another epoch replace the cached ones"""
+        with self.lock:
+            row = self.db.execute("SELECT epoch, high_water, bytes FROM chats WHERE chat = ?", (chat,)).fetchone()
+            if row is None or row[0] != epoch:
+                self.db.execute("DELETE FROM messages WHERE chat = ?", (chat,))
+                high_water, size = 0, 0
+            else:
+                high_water, size = row[1], row[2]
+
+            for message in messages:
+                inserted = self.db.execute(
+                    "INSERT OR IGNORE INTO messages (chat, id, sender, content, timestamp) VALUES (?, ?, ?, ?, ?)",
+                    (chat, message["id"], message.get("sender"), message.get("content"), message.get("timestamp")),
+                ).rowcount
+                if inserted:
+                    size += self._message_size(message)
+                high_water = max(high_water, message["id"])
+
+            self.db.execute(
+                "INSERT OR REPLACE INTO chats (chat, epoch, high_water, bytes, last_used) VALUES (?, ?, ?, ?, ?)",
+                (chat, epoch, high_water, size, time.time()),
+            )
+            self._evict(keep=chat)
+            self.db.commit()
+
+    def _evict(self, keep):
+        """Drop least recently used chats until the cache fits its limits (never the chat being stored)"""
+        while True:
+            count, total = self.db.execute("SELECT COUNT(*), COALESCE(SUM(bytes), 0) FROM chats").fetchone()
+            if count <= self.max_chats and total <= self.max_bytes:
+                return
+            row = self.db.execute(
+                "SELECT chat FROM chats WHERE chat != ? ORDER BY last_used LIMIT 1", (keep,)
+            ).fetchone()
+            if row is None:
+                return
+            self.db.execute("DELETE FROM messages WHERE chat = ?", row)
+            self.db.execute("DELETE FROM chats WHERE chat = ?", row)
+
+    @staticmethod
+    def _message_size(message):
+        return sum(len(str(message.get(field) or "")) for field in ("sender", "content", "timestamp"))
+
+    def close(self):
+        with self.lock:
+            self.db.close()
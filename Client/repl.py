@@ -13,7 +13,11 @@ def print_help():
   list friends                     - List your friends
   list mygroups                    - List groups you're in
   list groups                      - List all available groups
+  list online                      - List users that are online now
   list messages <chatname>         - List messages from a chat
+  inbox                            - Show unread messages in all your chats
+  search <words>                   - Search messages in your chats
+  search more                      - Show older results of the last search
   follow <username>                - Follow a user
   unfollow <username>              - Unfollow a user
   create_group <groupname>         - Create a new group
@@ -21,8 +25,10 @@ def print_help():
   join <groupname> <key>           - Join a group with a key
   leave <groupname>                - Leave a group
   ban <username>                   - Ban a user from your groups
+  stats                            - Show server metrics (admin only)
   chat_group <groupname> <key> <message>  - Send message to group
   chat_friend <friendname> <message>      - Send message to friend
+  send_file <path>                 - Upload a file to the server
   exit                             - Exit the client
   help                             - Show this help message
 """
@@ -49,6 +55,16 @@ def print_messages(messages):
         
         print(f"{PURPLE}[{timestamp}] {sender}:{RESET} {content}")
 
+# exibe os resultados de uma busca, cada um com o chat de onde veio.
+def print_search_hits(hits):
+    if not hits:
+        print(f"{PURPLE}No messages found{RESET}")
+        return
+    
+    for hit in hits:
+        timestamp = format_timestamp(hit.get('timestamp', ''))
+        print(f"{PURPLE}[{timestamp}] {hit.get('chat', '?')} / {hit.get('sender', 'unknown')}:{RESET} {hit.get('content', '')}")
+
 # exibe uma lista de itens com título e mensagem de vazio, se necessário. Serve pra listas de usuários, grupos, etc.
 def print_list(items, title, empty_message="No items found"):
     if not items:
@@ -73,6 +89,30 @@ def print_list(items, title, empty_message="No items found"):
         for i, item in enumerate(items, 1):
             print(f"  {i}. {item}")
 
+# mostra as métricas do servidor: contadores e gauges com o valor, histogramas com contagem e média.
+def print_stats(metrics):
+    print(f"\n{PURPLE}Server metrics:{RESET}")
+    for name, values in sorted(metrics.items()):
+        for labels, value in sorted(values.items()):
+            if isinstance(value, dict):
+                mean = value["sum"] / value["count"] * 1000 if value["count"] else 0
+                value = f"count={value['count']} mean={mean:.2f}ms"
+            print(f"  {name}{labels}: {value}")
+    print()
+
+# mostra o inbox: cada chat com quantas mensagens não lidas tem e o começo da última mensagem.
+def print_inbox(chats):
+    if not chats:
+        print(f"{PURPLE}No chats yet{RESET}")
+        return
+    
+    print(f"{PURPLE}Inbox:{RESET}")
+    for chat in chats:
+        unread = f" ({chat['unread']} unread)" if chat['unread'] else ""
+        last = chat.get('last')
+        preview = f"{last['sender']}: {last['content']}" if last else "no messages"
+        print(f"  {chat['chat']}{unread} - {preview}")
+
 # Mostra uma mensagem de sucesso com um check verde.
 def print_success(message):
     print(f"{PURPLE}✓ {message}{RESET}")
@@ -95,11 +135,22 @@ def main():
         return
     
     print_success(f"Logged in as {username}. Type 'help' for commands.")
+    # Mensagens diretas recebidas enquanto estávamos offline
+    missed = client.fetch_offline()
+    if missed:
+        print_info(f"{len(missed)} message(s) while you were offline:")
+        print_search_hits(missed)
+    last_search = None  # (query, id of the last hit shown) for "search more"
     
     try:
         while True:
             try:
                 input_line = input(f"{PURPLE}> {RESET}").strip()
+                # Presence changes pushed by the server while we were waiting for input
+                for event in client.poll_events():
+                    if event.get("event") == "presence":
+                        print_info(f"{event['user']} is now {'online' if event['online'] else 'offline'}.")
+                
                 if not input_line:
                     continue
                 
@@ -116,7 +167,7 @@ def main():
                 
                 elif command == "list":
                     if len(tokens) < 2:
-                        print_error("Invalid list command. Usage: list [cinners|friends|mygroups|groups|messages <chatname>]")
+                        print_error("Invalid list command. Usage: list [cinners|friends|mygroups|groups|online|messages <chatname>]")
                         continue
                     
                     subcmd = tokens[1].lower()
@@ -148,20 +199,52 @@ def main():
                         else:
                             print_error("Failed to retrieve group list.")
                     
+                    elif subcmd == "online":
+                        users = client.list_online()
+                        if users is not None:
+                            print_list(users, "Online users", "Nobody is online")
+                        else:
+                            print_error("Failed to retrieve online users.")
+                    
                     elif subcmd == "messages":
                         if len(tokens) < 3:
                             print_error("Usage: list messages <chatname>")
                             continue
                         chat_name = tokens[2]
-                        messages = client.list_messages(chat_name)
-                        if messages is not None:
-                            print_messages(messages)
+                        # Only messages newer than the local cache are downloaded
+                        if client.sync_messages(chat_name) is not None:
+                            print_messages(client.cached_messages(chat_name))
                         else:
                             print_error(f"Failed to retrieve messages for {chat_name}.")
                     
                     else:
                         print_error("Unknown list subcommand. Use 'help' for available commands.")
                 
+                elif command == "inbox":
+                    chats = client.inbox()
+                    if chats is not None:
+                        print_inbox(chats)
+                    else:
+                        print_error("Failed to retrieve inbox.")
+                
+                elif command == "search":
+                    if len(tokens) < 2:
+                        print_error("Usage: search <words> | search more")
+                        continue
+                    if tokens[1:] == ["more"] and last_search:
+                        query, before = last_search
+                    else:
+                        query, before = " ".join(tokens[1:]), None
+                    result = client.search(query, before=before)
+                    if result is None:
+                        print_error("Search failed.")
+                        continue
+                    print_search_hits(result["hits"])
+                    last_search = None
+                    if result["more"] and result["hits"]:
+                        last_search = (query, result["hits"][-1]["id"])
+                        print_info("Older results available: type 'search more'.")
+                
                 elif command == "follow":
                     if len(tokens) < 2:
                         print_error("Usage: follow <username>")
@@ -240,6 +323,13 @@ def main():
                     else:
                         print_error(f"Failed to ban {user}.")
                 
+                elif command == "stats":
+                    metrics = client.stats()
+                    if metrics is not None:
+                        print_stats(metrics)
+                    else:
+                        print_error("Failed to retrieve server metrics (admin only).")
+                
                 elif command == "chat_group":
                     if len(tokens) < 4:
                         print_error("Usage: chat_group <groupname> <key> <message>")
@@ -265,6 +355,17 @@ def main():
                     else:
                         print_error(f"Failed to send message to {friend}.")
                 
+                elif command == "send_file":
+                    if len(tokens) < 2:
+                        print_error("Usage: send_file <path>")
+                        continue
+                    path = " ".join(tokens[1:])
+                    success = client.send_file(path)
+                    if success:
+                        print_success(f"File {path} sent.")
+                    else:
+                        print_error(f"Failed to send file {path}.")
+                
                 elif command == "exit":
                     client.logout()
                     print_info("Goodbye!")
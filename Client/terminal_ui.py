@@ -13,6 +13,18 @@ import curses
 from enum import Enum, auto
 import time
 from .client import Client  # Import the Client class
+from .worker import ClientWorker
+
+# How long getch waits for a key before the loop checks for network results (ms)
+UI_TICK_MS = 100
+
+# How often menus and the open chat are fetched again (seconds)
+MENU_REFRESH_INTERVAL = 5
+CHAT_POLL_INTERVAL = 2
+EVENT_POLL_INTERVAL = 1
+
+# How long to wait for the logout to be sent when quitting (seconds)
+LOGOUT_TIMEOUT = 5
 
 # Define application states as an enum
 class AppMode(Enum):
@@ -28,20 +40,137 @@ class AppState:
         self.selected_content = "Welcome"  # Start with welcome screen
         self.current_topic = ""  # Track the current selected topic/item
         self.client = None
+        self.worker = None  # Background thread running every client call
+        self.online = set()  # Users known to be online, from list:online and presence events
         self.chat_histories = {}  # Store chat histories by chat name
         self.current_chat_type = None  # "friend" or "group"
         self.refresh_needed = False
 
+# Jobs run by the worker thread
+def login_client(username):
+    """Connect and log in, returning the Client or None if the login failed"""
+    client = Client(username)
+    return client if client.login() is not False else None
+
+def fetch_menus(client):
+    """The lists shown in the menus, or None if any request failed"""
+    lists = {
+        "friends": client.list_friends(),
+        "mygroups": client.list_mygroups(),
+        "cinners": client.list_cinners(),
+        "groups": client.list_groups(),
+        "online": client.list_online(),
+    }
+    return None if None in lists.values() else lists
+
+# Virtual scrollback for the chat pane
+class Scrollback:
+    """Formatted chat lines for one conversation, appended incrementally and viewed through a window.
+    
+    Histories grow in place as new messages are synced, so only the messages past the ones already seen
+    are formatted; a history replaced by another list starts over. Drawing reads a slice of `height`
+    lines, whatever the size of the history.
+    """
+    def __init__(self):
+        self.topic = None
+        self.source = None  # The history list being followed
+        self.lines = []
+        self.message_count = 0
+        self.offset = 0  # Lines scrolled up from the bottom
+    
+    def sync(self, topic, messages):
+        """Bring the buffer up to date with the history of `topic`; returns True if anything changed"""
+        if topic != self.topic or messages is not self.source or len(messages) < self.message_count:
+            self.topic = topic
+            self.source = messages
+            self.lines = []
+            self.message_count = 0
+            self.offset = 0
+        elif len(messages) == self.message_count:
+            return False
+        
+        for message in messages[self.message_count:]:
+            self.lines.append(self.format(message))
+        self.message_count = len(messages)
+        return True
+    
+    @staticmethod
+    def format(message):
+        if isinstance(message, dict):
+            # Format message from server response
+            sender = message.get("sender", "Unknown")
+            content = message.get("content", "")
+            timestamp = message.get("timestamp", "")
+            return f"{timestamp} - {sender}: {content}"
+        # Format simple string message (like errors)
+        return str(message)
+    
+    def scroll(self, amount, height):
+        """Scroll up (positive) or down (negative), clamped to the history; returns True if the view moved"""
+        offset = min(max(self.offset + amount, 0), max(len(self.lines) - height, 0))
+        moved = offset != self.offset
+        self.offset = offset
+        return moved
+    
+    def visible(self, height):
+        """The lines currently in view, oldest first"""
+        end = len(self.lines) - self.offset
+        return self.lines[max(end - height, 0):end]
+
 # Base UI component class
 class UIComponent:
     def __init__(self, app_state, title):
         self.state = app_state
         self.title = title
         self.window = None
+        self.dirty = True  # Whole window must be repainted (first draw, resize, uncovered)
+        self.drawn_lines = {}  # Row -> what was painted there, to skip rows that did not change
     
     def draw(self, stdscr):
         pass
     
+    def invalidate(self):
+        """Force a full repaint on the next draw"""
+        self.dirty = True
+    
+    def begin_draw(self):
+        """Start a frame: erase the window only if it was invalidated. Returns True on full repaints"""
+        if not self.dirty:
+            return False
+        self.window.erase()
+        self.window.border()
+        self.drawn_lines = {}
+        self.dirty = False
+        return True
+    
+    def end_draw(self):
+        """Queue the window for the next curses.doupdate() instead of refreshing it on its own"""
+        self.window.noutrefresh()
+    
+    def draw_line(self, y, x, *segments):
+        """Paint a row from (text, attr) segments, padded up to the right border.
+        
+        Rows identical to what was painted last frame are skipped. Returns True if the row was painted.
+        """
+        if self.drawn_lines.get(y) == (x, segments):
+            return False
+        end = self.width - 1  # Keep the right border intact
+        col = x
+        for text, attr in segments:
+            text = text[:max(end - col, 0)]
+            if text:
+                self.window.addstr(y, col, text, attr)
+                col += len(text)
+        if col < end:
+            self.window.addstr(y, col, " " * (end - col))
+        self.drawn_lines[y] = (x, segments)
+        return True
+    
+    def draw_centered(self, y, text, attr=0):
+        """Paint a row with `text` centered horizontally"""
+        padding = max((self.width - len(text)) // 2 - 1, 0)
+        return self.draw_line(y, 1, (" " * padding, 0), (text, attr))
+    
     def handle_input(self, key):
         if key in (curses.KEY_LEFT, 27):
             self.state.mode = AppMode.NAVIGATION
@@ -54,6 +183,7 @@ class UIComponent:
         self.height = height
         self.window = curses.newwin(self.height, self.width, self.y, self.x)
         self.window.keypad(True)
+        self.invalidate()
 
 # Menu component
 class MenuComponent(UIComponent):
@@ -65,31 +195,46 @@ class MenuComponent(UIComponent):
         self.previous_menu_idx = {title: 0}  # Track previous indices for each menu locally
         self.prev_selected_item = None  # Track previously selected item
         self.last_refresh = 0  # Track when we last refreshed menu data
+        self.drawn_title = None
     
     def draw(self, colors):
         # Try to refresh menus before drawing
         self.refresh_menus()
         
-        self.window.clear()
-        self.window.border()
-        self.window.addstr(0, 2, f" {self.title} ", colors.CYAN_BLACK)  # Use title property
+        # The title sits on the border, so a new title needs the frame repainted
+        if self.title != self.drawn_title:
+            self.invalidate()
+        if self.begin_draw():
+            self.window.addstr(0, 2, f" {self.title} ", colors.CYAN_BLACK)  # Use title property
+            self.drawn_title = self.title
         
         current_menu_items = self.menu_structure[self.title]
-        for idx, item in enumerate(current_menu_items):
-            y = idx + 2
-            if idx == self.selected_menu_idx:
-                self.window.addstr(y, 2, "> ", colors.CYAN_BLACK)
-                self.window.addstr(y, 4, item, colors.WHITE_BLACK)
-                
-                # Update content preview on hover
-                selected_item = current_menu_items[self.selected_menu_idx]
-                if selected_item != self.prev_selected_item:
-                    self.prev_selected_item = selected_item
-                    self.update_content_preview(selected_item)
+        
+        # Update content preview on hover
+        if self.selected_menu_idx < len(current_menu_items):
+            selected_item = current_menu_items[self.selected_menu_idx]
+            if selected_item != self.prev_selected_item:
+                self.prev_selected_item = selected_item
+                self.update_content_preview(selected_item)
+        
+        # Only the rows that fit are drawn, scrolled so the selection stays visible
+        rows = self.height - 3
+        top = max(self.selected_menu_idx - rows + 1, 0)
+        for row in range(rows):
+            idx = top + row
+            y = row + 2
+            if idx >= len(current_menu_items):
+                self.draw_line(y, 2)
             else:
-                self.window.addstr(y, 2, f"  {item}")
+                item = current_menu_items[idx]
+                # Friends that are online get a marker
+                marker = (" ●", colors.CYAN_BLACK) if self.title == "Amigos" and item in self.state.online else ("", 0)
+                if idx == self.selected_menu_idx:
+                    self.draw_line(y, 2, ("> ", colors.CYAN_BLACK), (item, colors.WHITE_BLACK), marker)
+                else:
+                    self.draw_line(y, 2, (f"  {item}", 0), marker)
         
-        self.window.refresh()
+        self.end_draw()
     
     def update_content_preview(self, selected_item):
         """Update the content preview based on the currently hovered item"""
@@ -164,58 +309,55 @@ class MenuComponent(UIComponent):
         if self.title == "Descobrir.Usuários" and key == ord('a'):  # 'a' for add friend
             if self.selected_menu_idx < len(current_menu_items):
                 selected_user = current_menu_items[self.selected_menu_idx]
-                try:
-                    self.state.client.follow(selected_user)
-                    self.state.messages.append(f"Added {selected_user} as friend")
-                    self.last_refresh = 0  # Force refresh
-                except Exception as e:
-                    self.state.messages.append(f"Error adding friend: {str(e)}")
+                self.state.worker.submit("follow", self.state.client.follow, selected_user)
         
         elif self.title == "Descobrir.Grupos" and key == ord('j'):  # 'j' for join group
             if self.selected_menu_idx < len(current_menu_items):
                 selected_group = current_menu_items[self.selected_menu_idx]
-                try:
-                    # For simplicity, using group name as key
-                    self.state.client.join_group(selected_group, selected_group)
-                    self.state.messages.append(f"Joined group {selected_group}")
-                    self.last_refresh = 0  # Force refresh
-                except Exception as e:
-                    self.state.messages.append(f"Error joining group: {str(e)}")
+                # For simplicity, using group name as key
+                self.state.worker.submit("join", self.state.client.join_group, selected_group, selected_group)
         
         return False
     
     def refresh_menus(self):
-        """Update menu items from the server"""
-        if not self.state.client or time.time() - self.last_refresh < 5:  # Only refresh every 5 seconds
+        """Ask the worker for fresh menu items; they are applied by apply_menus when they arrive"""
+        if not self.state.client or time.time() - self.last_refresh < MENU_REFRESH_INTERVAL:
             return
-            
-        try:
-            # Update friends list
-            friends = self.state.client.list_friends()
-            self.menu_structure["Amigos"] = friends if friends else ["Nenhum amigo ainda"]
-            
-            # Update groups list
-            mygroups = self.state.client.list_mygroups()
-            self.menu_structure["Grupos"] = mygroups if mygroups else ["Nenhum grupo ainda"]
-            
-            # Update available users and groups
-            all_users = self.state.client.list_cinners()
-            self.menu_structure["Descobrir.Usuários"] = [u for u in all_users if u not in friends]
-            
-            all_groups = self.state.client.list_groups()
-            self.menu_structure["Descobrir.Grupos"] = [g for g in all_groups if g not in mygroups]
-            
-            # Update content mappings
-            for friend in friends:
-                self.content_mapping[friend] = "Chat"
-            
-            for group in mygroups:
-                self.content_mapping[group] = "Chat"
-                
-            self.last_refresh = time.time()
-        except Exception:
-            # Handle errors gracefully
-            pass
+        if self.state.worker.busy("menus"):
+            return
+        
+        self.state.worker.submit("menus", fetch_menus, self.state.client)
+        self.last_refresh = time.time()
+    
+    def apply_menus(self, lists):
+        """Update menu items from the lists fetched by the worker"""
+        friends = lists["friends"]
+        # Groups come as dicts (name, owner, members...); menus and chats go by the name
+        mygroups = [group["name"] for group in lists["mygroups"]]
+        
+        # Update friends list
+        self.menu_structure["Amigos"] = friends if friends else ["Nenhum amigo ainda"]
+        
+        # Update groups list
+        self.menu_structure["Grupos"] = mygroups if mygroups else ["Nenhum grupo ainda"]
+        
+        # Update available users and groups
+        self.menu_structure["Descobrir.Usuários"] = [u for u in lists["cinners"] if u not in friends]
+        self.menu_structure["Descobrir.Grupos"] = [g["name"] for g in lists["groups"] if g["name"] not in mygroups]
+        
+        # Presence events keep this up to date between refreshes
+        self.state.online = set(lists["online"])
+        
+        # Update content mappings
+        for friend in friends:
+            self.content_mapping[friend] = "Chat"
+        
+        for group in mygroups:
+            self.content_mapping[group] = "Chat"
+        
+        # Keep the selection inside the (possibly shorter) list
+        items = self.menu_structure[self.title]
+        self.selected_menu_idx = min(self.selected_menu_idx, max(len(items) - 1, 0))
 
 # Content component
 class ContentChatComponent(UIComponent):
@@ -224,87 +366,93 @@ class ContentChatComponent(UIComponent):
         self.is_typing = False  # Internal flag for typing mode
         self.cursor_pos = 0     # Cursor position in text input
         self.input_text = " "   # Always reset to a single space
+        self.scrollback = Scrollback()
+        self.drawn_title = None
+        self.last_poll = 0  # When the open chat was last requested
+        self.on_idle = None  # Called while the user types, to apply network results and redraw (set by ChatApp)
     
     def draw(self, colors):
-        self.window.clear()
-        self.window.border()
-        
         # Display title with current topic if available
         title = f" {self.title}"
         if hasattr(self.state, 'current_topic') and self.state.current_topic:
             title += f": {self.state.current_topic}"
         
-        self.window.addstr(0, 2, title, colors.CYAN_BLACK)
-        
-        # Load messages if needed
-        if self.state.refresh_needed and self.state.current_topic:
-            try:
-                messages = self.state.client.list_messages(self.state.current_topic)
-                self.state.chat_histories[self.state.current_topic] = messages
+        if title != self.drawn_title:
+            self.invalidate()
+        if self.begin_draw():
+            self.window.addstr(0, 2, title, colors.CYAN_BLACK)
+            self.drawn_title = title
+        
+        # Show the locally cached history right away, then sync what is new since it (and periodically,
+        # to see new messages); synced messages are drawn when they arrive
+        topic = self.state.current_topic
+        if topic and self.state.client:
+            if topic not in self.state.chat_histories:
+                self.state.chat_histories[topic] = self.state.client.cached_messages(topic)
+            if self.state.refresh_needed or time.time() - self.last_poll > CHAT_POLL_INTERVAL:
+                self.state.worker.submit("messages", self.state.client.sync_messages, topic)
                 self.state.refresh_needed = False
-            except Exception as e:
-                self.state.messages.append(f"Error loading messages: {str(e)}")
-        
-        # Draw messages from chat history
-        chat_messages = self.state.chat_histories.get(self.state.current_topic, [])
-        display_messages = chat_messages[-(self.height - 4):] if chat_messages else ["No messages yet"]
-        
-        for idx, message in enumerate(display_messages):
-            if isinstance(message, dict):
-                # Format message from server response
-                sender = message.get("sender", "Unknown")
-                content = message.get("content", "")
-                timestamp = message.get("timestamp", "")
-                formatted_msg = f"{timestamp} - {sender}: {content}"
-                self.window.addstr(idx + 1, 2, formatted_msg[:self.width - 4])
-            else:
-                # Format simple string message (like errors)
-                self.window.addstr(idx + 1, 2, message[:self.width - 4])
+                self.last_poll = time.time()
+        
+        # Draw messages from chat history, only the rows in view and only those that changed
+        chat_messages = self.state.chat_histories.get(topic, [])
+        self.scrollback.sync(topic, chat_messages)
+        rows = self.height - 4
+        if chat_messages:
+            display_lines = self.scrollback.visible(rows)
+        elif self.state.worker and self.state.worker.busy("messages"):
+            display_lines = ["Loading..."]
+        else:
+            display_lines = ["No messages yet"]
+        
+        for row in range(rows):
+            line = display_lines[row] if row < len(display_lines) else ""
+            self.draw_line(row + 1, 2, (line, 0))
         
         input_box_y = self.height - 2
         # Draw a bar dividing user input 
-        self.window.addstr(input_box_y - 1, 2, "-" * (self.width - 4))
-
+        self.draw_line(input_box_y - 1, 2, ("-" * (self.width - 4), 0))
+        
         # Always show the input prompt
         if self.state.mode == AppMode.NAVIGATION:
-            self.window.addstr(input_box_y, 2, "> ", colors.WHITE_BLACK)
+            self.draw_line(input_box_y, 2, ("> ", colors.WHITE_BLACK))
         elif self.state.mode == AppMode.CONTENT:
-            self.window.addstr(input_box_y, 2, "> ", colors.CYAN_BLACK)
             if not self.is_typing:
                 # When in content mode but not typing, show a highlight
-                self.window.addstr(input_box_y, 4, " ", colors.BLACK_WHITE)
+                self.draw_line(input_box_y, 2, ("> ", colors.CYAN_BLACK), (" ", colors.BLACK_WHITE))
+            # While typing, the input row is handle_text_input's
         
-        self.window.refresh()
+        self.end_draw()
         return self.window
     
     def handle_input(self, key):
         if self.state.mode == AppMode.CONTENT:
             if key in (27,curses.KEY_LEFT):  # ESC or Left arrow to exit content mode
                 self.state.mode = AppMode.NAVIGATION
+            elif key in (curses.KEY_UP, curses.KEY_DOWN, curses.KEY_PPAGE, curses.KEY_NPAGE):
+                # Scroll through the history; a page is the height of the message area
+                rows = self.height - 4
+                amount = {curses.KEY_UP: 1, curses.KEY_DOWN: -1, curses.KEY_PPAGE: rows, curses.KEY_NPAGE: -rows}[key]
+                self.scrollback.scroll(amount, rows)
             elif key == ord('\n'):  # Enter to start typing
                 self.is_typing = True
                 self.input_text = ""
-
+                
                 if self.handle_text_input():
                     if self.input_text.strip():
-                        # Send message based on current chat type
-                        try:
-                            if self.state.current_chat_type == "friend":
-                                self.state.client.chat_friend(self.state.current_topic, self.input_text)
-                            elif self.state.current_chat_type == "group":
-                                # For simplicity, assuming key is the group name
-                                self.state.client.chat_group(self.state.current_topic, self.state.current_topic, self.input_text)
-                            
-                            # Refresh messages after sending
-                            time.sleep(0.2)  # Give server time to process
-                            self.state.refresh_needed = True
-                        except Exception as e:
-                            self.state.messages.append(f"Error sending message: {str(e)}")
+                        # Send message based on current chat type; the chat is refreshed once it was sent
+                        if self.state.current_chat_type == "friend":
+                            self.state.worker.submit("send", self.state.client.chat_friend, self.state.current_topic, self.input_text)
+                        elif self.state.current_chat_type == "group":
+                            # For simplicity, assuming key is the group name
+                            self.state.worker.submit("send", self.state.client.chat_group, self.state.current_topic, self.state.current_topic, self.input_text)
                     
                     # Always reset input text after sending
                     self.input_text = ""
                 
                 self.is_typing = False
+                # The input row was painted outside of draw_line
+                self.drawn_lines.pop(self.height - 2, None)
         return False
     
     def handle_text_input(self):
@@ -315,18 +463,28 @@ class ContentChatComponent(UIComponent):
         max_width = self.width - 6  # Account for borders and prompt
         
         curses.curs_set(1)
+        # As in the main loop, getch returns -1 after UI_TICK_MS without a key: results that arrived
+        # meanwhile (messages, presence) are applied and drawn while the user types
+        self.window.timeout(UI_TICK_MS)
         self._draw_input_line(input_box_y, input_text, cursor_pos)
         
         while True:
             try:
                 key = self.window.getch()
                 
-                if key == 27:  
+                if key == -1:
+                    if self.on_idle is not None:
+                        self.on_idle()
+                    # Puts the cursor back on the input row after the redraw
+                    self._draw_input_line(input_box_y, input_text, cursor_pos)
+                    continue
+                
+                elif key == 27:  
                     curses.curs_set(0)
                     cursor_pos = 0
                     self.input_text = input_text
                     return False
-                    
+                
                 elif key == ord('\n'): 
                     curses.curs_set(0)
                     cursor_pos = 0
@@ -335,34 +493,34 @@ class ContentChatComponent(UIComponent):
                 
                 elif key == curses.KEY_LEFT and cursor_pos > 0:
                     cursor_pos -= 1
-                    
+                
                 elif key == curses.KEY_RIGHT and cursor_pos < len(input_text):
                     cursor_pos += 1
-                    
+                
                 elif key in (curses.KEY_BACKSPACE, 8, 127):  # Backspace
                     if cursor_pos > 0:
                         input_text = input_text[:cursor_pos-1] + input_text[cursor_pos:]
                         cursor_pos -= 1
-                        
+                
                 elif key == curses.KEY_DC:  # Delete
                     if cursor_pos < len(input_text):
                         input_text = input_text[:cursor_pos] + input_text[cursor_pos+1:]
-                        
+                
                 elif 32 <= key <= 126:  # Printable characters
                     if len(input_text) < max_width:
                         input_text = input_text[:cursor_pos] + chr(key) + input_text[cursor_pos:]
                         cursor_pos += 1
                 
                 self._draw_input_line(input_box_y, input_text, cursor_pos)
-                
+            
             except curses.error:
                 curses.curs_set(0)
                 return False
     
     def _draw_input_line(self, y, text, cursor_pos):
         max_visible = self.width - 8
-        self.window.move(y, 2)
-        self.window.clrtoeol()
+        # Blank the row up to the border (clrtoeol would also erase the border)
+        self.window.addstr(y, 2, " " * (self.width - 3))
         self.window.addstr(y, 2, "> ")
         
         if len(text) > max_visible:
@@ -382,17 +540,20 @@ class ContentChatComponent(UIComponent):
         else:
             self.window.addstr(y, 4, text)
             self.window.move(y, 4 + cursor_pos)
-            
-        self.window.refresh()
+        
+        self.window.noutrefresh()
+        curses.doupdate()
 
 # Welcome component
 class WelcomeComponent(UIComponent):
     def resize(self, x, y, width, height):
         super().resize(x, y, width, height)
-
+    
     def draw(self, colors):
-        self.window.clear()
-        self.window.border()
+        # Static screen: only painted after being invalidated
+        if not self.begin_draw():
+            return self.window
+        
         # Display a proper welcome message with commands
         self.window.addstr(0, 2, " Welcome ", colors.CYAN_BLACK | curses.A_BOLD)
         
@@ -414,7 +575,7 @@ class WelcomeComponent(UIComponent):
             x = (self.width - len(line)) // 2  # Center the text horizontally
             self.window.addstr(start_y + idx, x, line)
         
-        self.window.refresh()
+        self.end_draw()
         return self.window
 
 # Login component
@@ -423,63 +584,52 @@ class LoginComponent(UIComponent):
         super().__init__(app_state, title)
         self.username = ""
         self.error_message = ""
-        
+    
     def draw(self, colors):
-        self.window.clear()
-        self.window.border()
-        self.window.addstr(0, 2, " Login ", colors.CYAN_BLACK | curses.A_BOLD)
-        
         center_y = self.height // 2
-        prompt_text = "Enter your username: "
-        self.window.addstr(center_y - 2, (self.width - len(prompt_text)) // 2, prompt_text)
-        
-        # Draw input box
         box_width = 30
         box_x = (self.width - box_width) // 2
-        self.window.addstr(center_y, box_x - 1, "┌" + "─" * box_width + "┐")
-        self.window.addstr(center_y + 1, box_x - 1, "│")
+        
+        if self.begin_draw():
+            self.window.addstr(0, 2, " Login ", colors.CYAN_BLACK | curses.A_BOLD)
+            
+            prompt_text = "Enter your username: "
+            self.window.addstr(center_y - 2, (self.width - len(prompt_text)) // 2, prompt_text)
+            
+            # Draw input box
+            self.window.addstr(center_y, box_x - 1, "┌" + "─" * box_width + "┐")
+            self.window.addstr(center_y + 2, box_x - 1, "└" + "─" * box_width + "┘")
+            
+            # Show instructions
+            self.window.addstr(center_y + 4, (self.width - 30) // 2, "Press Enter to login")
         
         # Show username with padding if empty
         display_username = self.username if self.username else " "
-        self.window.addstr(center_y + 1, box_x, display_username[:box_width].ljust(box_width))
-        
-        self.window.addstr(center_y + 1, box_x + box_width, "│")
-        self.window.addstr(center_y + 2, box_x - 1, "└" + "─" * box_width + "┘")
-        
-        # Show instructions
-        self.window.addstr(center_y + 4, (self.width - 30) // 2, "Press Enter to login")
+        self.draw_line(center_y + 1, box_x - 1, ("│" + display_username[:box_width].ljust(box_width) + "│", 0))
         
         # Show error message if any
-        if self.error_message:
-            self.window.addstr(center_y + 6, (self.width - len(self.error_message)) // 2, 
-                              self.error_message, colors.CYAN_BLACK)
-        
-        self.window.refresh()
+        self.draw_centered(center_y + 6, self.error_message, colors.CYAN_BLACK)
         
+        self.end_draw()
+    
     def handle_input(self, key):
         if key == ord('\n'):  # Enter key
             if not self.username.strip():
                 self.error_message = "Username cannot be empty!"
                 return False
-                
-            # Create client and attempt login
-            self.state.client = Client(self.username)
             
-            if self.state.client.login() is False:
-                self.error_message = "Login failed"
-                return False
-            else:
-                self.state.mode = AppMode.NAVIGATION
-                self.state.selected_content = "Welcome"
-                return True
-                
+            # Create client and attempt login in the background; ChatApp switches modes when it answers
+            if self.state.worker.submit("login", login_client, self.username.strip()):
+                self.error_message = "Logging in..."
+            return False
+        
         elif key in (curses.KEY_BACKSPACE, 8, 127):  # Backspace
             self.username = self.username[:-1]
             self.error_message = ""
         elif 32 <= key <= 126:  # Printable characters
             self.username += chr(key)
             self.error_message = ""
-            
+        
         return False
 
 # Main application class
@@ -487,6 +637,7 @@ class ChatApp:
     def __init__(self, stdscr):
         self.stdscr = stdscr
         self.state = AppState()
+        self.state.worker = ClientWorker()
         self.menu_structure = {
             "Menu": ["Chats", "Grupos", "Amigos", "Descobrir", "Configurações", "Sair"],
             "Chats": ["Chat Geral"],
@@ -509,7 +660,10 @@ class ChatApp:
             "Welcome": WelcomeComponent(self.state, "Bem-Vindo"),
             "Chat": ContentChatComponent(self.state, "Chat"),
         }
+        self.contents["Chat"].on_idle = self.update
         self.login = LoginComponent(self.state, "Login")
+        self.shown_content = None  # Content component currently on screen
+        self.last_event_poll = 0
         self.resize()
     
     def setup_colors(self):
@@ -549,36 +703,112 @@ class ChatApp:
         for comp in self.contents.values():
             comp.resize(left_width + 1, 1, right_width, content_height)
         self.login.resize(1, 1, sw - 2, content_height)
+        self.shown_content = None
+    
+    def draw(self):
+        """Draw the visible components and push all their changes to the terminal at once"""
+        if self.state.mode == AppMode.LOGIN:
+            self.login.draw(self.colors)
+        else:
+            # Use Welcome as default when nothing is selected
+            current_content = self.contents.get(self.state.selected_content, self.contents["Welcome"])
+            if current_content is not self.shown_content:
+                # Coming from the login screen or from another content pane: both panes were covered
+                if self.shown_content is None:
+                    self.menu.invalidate()
+                current_content.invalidate()
+                self.shown_content = current_content
+            
+            self.menu.draw(self.colors)
+            current_content.draw(self.colors)
+        curses.doupdate()
+    
+    def poll_events(self):
+        """Ask the worker for events pushed by the server, such as friends going online or offline"""
+        if self.state.client and time.time() - self.last_event_poll > EVENT_POLL_INTERVAL:
+            self.state.worker.submit("events", self.state.client.poll_events)
+            self.last_event_poll = time.time()
+    
+    def apply_results(self):
+        """Fold the results of finished network jobs into the state the UI draws from"""
+        for name, args, result, error in self.state.worker.poll():
+            if error is not None:
+                self.state.messages.append(f"Error in {name}: {str(error)}")
+                if name == "login":
+                    self.login.error_message = "Login failed"
+                continue
+            
+            if name == "login":
+                if result is None:
+                    self.login.error_message = "Login failed"
+                else:
+                    self.state.client = result
+                    self.state.mode = AppMode.NAVIGATION
+                    self.state.selected_content = "Welcome"
+            elif name == "menus":
+                if result is not None:
+                    self.menu.apply_menus(result)
+            elif name == "messages":
+                if result is not None:
+                    new_messages, rebuilt = result
+                    if rebuilt or args[0] not in self.state.chat_histories:
+                        self.state.chat_histories[args[0]] = new_messages
+                    else:
+                        self.state.chat_histories[args[0]].extend(new_messages)
+            elif name == "send":
+                if result is False:
+                    self.state.messages.append(f"Error sending message to {args[0]}")
+                elif args[0] == self.state.current_topic:
+                    self.state.refresh_needed = True
+            elif name == "events":
+                for event in result:
+                    if event.get("event") == "presence":
+                        if event["online"]:
+                            self.state.online.add(event["user"])
+                        else:
+                            self.state.online.discard(event["user"])
+            elif name == "follow":
+                self.state.messages.append(f"Added {args[0]} as friend" if result else f"Error adding friend: {args[0]}")
+                self.menu.last_refresh = 0  # Force refresh
+            elif name == "join":
+                self.state.messages.append(f"Joined group {args[0]}" if result else f"Error joining group: {args[0]}")
+                self.menu.last_refresh = 0  # Force refresh
+    
+    def update(self):
+        """Apply the network results that arrived and draw what changed"""
+        self.poll_events()
+        self.apply_results()
+        self.draw()
     
     def run(self):
         curses.curs_set(0)
+        # getch returns -1 after UI_TICK_MS without a key, so results keep being drawn while idle
+        self.stdscr.timeout(UI_TICK_MS)
         
         while True:
+            self.update()
             if self.state.mode == AppMode.LOGIN:
-                self.login.draw(self.colors)
                 key = self.stdscr.getch()
+                if key == -1:
+                    continue
                 if key == curses.KEY_RESIZE:
                     self.resize()
                 else:
                     self.login.handle_input(key)
             else:
-                self.menu.draw(self.colors)
-                
-                # Use Welcome as default when nothing is selected
-                current_content = self.contents.get(self.state.selected_content, self.contents["Welcome"])
-                current_content.draw(self.colors)
+                current_content = self.shown_content
                 
                 key = self.stdscr.getch()
+                if key == -1:
+                    continue
                 if key == curses.KEY_RESIZE:
                     self.resize()
                 elif self.state.mode == AppMode.NAVIGATION:
                     if self.menu.handle_input(key):
-                        # Do logout before exiting
+                        # Do logout before exiting, after whatever the worker still has queued
                         if self.state.client:
-                            try:
-                                self.state.client.logout()
-                            except Exception:
-                                pass
+                            self.state.worker.submit("logout", self.state.client.logout)
+                        self.state.worker.stop(LOGOUT_TIMEOUT)
                         break
                 elif self.state.mode == AppMode.CONTENT:
                     current_content.handle_input(key)
@@ -0,0 +1,56 @@
+import queue
+import threading
+
+class ClientWorker:
+    """Runs Client calls on a background thread so the UI never waits on the network.
+
+    The UI submits jobs and collects their results with poll(); only the worker thread touches the
+    Client (and its RDT socket), so calls never overlap.
+    """
+    def __init__(self):
+        self.requests = queue.Queue()
+        self.results = queue.Queue()
+        self.pending = set()  # (name, args) of jobs queued or running, owned by the UI thread
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, name, func, *args):
+        """Queue func(*args) under `name`. An identical job still pending is not queued twice"""
+        job = (name, args)
+        if job in self.pending:
+            return False
+        self.pending.add(job)
+        self.requests.put((name, func, args))
+        return True
+
+    def busy(self, name):
+        """Whether a job called `name` is queued or running"""
+        return any(pending_name == name for pending_name, _ in self.pending)
+
+    def poll(self):
+        """Return the (name, args, result, error) of every job finished since the last call"""
+        finished = []
+        while True:
+            try:
+                name, args, result, error = self.results.get_nowait()
+            except queue.Empty:
+                return finished
+            self.pending.discard((name, args))
+            finished.append((name, args, result, error))
+
+    def stop(self, timeout=None):
+        """Let the queued jobs finish, then end the thread"""
+        self.requests.put(None)
+        self.thread.join(timeout)
+
+    def _run(self):
+        while True:
+            job = self.requests.get()
+            if job is None:
+                break
+            name, func, args = job
+            try:
+                result, error = func(*args), None
+            except Exception as e:
+                result, error = None, e
+            self.results.put((name, args, result, error))
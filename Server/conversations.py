@@ -0,0 +1,58 @@
+class Conversations:
+    """Integer ids for every chat, allocated once and looked up without building strings.
+
+    Message histories, the search index, the inbox and retention are all keyed by these ids. A direct
+    conversation is found from either of its users through a table of tables (user -> peer -> id), so
+    neither a key string nor a sorted pair is made per message. A group gets a new id every time it is
+    created, so a deleted group's messages never show up in a new group with the same name.
+    """
+    def __init__(self):
+        self.last_id = 0
+        self.direct_ids = {}  # username -> {peer username: id of their direct conversation}
+        self.group_ids = {}  # group name -> id
+        self.kinds = {}  # id -> "direct" or "group"
+        self.names = {}  # id -> name clients know the chat by: "user1_user2" (sorted) or the group name
+
+    def direct(self, user1, user2):
+        """Id of the direct conversation of the two users, allocated the first time it is asked for"""
+        chat = self.direct_ids.get(user1, {}).get(user2)
+        if chat is None:
+            chat = self._allocate("direct", "_".join(sorted((user1, user2))))
+            self.direct_ids.setdefault(user1, {})[user2] = chat
+            self.direct_ids.setdefault(user2, {})[user1] = chat
+        return chat
+
+    def find_direct(self, username, name):
+        """Id of the user's direct conversation named `name`, which is either the peer's username or the
+        conversation name ("user1_user2"); None if there is none. Underscores in usernames are fine: the
+        user's own name is taken off the conversation name to find the peer, never split on."""
+        peers = self.direct_ids.get(username, {})
+        if name in peers:
+            return peers[name]
+        if name.startswith(username + "_") and name[len(username) + 1:] in peers:
+            return peers[name[len(username) + 1:]]
+        if name.endswith("_" + username) and name[:-len(username) - 1] in peers:
+            return peers[name[:-len(username) - 1]]
+        return None
+
+    def direct_chats(self, username):
+        return list(self.direct_ids.get(username, {}).values())
+
+    def create_group(self, name):
+        chat = self.group_ids[name] = self._allocate("group", name)
+        return chat
+
+    def group(self, name):
+        return self.group_ids.get(name)
+
+    def delete_group(self, name):
+        chat = self.group_ids.pop(name)
+        del self.kinds[chat]
+        del self.names[chat]
+        return chat
+
+    def _allocate(self, kind, name):
+        self.last_id += 1
+        self.kinds[self.last_id] = kind
+        self.names[self.last_id] = name
+        return self.last_id
@@ -0,0 +1,62 @@
+class FriendGraph:
+    """Who follows whom, indexed in both directions.
+
+    Each user has the set of users it follows and the set of users following it, so checking a follow,
+    following, unfollowing and counting are O(1), and fanning an event out to someone's followers only
+    touches those followers. Sets are dicts with no values, which keeps them in follow order for listings.
+    """
+    def __init__(self):
+        self.following = {}  # username -> {username it follows: None}
+        self.followers = {}  # username -> {username following it: None}
+        self.edges = 0
+
+    def add_user(self, username):
+        self.following.setdefault(username, {})
+        self.followers.setdefault(username, {})
+
+    def follow(self, username, friend_name):
+        """False if the user already followed the friend"""
+        following = self.following.setdefault(username, {})
+        if friend_name in following:
+            return False
+        following[friend_name] = None
+        self.followers.setdefault(friend_name, {})[username] = None
+        self.edges += 1
+        return True
+
+    def unfollow(self, username, friend_name):
+        """False if the user did not follow the friend"""
+        if friend_name not in self.following.get(username, {}):
+            return False
+        del self.following[username][friend_name]
+        del self.followers[friend_name][username]
+        self.edges -= 1
+        return True
+
+    def follows(self, username, friend_name):
+        return friend_name in self.following.get(username, {})
+
+    def following_of(self, username):
+        """Users the user follows, in the order it followed them"""
+        return list(self.following.get(username, {}))
+
+    def followers_of(self, username):
+        return list(self.followers.get(username, {}))
+
+    def follower_count(self, username):
+        return len(self.followers.get(username, {}))
+
+    def following_count(self, username):
+        return len(self.following.get(username, {}))
+
+    def mutual(self, username):
+        """Users the user follows that follow it back"""
+        followers = self.followers.get(username, {})
+        return [friend for friend in self.following.get(username, {}) if friend in followers]
+
+    def mutual_friends(self, username, other):
+        """Users both of them follow"""
+        mine, theirs = self.following.get(username, {}), self.following.get(other, {})
+        if len(theirs) < len(mine):
+            mine, theirs = theirs, mine
+        return [friend for friend in mine if friend in theirs]
@@ -0,0 +1,75 @@
+PREVIEW_LENGTH = 60  # Characters of the last message shown in the inbox
+
+class Inbox:
+    """Unread counts of every user in every chat they read, kept as counters instead of scans.
+
+    Each chat counts the messages ever stored in it and each reader remembers how many of those it has
+    read, so storing a message is O(1) whatever the size of the group (only the chat's own counter moves)
+    and a reader's unread count is the difference of the two. Chats are conversation ids, as in the
+    search index.
+    """
+    def __init__(self):
+        self.totals = {}  # chat -> messages ever stored in it
+        self.latest = {}  # chat -> newest message
+        self.read = {}  # username -> {chat: how many of its messages the user has read}
+        self.readers = {}  # chat -> users with a read counter there
+        # username -> {chat: positions of the user's own messages past its read counter}: sending does not
+        # mean reading what others said before, but the user's own messages are never unread for it
+        self.own = {}
+
+    def join(self, username, chat):
+        """Start counting the chat for the user; what was said before counts as read"""
+        chats = self.read.setdefault(username, {})
+        if chat not in chats:
+            chats[chat] = self.totals.get(chat, 0)
+            self.readers.setdefault(chat, set()).add(username)
+
+    def leave(self, username, chat):
+        self.read.get(username, {}).pop(chat, None)
+        self.own.get(username, {}).pop(chat, None)
+        self.readers.get(chat, set()).discard(username)
+
+    def remove_chat(self, chat):
+        for username in self.readers.pop(chat, ()):
+            self.read[username].pop(chat, None)
+            self.own.get(username, {}).pop(chat, None)
+        self.totals.pop(chat, None)
+        self.latest.pop(chat, None)
+
+    def add(self, chat, message):
+        """Count a stored message; it is unread for everyone but its sender"""
+        sender = message["sender"]
+        self.join(sender, chat)
+        total = self.totals[chat] = self.totals.get(chat, 0) + 1
+        self.latest[chat] = message
+        chats = self.read[sender]
+        if chats[chat] == total - 1:
+            # The sender had read everything: it still has
+            chats[chat] = total
+        else:
+            self.own.setdefault(sender, {}).setdefault(chat, []).append(total)
+
+    def mark_read(self, username, chat, unread):
+        """The user has seen the chat up to a point that leaves `unread` messages after it"""
+        chats = self.read.get(username)
+        if chats is not None and chat in chats:
+            chats[chat] = max(chats[chat], self.totals.get(chat, 0) - unread)
+            own = self.own.get(username, {})
+            if chat in own:
+                own[chat] = [position for position in own[chat] if position > chats[chat]]
+                if not own[chat]:
+                    del own[chat]
+
+    def summary(self, username):
+        """[(chat, unread, preview of the last message or None)], most recent activity first"""
+        entries = []
+        for chat, read in self.read.get(username, {}).items():
+            latest = self.latest.get(chat)
+            preview = None
+            if latest is not None:
+                preview = {"id": latest["id"], "sender": latest["sender"],
+                           "content": latest["content"][:PREVIEW_LENGTH], "timestamp": latest["timestamp"]}
+            own = len(self.own.get(username, {}).get(chat, ()))
+            entries.append((chat, self.totals.get(chat, 0) - read - own, preview))
+        entries.sort(key=lambda entry: entry[2]["id"] if entry[2] else 0, reverse=True)
+        return entries
@@ -0,0 +1,111 @@
+import os
+import json
+from collections import deque
+from urllib.parse import quote, unquote
+from rdt.log import get_logger
+
+OFFLINE_BATCH = 20  # Queued messages per reply
+OFFLINE_WINDOW = 4  # Replies sent for one request, before waiting for the client to acknowledge them
+MAX_OFFLINE_QUEUE = 1000  # Per user; past this the oldest are dropped (they are still in the chat history)
+
+log = get_logger("server.offline")
+
+class OfflineQueue:
+    """Messages sent to users while they were offline, kept until they acknowledge having them.
+
+    Every queued message gets the next number of its user's queue, so acknowledging is a cursor: the
+    client sends the number of the last message it has and everything up to it is removed. Numbers are
+    the queue's own, not message ids, so they keep their order across server restarts.
+
+    With a directory, each queue is also a JSON-lines journal there: a message is appended as it is
+    queued and the file is rewritten with what is left when the user acknowledges, so queues survive a
+    restart of the server. A full queue drops its oldest messages from memory only; the journal is
+    rewritten once it holds twice max_messages, so it stays bounded for a user who never acknowledges.
+    """
+    def __init__(self, directory=None, max_messages=MAX_OFFLINE_QUEUE):
+        self.directory = directory
+        self.max_messages = max_messages
+        self.queues = {}  # username -> deque of (number, message), oldest first
+        self.last_number = {}  # username -> number of the last message queued for it
+        self.journal_lines = {}  # username -> messages in its journal, dropped ones included
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            self._load()
+
+    def add(self, username, message):
+        number = self.last_number[username] = self.last_number.get(username, 0) + 1
+        queue = self.queues.setdefault(username, deque())
+        queue.append((number, message))
+        if len(queue) > self.max_messages:
+            queue.popleft()
+        if self.directory:
+            if self.journal_lines.get(username, 0) >= 2 * self.max_messages:
+                self._write(username, queue, "w")
+            else:
+                self._write(username, [(number, message)], "a")
+
+    def pending(self, username):
+        return len(self.queues.get(username, ()))
+
+    def ack(self, username, cursor):
+        """Remove the user's messages numbered up to `cursor`; returns how many were removed"""
+        queue = self.queues.get(username)
+        removed = 0
+        while queue and queue[0][0] <= cursor:
+            queue.popleft()
+            removed += 1
+        if removed and self.directory:
+            self._write(username, queue, "w")
+        if queue is not None and not queue:
+            del self.queues[username]
+        return removed
+
+    def window(self, username, batch=OFFLINE_BATCH, window=OFFLINE_WINDOW):
+        """Up to `window` batches of `batch` (number, message), oldest first, and how many are left after them"""
+        queue = self.queues.get(username, ())
+        entries = list(queue)[:batch * window]
+        batches = [entries[start:start + batch] for start in range(0, len(entries), batch)]
+        return batches, len(queue) - len(entries)
+
+    def _path(self, username):
+        return os.path.join(self.directory, quote(username, safe="") + ".jsonl")
+
+    def _write(self, username, entries, mode):
+        path = self._path(username)
+        try:
+            if mode == "w" and not entries:
+                os.remove(path)
+                self.journal_lines.pop(username, None)
+                return
+            # A rewrite goes to a new file first, so a crash never leaves a half-written queue
+            target = path + ".tmp" if mode == "w" else path
+            with open(target, mode) as f:
+                f.writelines(json.dumps({"number": number, "message": message}) + "\n" for number, message in entries)
+            if mode == "w":
+                os.replace(target, path)
+                self.journal_lines[username] = len(entries)
+            else:
+                self.journal_lines[username] = self.journal_lines.get(username, 0) + len(entries)
+        except OSError as e:
+            log.error("Could not write the offline queue of %s to %s: %s", username, path, e)
+
+    def _load(self):
+        for name in os.listdir(self.directory):
+            if not name.endswith(".jsonl"):
+                continue
+            username = unquote(name[:-len(".jsonl")])
+            queue = deque(maxlen=self.max_messages)
+            lines = 0
+            with open(os.path.join(self.directory, name)) as f:
+                for line in f:
+                    lines += 1
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # The last line of a crashed append
+                        continue
+                    queue.append((entry["number"], entry["message"]))
+            self.journal_lines[username] = lines
+            if queue:
+                self.queues[username] = deque(queue)
+                self.last_number[username] = queue[-1][0]
@@ -0,0 +1,85 @@
+import time
+
+HEARTBEAT_INTERVAL = 5.0  # Clients send a heartbeat this often while logged in
+PRESENCE_TIMEOUT = 3 * HEARTBEAT_INTERVAL  # Users whose heartbeats stop for this long go offline
+
+# Timer wheel resolution; a wheel covers WHEEL_SLOTS * WHEEL_TICK seconds, which must exceed PRESENCE_TIMEOUT
+WHEEL_TICK = 1.0
+WHEEL_SLOTS = 64
+
+class TimerWheel:
+    """Hashed timer wheel: each key sits in the slot of the tick it expires at.
+
+    Scheduling, rescheduling and cancelling are O(1), and each tick only looks at its own slot, so the
+    cost of expiring does not depend on how many timers are pending.
+    """
+    def __init__(self, tick=WHEEL_TICK, slots=WHEEL_SLOTS, now=None):
+        self.tick = tick
+        self.slots = [set() for _ in range(slots)]
+        self.slot_of = {}  # key -> index of the slot it is in
+        self.current_tick = int((time.time() if now is None else now) / tick)
+
+    def schedule(self, key, delay):
+        """(Re)start the timer of `key` to expire `delay` seconds after the current tick"""
+        ticks = max(1, int(delay / self.tick + 0.999999))
+        if ticks >= len(self.slots):
+            raise ValueError(f"delay {delay}s does not fit in a wheel of {len(self.slots) * self.tick}s")
+        self.cancel(key)
+        index = (self.current_tick + ticks) % len(self.slots)
+        self.slots[index].add(key)
+        self.slot_of[key] = index
+
+    def cancel(self, key):
+        index = self.slot_of.pop(key, None)
+        if index is not None:
+            self.slots[index].discard(key)
+
+    def advance(self, now=None):
+        """Move the wheel up to `now` and return the keys whose timers expired on the way"""
+        target = int((time.time() if now is None else now) / self.tick)
+        expired = []
+        # After a full turn every slot has been visited, so a long pause costs at most one turn
+        for _ in range(min(target - self.current_tick, len(self.slots))):
+            self.current_tick += 1
+            slot = self.slots[self.current_tick % len(self.slots)]
+            for key in slot:
+                del self.slot_of[key]
+            expired.extend(slot)
+            slot.clear()
+        self.current_tick = max(self.current_tick, target)
+        return expired
+
+class Presence:
+    """Who is online, kept as a set and expired through a timer wheel fed by heartbeats"""
+    def __init__(self, timeout=PRESENCE_TIMEOUT):
+        self.timeout = timeout
+        self.online = set()
+        self.wheel = TimerWheel()
+
+    def heartbeat(self, username):
+        """Record a sign of life; returns True if the user just came online. Call expire() regularly"""
+        self.wheel.schedule(username, self.timeout)
+        if username in self.online:
+            return False
+        self.online.add(username)
+        return True
+
+    def logout(self, username):
+        """Returns True if the user was online"""
+        self.wheel.cancel(username)
+        if username not in self.online:
+            return False
+        self.online.discard(username)
+        return True
+
+    def expire(self, now=None):
+        """Users whose heartbeats stopped; they are no longer online"""
+        expired = self.wheel.advance(now)
+        self.online.difference_update(expired)
+        return expired
+
+    def is_online(self, username):
+        return username in self.online
+
+    def online_users(self):
+        return sorted(self.online)
@@ -0,0 +1,48 @@
+import time
+
+class TokenBucket:
+    """Allows `rate` requests per second on average and bursts of up to `burst` at once"""
+    def __init__(self, rate, burst, now=None):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic() if now is None else now
+
+    def take(self, now=None):
+        """0 if a request may go through now, otherwise the seconds until one may"""
+        now = time.monotonic() if now is None else now
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+class RateLimiter:
+    """One token bucket per key (a username, an IP...), created on first use.
+
+    Buckets that have been idle long enough to be full again are forgotten, so the table only holds
+    keys that were active in the last few seconds.
+    """
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.buckets = {}
+        self.last_prune = time.monotonic()
+
+    def take(self, key, now=None):
+        """0 if the key may make a request now, otherwise the seconds until it may"""
+        now = time.monotonic() if now is None else now
+        if now - self.last_prune > self.burst / self.rate:
+            self._prune(now)
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = TokenBucket(self.rate, self.burst, now)
+        return bucket.take(now)
+
+    def _prune(self, now):
+        refill = self.burst / self.rate
+        for key, bucket in list(self.buckets.items()):
+            if now - bucket.updated > refill:
+                del self.buckets[key]
+        self.last_prune = now
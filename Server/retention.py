@@ -0,0 +1,137 @@
+import os
+import json
+import heapq
+import queue
+import bisect
+import threading
+from datetime import datetime, timedelta
+from urllib.parse import quote
+from rdt.log import get_logger
+
+MAX_MESSAGES_PER_CHAT = 10000  # Older messages of a chat are dropped past this, a tenth of the cap at a time
+MAX_MESSAGE_AGE = 90 * 24 * 3600  # Seconds a message is kept
+MEMORY_BUDGET = 256 * 1024 * 1024  # Approximate bytes all histories may use; the oldest messages go first
+COMPACT_INTERVAL = 5.0  # Seconds between compaction steps
+COMPACT_BATCH = 2000  # Messages one compaction step drops at most, so a step never stalls the request loop
+MESSAGE_OVERHEAD = 500  # Approximate bytes of a stored message besides its content (dict, id, timestamp...)
+
+log = get_logger("server.retention")
+
+def message_size(message):
+    return MESSAGE_OVERHEAD + len(message["content"])
+
+def _timestamp(message):
+    return message["timestamp"]
+
+class Retention:
+    """Which old messages to drop: past the per-chat cap, older than the maximum age, or the oldest
+    overall while the histories are over the memory budget.
+
+    The server reports what it stores and drops so the memory estimate is kept as a running total. The
+    per-chat cap is checked as each message is stored; age and memory are checked by compaction steps
+    of at most `batch` messages, run every `interval` seconds from the request loop.
+    """
+    def __init__(self, max_messages=MAX_MESSAGES_PER_CHAT, max_age=MAX_MESSAGE_AGE, memory_budget=MEMORY_BUDGET,
+                 interval=COMPACT_INTERVAL, batch=COMPACT_BATCH):
+        self.max_messages = max_messages
+        self.max_age = max_age
+        self.memory_budget = memory_budget
+        self.interval = interval
+        self.batch = batch
+        self.bytes = 0
+        self.last_run = 0
+
+    def stored(self, message):
+        self.bytes += message_size(message)
+
+    def dropped(self, messages):
+        self.bytes -= sum(message_size(message) for message in messages)
+
+    def over_cap(self, history):
+        """How many of the oldest messages to drop before storing one more"""
+        if len(history) < self.max_messages:
+            return 0
+        return len(history) - self.max_messages + max(1, self.max_messages // 10)
+
+    def due(self, now):
+        return now - self.last_run >= self.interval
+
+    def plan(self, histories, now):
+        """[(chat, how many of its oldest messages to drop, reason)] for one compaction step.
+
+        `histories` is an iterable of (chat, history), each history oldest first. If the step had to stop
+        at `batch`, the next one is not delayed.
+        """
+        self.last_run = now
+        budget = self.batch
+        plan = {}
+        cutoff = (datetime.fromtimestamp(now) - timedelta(seconds=self.max_age)).isoformat()
+        # Messages are stored in timestamp order, so the expired ones are a prefix of each history
+        for chat, history in histories:
+            expired = min(bisect.bisect_left(history, cutoff, key=_timestamp), budget)
+            if expired:
+                plan[chat] = (history, expired, "age")
+                budget -= expired
+            if not budget:
+                break
+
+        excess = self.bytes - self.memory_budget - sum(
+            sum(message_size(message) for message in history[:count]) for history, count, _ in plan.values())
+        if excess > 0 and budget:
+            self._plan_memory(plan, histories, excess, budget)
+
+        if sum(count for _, count, _ in plan.values()) >= self.batch:
+            self.last_run -= self.interval
+        return [(chat, count, reason) for chat, (_, count, reason) in plan.items()]
+
+    def _plan_memory(self, plan, histories, excess, budget):
+        # The oldest message of all chats goes first: merge the chats by the id of their next message
+        heap = []
+        for chat, history in histories:
+            start = plan[chat][1] if chat in plan else 0
+            if start < len(history):
+                heap.append((history[start]["id"], chat, history, start))
+        heapq.heapify(heap)
+        while heap and excess > 0 and budget:
+            _, chat, history, index = heapq.heappop(heap)
+            excess -= message_size(history[index])
+            budget -= 1
+            count = index + 1
+            plan[chat] = (history, count, plan[chat][2] if chat in plan else "memory")
+            if count < len(history):
+                heapq.heappush(heap, (history[count]["id"], chat, history, count))
+
+class Archiver:
+    """Appends dropped messages to one JSON-lines file per chat, from a thread of its own so the
+    request loop never waits for the disk"""
+    def __init__(self, directory):
+        self.directory = directory
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def archive(self, chat, messages):
+        self.queue.put((chat, messages))
+
+    def close(self):
+        """Write what is still queued and stop"""
+        self.queue.put(None)
+        self.thread.join()
+
+    def path(self, chat):
+        kind, key = chat
+        return os.path.join(self.directory, kind, quote(key, safe="") + ".jsonl")
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            chat, messages = item
+            path = self.path(chat)
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, "a") as f:
+                    f.writelines(json.dumps(message) + "\n" for message in messages)
+            except OSError as e:
+                log.error("Could not archive %s messages to %s: %s", len(messages), path, e)
@@ -0,0 +1,85 @@
+import re
+import heapq
+import bisect
+import itertools
+
+TOKEN_PATTERN = re.compile(r"\w+")
+MAX_QUERY_TOKENS = 8
+
+def tokenize(text):
+    """Lowercase words of the text, each once, in order of first appearance"""
+    return list(dict.fromkeys(TOKEN_PATTERN.findall(text.lower())))
+
+class SearchIndex:
+    """Inverted index over chat messages, updated as each message is stored.
+
+    Every chat has its own posting lists (token -> ids of the messages containing it, oldest first).
+    Message ids only grow, so appending keeps the lists sorted and the newest hits are read from the end:
+    a query walks its rarest token backwards, checks the other tokens by bisection and merges the chats
+    the user can read newest first, stopping as soon as the page is full.
+    """
+    def __init__(self):
+        self.postings = {}  # chat -> {token: [message id, ...] ascending}
+        self.messages = {}  # message id -> message
+
+    def add(self, chat, message):
+        """Index a stored message of the chat (a conversation id)"""
+        chat_postings = self.postings.setdefault(chat, {})
+        for token in tokenize(message["content"]):
+            chat_postings.setdefault(token, []).append(message["id"])
+        self.messages[message["id"]] = message
+
+    def remove_chat(self, chat):
+        ids = set()
+        for postings in self.postings.pop(chat, {}).values():
+            ids.update(postings)
+        for message_id in ids:
+            del self.messages[message_id]
+
+    def trim(self, chat, messages):
+        """Forget the oldest messages of the chat (the given ones, which were dropped from its history)"""
+        if not messages:
+            return
+        chat_postings = self.postings.get(chat, {})
+        cutoff = messages[-1]["id"]
+        for token, postings in list(chat_postings.items()):
+            del postings[:bisect.bisect_right(postings, cutoff)]
+            if not postings:
+                del chat_postings[token]
+        for message in messages:
+            self.messages.pop(message["id"], None)
+
+    def search(self, query, chats, limit, before=None):
+        """Up to `limit` (chat, message) matching every query token, newest first, with ids below `before`.
+
+        Returns (hits, more) where `more` says whether older hits exist past this page.
+        """
+        tokens = tokenize(query)[:MAX_QUERY_TOKENS]
+        if not tokens or limit <= 0:
+            return [], False
+
+        matches = []
+        for chat in chats:
+            chat_postings = self.postings.get(chat, {})
+            lists = [chat_postings.get(token) for token in tokens]
+            if all(lists):
+                matches.append(self._chat_matches(chat, sorted(lists, key=len), before))
+
+        newest_first = heapq.merge(*matches, key=lambda hit: hit[1], reverse=True)
+        hits = list(itertools.islice(newest_first, limit + 1))
+        return [(chat, self.messages[message_id]) for chat, message_id in hits[:limit]], len(hits) > limit
+
+    @staticmethod
+    def _chat_matches(chat, lists, before):
+        rarest, others = lists[0], lists[1:]
+        # Candidates only get older, so each other list is searched below where the last one was found
+        bounds = [len(other) for other in others]
+        end = len(rarest) if before is None else bisect.bisect_left(rarest, before)
+        for index in range(end - 1, -1, -1):
+            message_id = rarest[index]
+            for i, other in enumerate(others):
+                position = bounds[i] = bisect.bisect_left(other, message_id, 0, bounds[i])
+                if position == len(other) or other[position] != message_id:
+                    break
+            else:
+                yield chat, message_id
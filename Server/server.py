@@ -1,82 +1,220 @@
 import rdt
+import io
+import os
 import json
+import time
+import pstats
+import cProfile
+import logging
+import argparse
+import bisect
 import random
 import string
 from datetime import datetime
+from rdt import file_transfer
+from rdt import tracing
+from rdt.log import configure as configure_logging, get_logger
+from .presence import Presence
+from .search import SearchIndex
+from .inbox import Inbox
+from .ratelimit import RateLimiter
+from .retention import Retention, Archiver
+from .graph import FriendGraph
+from .conversations import Conversations
+from .offline import OfflineQueue, OFFLINE_BATCH, OFFLINE_WINDOW
 
 SERVER_ADDR = ("localhost", 5001)
+FILES_DIR = "./Files"  # Uploaded files, one folder per user
+UPLOAD_IDLE_TIMEOUT = 60  # Unfinished uploads are closed (and kept for resuming) after this many seconds
+MAX_MESSAGES_PER_SYNC = 20  # Incremental list:messages replies are split so each stays small
+MAX_SEARCH_RESULTS = 20  # Hits per search reply; older ones are fetched page by page
+
+# Requests per second (on average, and in a burst) a user may make; past that the reply is "busy, retry after".
+# The IP limit is for many users behind one address, so it is checked only for requests the user limit lets through.
+USER_RATE, USER_BURST = 20, 40
+IP_RATE, IP_BURST = 100, 200
+UNTHROTTLED = {"login", "logout"}  # No reply is expected, so a busy one would be read as the next request's
+
+log = get_logger("server")
+
+# Commands counted by name in the metrics; anything else is counted as "unknown"
+COMMANDS = {
+    "login", "logout", "list:cinners", "list:friends", "list:mygroups", "list:groups", "list:online",
+    "follow", "unfollow", "create_group", "delete_group", "join", "leave", "ban", "stats",
+    "chat_group", "chat_friend", "list:messages", "search", "inbox", "send_file", "offline",
+}
+
+def is_safe_filename(name):
+    """Whether `name` is a single path component that cannot leave the directory it is joined to"""
+    return isinstance(name, str) and name not in ("", ".", "..") and not any(c in name for c in "/\\\0")
 
 class Server:
-    def __init__(self):
-        self.socket = rdt.RDTSocket(port=SERVER_ADDR[1])
+    def __init__(self, metrics_port=None, profile_path=None, archive_dir=None, offline_dir=None):
+        # Transport and command metrics share one registry, readable with the stats command
+        self.metrics = rdt.MetricsRegistry()
+        # Each client gets at most a window of unread requests: one that sends faster than we handle them waits
+        self.socket = rdt.RDTSocket(port=SERVER_ADDR[1], metrics=self.metrics, backlog_limit=rdt.MAX_SESSION_BACKLOG)
 
         self.users = {}  # username -> {online: bool}
-        self.friends = {}  # username -> [friend_usernames]
-        self.groups = {}  # group_name -> {owner: username, members: [usernames], key: access_key}
-        self.messages = {
-            "direct": {},  # user1_user2 -> [{sender, content, timestamp}]
-            "group": {}    # group_name -> [{sender, content, timestamp}]
-        }
+        self.friends = FriendGraph()  # Who follows whom, with the followers of each user indexed too
+        self.groups = {}  # group_name -> {owner: username, members: [usernames], key: access_key, chat: conversation id}
+        self.conversations = Conversations()  # Integer id of every direct conversation and group
+        self.messages = {}  # conversation id -> [{id, sender, content, timestamp}]
+        # Message ids only grow, so clients can ask for what is newer than the last id they have.
+        # The epoch changes on every start: ids from a previous run mean nothing to this one.
+        self.last_message_id = 0
+        self.epoch = str(int(time.time() * 1000))
+        # Listings shared by every user are serialized once per generation; each mutation bumps it
+        self.generations = {"list:cinners": 1, "list:groups": 1}
+        self.response_cache = {}  # (listing, versioned) -> (generation, serialized reply)
+        self.search_index = SearchIndex()  # Every stored message, indexed by word as it arrives
+        self.inbox = Inbox()  # Unread counts and last message of every chat, per user
+        self.retention = Retention()  # Which old messages to drop (see Server/retention.py)
+        self.archiver = Archiver(archive_dir) if archive_dir else None  # Dropped messages are kept here, if set
+        self.offline = OfflineQueue(offline_dir)  # Direct messages sent to offline users, until they fetch them
         self.banned_users = []
-        self.log_message("Server started on {}:{}".format(*SERVER_ADDR))
+        self.uploads = {}  # client address -> FileReceiver of the upload in progress
+        self.presence = Presence()  # Online users, kept alive by heartbeat datagrams
+        self.user_limiter = RateLimiter(USER_RATE, USER_BURST)
+        self.ip_limiter = RateLimiter(IP_RATE, IP_BURST)
+        self.addresses = {}  # username -> address of the client it last heard from
+        self.socket.datagram_handler = self.handle_datagram
+        self.profile_path = profile_path  # cProfile stats of the request loop are written here on shutdown
+        self._register_metrics()
+        if metrics_port:
+            rdt.serve_metrics(self.metrics, metrics_port)
+            self.log_message("Metrics available at http://127.0.0.1:%s/metrics", metrics_port)
+        self.log_message("Server started on %s:%s", *SERVER_ADDR)
     
-    def log_message(self, message):
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        print(f"\033[36m[{timestamp}] SERVER: {message}\033[0m")
+    def _register_metrics(self):
+        self.requests = self.metrics.counter("server_requests_total", "Requests handled, by command")
+        self.request_latency = self.metrics.histogram("server_request_seconds", "Time from receiving a request to sending its reply, by command")
+        self.dropped_replies = self.metrics.counter("server_dropped_replies_total", "Replies dropped because the client was not acknowledging them")
+        self.throttled = self.metrics.counter("server_throttled_total", "Requests answered busy, by the limit (user or ip) they hit")
+        self.evicted = self.metrics.counter("server_evicted_messages_total", "Messages dropped from the histories, by reason (cap, age, memory or deleted)")
+        self.metrics.gauge("server_users", "Registered users").set_function(lambda: len(self.users))
+        self.metrics.gauge("server_online_users", "Users sending heartbeats").set_function(lambda: len(self.presence.online))
+        self.metrics.gauge("server_groups", "Existing groups").set_function(lambda: len(self.groups))
+        self.metrics.gauge("server_follows", "Follow relationships").set_function(lambda: self.friends.edges)
+        self.metrics.gauge("server_uploads", "Uploads in progress").set_function(lambda: len(self.uploads))
+        self.metrics.gauge("server_history_bytes", "Approximate memory used by the message histories").set_function(lambda: self.retention.bytes)
+        self.metrics.gauge("server_offline_messages", "Messages queued for offline users").set_function(lambda: sum(map(len, self.offline.queues.values())))
+    
+    def log_message(self, message, *args, level=logging.INFO):
+        # Arguments are only formatted into the message if the level is enabled (see rdt/log.py)
+        log.log(level, message, *args)
     
     def start(self):
+        profiler = cProfile.Profile() if self.profile_path else None
         try:
+            if profiler:
+                profiler.enable()
             while True:
                 self.handle_client()
         except KeyboardInterrupt:
             self.log_message("Server shutting down...")
         finally:
+            if profiler:
+                profiler.disable()
+                self._dump_profile(profiler)
             self.socket.close()
+            if self.archiver:
+                self.archiver.close()
+    
+    def _dump_profile(self, profiler):
+        # The .prof file opens in snakeviz or pstats, or becomes a flamegraph with flameprof/gprof2dot
+        profiler.dump_stats(self.profile_path)
+        summary = io.StringIO()
+        pstats.Stats(profiler, stream=summary).sort_stats("cumulative").print_stats(15)
+        self.log_message("Profile written to %s\n%s", self.profile_path, summary.getvalue())
     
     def handle_client(self):
         connected_user = None
 
         try:
             while True:
-                data = self.socket.recv()
+                data, addr = self.socket.recvfrom()
+                received_at = time.perf_counter()
+                self._expire_presence()
+                self._compact()
                 if data is None:
                     break
 
-                try:
-                    request = json.loads(data.decode())
-                    command = request.get("command", "")
-                    username = request.get("user", "")
-
-                    if username in self.banned_users and command != "logout":
-                        self.log_message(f"Rejected request from banned user: {username}")
+                # Spans (see rdt/tracing.py) only measure anything when tracing is enabled
+                with tracing.span("server.request"):
+                    # File chunks go to the sender's upload; they are never parsed as commands
+                    if file_transfer.is_chunk(data):
+                        with tracing.span("server.handle:file_chunk"):
+                            response = self.handle_file_chunk(addr, data)
+                        if response is not None:
+                            with tracing.span("server.reply"):
+                                self._reply(json.dumps(response).encode(), addr)
+                        self._record_request("file_chunk", received_at)
                         continue
 
-                    response = self.handle_command(request)
+                    request = None
+                    try:
+                        with tracing.span("server.decode"):
+                            request = json.loads(data.decode())
+                        command = request.get("command", "")
+                        username = request.get("user", "")
+                        # Clients that pipeline requests tag them with an id; every reply to the request carries it
+                        request_id = request.get("id")
+
+                        if username in self.banned_users and command != "logout":
+                            self.log_message("Rejected request from banned user: %s", username, level=logging.WARNING)
+                            if command not in UNTHROTTLED:
+                                self._reply(json.dumps({"error": "banned"}).encode(), addr, request_id)
+                            continue
 
-                    if command == "login":
-                        self.users[username] = {"online": True}
-                    elif command == "logout" and connected_user:
-                        if username in self.users:
-                            self.users[username]["online"] = False
-                        connected_user = None
+                        if command in COMMANDS and command not in UNTHROTTLED:
+                            retry_after = self._throttle(username, addr)
+                            if retry_after:
+                                # Its next requests wait in the transport until then; if they keep coming, they are dropped
+                                self._reply(json.dumps({"busy": True, "retry_after": round(retry_after, 3)}).encode(), addr, request_id)
+                                self.socket.hold(addr, retry_after)
+                                self._record_request(command, received_at)
+                                continue
 
-                    # Send response for commands that expect one
-                    if response is not None:
-                        self.socket.send(json.dumps(response).encode())
+                        with tracing.span("server.handle:" + str(command)):
+                            response = self.handle_command(request, addr)
 
-                except json.JSONDecodeError:
-                    self.log_message(f"Received invalid JSON data: {data.decode("utf-8")}")
-                except Exception as e:
-                    self.log_message(f"Error handling client command: {str(e)}. Packet content: {data.decode("utf-8")}")
+                        if command == "login":
+                            self._mark_online(username, addr)
+                        elif command == "logout" and connected_user:
+                            if username in self.users:
+                                self.users[username]["online"] = False
+                            connected_user = None
+
+                        # Send response for commands that expect one (cached replies are already serialized)
+                        if response is not None:
+                            with tracing.span("server.encode"):
+                                reply = response if isinstance(response, bytes) else json.dumps(response).encode()
+                            with tracing.span("server.reply"):
+                                self._reply(reply, addr, request_id)
+                        self._record_request(command if command in COMMANDS else "unknown", received_at)
+
+                    except (json.JSONDecodeError, UnicodeDecodeError):
+                        response = self._damaged_chunk(addr, data)
+                        if response is not None:
+                            self._reply(json.dumps(response).encode(), addr)
+                        else:
+                            # Payloads may be binary: only their size is logged
+                            self.log_message("Received invalid JSON data (%s bytes) from %s", len(data), addr, level=logging.WARNING)
+                    except Exception as e:
+                        self.log_message("Error handling client command: %s. Packet content: %s", str(e), data[:200].decode('utf-8', errors='replace'), level=logging.ERROR)
+                        # The client is waiting for a reply: without one it would take the next reply for this one's
+                        if isinstance(request, dict) and request.get("command") not in UNTHROTTLED:
+                            self._reply(json.dumps({"error": str(e)}).encode(), addr, request.get("id"))
 
         except Exception as e:
-            self.log_message(f"Client connection error: {str(e)}")
+            self.log_message("Client connection error: %s", str(e), level=logging.ERROR)
     
-    def handle_command(self, request):
+    def handle_command(self, request, addr=None):
         command = request["command"]
         username = request["user"]
         
-        self.log_message(f"Received command: {command} from {username}")
+        self.log_message("Received command: %s from %s", command, username, level=logging.DEBUG)
         
         # Command handlers
         if command == "login":
@@ -84,13 +222,15 @@ class Server:
         elif command == "logout":
             return self.handle_logout(username)
         elif command == "list:cinners":
-            return self.handle_list_cinners()
+            return self._cached_listing(command, self.handle_list_cinners, request.get("version"))
         elif command == "list:friends":
             return self.handle_list_friends(username)
         elif command == "list:mygroups":
             return self.handle_list_mygroups(username)
         elif command == "list:groups":
-            return self.handle_list_groups()
+            return self._cached_listing(command, self.handle_list_groups, request.get("version"))
+        elif command == "list:online":
+            return self.handle_list_online()
         elif command == "follow":
             return self.handle_follow(username, request["friend"])
         elif command == "unfollow":
@@ -105,40 +245,54 @@ class Server:
             return self.handle_leave_group(username, request["group"])
         elif command == "ban":
             return self.handle_ban_user(username, request["target"])
+        elif command == "stats":
+            return self.handle_stats(username)
         elif command == "chat_group":
             return self.handle_chat_group(username, request["group"], request["key"], request["message"])
         elif command == "chat_friend":
             return self.handle_chat_friend(username, request["friend"], request["message"])
         elif command == "list:messages":
-            return self.handle_list_messages(username, request["chat"])
+            return self.handle_list_messages(username, request["chat"], request.get("since"), request.get("epoch"), request.get("kind"))
+        elif command == "search":
+            return self.handle_search(username, request.get("query", ""), request.get("chat"), request.get("limit"), request.get("before"), request.get("kind"))
+        elif command == "inbox":
+            return self.handle_inbox(username)
+        elif command == "send_file":
+            return self.handle_send_file(username, request, addr)
+        elif command == "offline":
+            return self.handle_offline(username, request.get("ack", 0), addr, request.get("id"))
         else:
-            self.log_message(f"Unknown command: {command}")
-            return None
+            self.log_message("Unknown command: %s", command, level=logging.WARNING)
+            return {"error": f"unknown command: {command}"}
     
     # Command Handler Methods
     def handle_login(self, username):
         if username not in self.users:
             self.users[username] = {"online": True, "socket": None}
-            self.friends[username] = []
-            self.log_message(f"User registered: {username}")
+            self.friends.add_user(username)
+            self._bump_generation("list:cinners")
+            self.log_message("User registered: %s", username)
         else:
             self.users[username]["online"] = True
-            self.log_message(f"User logged in: {username}")
+            self.log_message("User logged in: %s", username)
         return None
     
     def handle_logout(self, username):
         if username in self.users:
             self.users[username]["online"] = False
-            self.log_message(f"User logged out: {username}")
+            self.log_message("User logged out: %s", username)
+        if self.presence.logout(username):
+            self._push_presence(username, False)
         return None
     
     def handle_list_cinners(self):
         return [user for user in self.users.keys()]
     
+    def handle_list_online(self):
+        return self.presence.online_users()
+    
     def handle_list_friends(self, username):
-        if username not in self.friends:
-            return []
-        return [friend for friend in self.friends[username]]
+        return self.friends.following_of(username)
     
     def handle_list_mygroups(self, username):
         user_groups = []
@@ -165,24 +319,17 @@ class Server:
         if friend_name not in self.users:
             return False
         
-        if username not in self.friends:
-            self.friends[username] = []
+        if self.friends.follow(username, friend_name):
+            self.log_message("%s is now following %s", username, friend_name, level=logging.DEBUG)
         
-        if friend_name not in self.friends[username]:
-            self.friends[username].append(friend_name)
-            self.log_message(f"{username} is now following {friend_name}")
-        
-        # Create a conversation key for direct messages
-        chat_key = self._get_direct_chat_key(username, friend_name)
-        if chat_key not in self.messages["direct"]:
-            self.messages["direct"][chat_key] = []
+        # Create the conversation for direct messages
+        self.messages.setdefault(self.conversations.direct(username, friend_name), [])
         
         return True
     
     def handle_unfollow(self, username, friend_name):
-        if username in self.friends and friend_name in self.friends[username]:
-            self.friends[username].remove(friend_name)
-            self.log_message(f"{username} unfollowed {friend_name}")
+        if self.friends.unfollow(username, friend_name):
+            self.log_message("%s unfollowed %s", username, friend_name, level=logging.DEBUG)
             return True
         return False
     
@@ -193,24 +340,31 @@ class Server:
         # Generate a random key for the group
         key = ''.join(random.choices(string.ascii_uppercase + string.digits, k=6))
         
+        chat = self.conversations.create_group(group_name)
         self.groups[group_name] = {
             "owner": username,
             "members": [username],
-            "key": key
+            "key": key,
+            "chat": chat
         }
         
         # Create message storage for the group
-        self.messages["group"][group_name] = []
+        self.messages[chat] = []
+        self.inbox.join(username, chat)
+        self._bump_generation("list:groups")
         
-        self.log_message(f"Group created: {group_name} by {username} with key {key}")
+        self.log_message("Group created: %s by %s with key %s", group_name, username, key)
         return True
     
     def handle_delete_group(self, username, group_name):
         if group_name in self.groups and self.groups[group_name]["owner"] == username:
-            del self.groups[group_name]
-            if group_name in self.messages["group"]:
-                del self.messages["group"][group_name]
-            self.log_message(f"Group deleted: {group_name} by {username}")
+            chat = self.groups.pop(group_name)["chat"]
+            self._forget(chat, self.messages.pop(chat, []), "deleted")
+            self.search_index.remove_chat(chat)
+            self.inbox.remove_chat(chat)
+            self.conversations.delete_group(group_name)
+            self._bump_generation("list:groups")
+            self.log_message("Group deleted: %s by %s", group_name, username)
             return True
         return False
     
@@ -224,7 +378,9 @@ class Server:
         if username == group["owner"] or key == group["key"]:
             if username not in group["members"]:
                 group["members"].append(username)
-                self.log_message(f"{username} joined group: {group_name}")
+                self.inbox.join(username, group["chat"])
+                self._bump_generation("list:groups")
+                self.log_message("%s joined group: %s", username, group_name)
             return True
         return False
     
@@ -238,7 +394,9 @@ class Server:
             
             if username in group["members"]:
                 group["members"].remove(username)
-                self.log_message(f"{username} left group: {group_name}")
+                self.inbox.leave(username, group["chat"])
+                self._bump_generation("list:groups")
+                self.log_message("%s left group: %s", username, group_name)
                 return True
         return False
     
@@ -247,10 +405,16 @@ class Server:
         # In a real app, you'd check admin privileges
         if username == "admin" and target_user not in self.banned_users:
             self.banned_users.append(target_user)
-            self.log_message(f"User banned: {target_user} by {username}")
+            self.log_message("User banned: %s by %s", target_user, username)
             return True
         return False
     
+    def handle_stats(self, username):
+        # Same admin rule as ban: metrics reveal who is online and how busy the server is
+        if username != "admin":
+            return False
+        return self.metrics.snapshot()
+    
     def handle_chat_group(self, username, group_name, key, message):
         if group_name not in self.groups:
             return False
@@ -262,61 +426,314 @@ class Server:
             return False
         
         # Store the message
-        new_message = {
-            "sender": username,
-            "content": message,
-            "timestamp": datetime.now().isoformat()
-        }
-        
-        self.messages["group"][group_name].append(new_message)
-        self.log_message(f"Group message to {group_name} from {username}: {message}")
+        stored = self._store_message(group["chat"], username, message)
+        self.search_index.add(group["chat"], stored)
+        self.inbox.add(group["chat"], stored)
+        self.log_message("Group message to %s from %s: %s", group_name, username, message, level=logging.DEBUG)
         
         return True
     
     def handle_chat_friend(self, username, friend_name, message):
-        if friend_name not in self.users or username not in self.friends.get(friend_name, []):
+        if friend_name not in self.users or not self.friends.follows(friend_name, username):
             return False
         
         # Store the message
-        chat_key = self._get_direct_chat_key(username, friend_name)
-        if chat_key not in self.messages["direct"]:
-            self.messages["direct"][chat_key] = []
-        
-        new_message = {
-            "sender": username,
-            "content": message,
-            "timestamp": datetime.now().isoformat()
-        }
-        
-        self.messages["direct"][chat_key].append(new_message)
-        self.log_message(f"Direct message to {friend_name} from {username}: {message}")
+        chat = self.conversations.direct(username, friend_name)
+        stored = self._store_message(chat, username, message)
+        self.search_index.add(chat, stored)
+        self.inbox.join(friend_name, chat)
+        self.inbox.add(chat, stored)
+        if not self.presence.is_online(friend_name):
+            # Kept apart from the history, so catching up at login does not mean going through every chat
+            self.offline.add(friend_name, {"chat": self.conversations.names[chat], **stored})
+        self.log_message("Direct message to %s from %s: %s", friend_name, username, message, level=logging.DEBUG)
         
         return True
 
-    def handle_list_messages(self, username, chat_name):
-        # Check if it's a direct chat
-        if "_" in chat_name:
-            parts = chat_name.split("_")
-            if len(parts) == 2 and (username == parts[0] or username == parts[1]):
-                chat_key = self._get_direct_chat_key(parts[0], parts[1])
-                return self.messages["direct"].get(chat_key, [])
+    def handle_list_messages(self, username, chat_name, since=None, epoch=None, kind=None):
+        chat = self._readable_chat(username, chat_name, kind)
+        if chat is None:
+            return []
+        history = self.messages.get(chat, [])
+        if since is None:
+            self.inbox.mark_read(username, chat, 0)
+            return history
         
-        # Check if it's a group chat
-        elif chat_name in self.groups:
+        # Clients with a cache only get what is newer than their last id, unless that id is from a previous run
+        if epoch != self.epoch:
+            since = 0
+        start = bisect.bisect_right(history, since, key=lambda message: message["id"])
+        delta = history[start:start + MAX_MESSAGES_PER_SYNC]
+        # What the reply delivers counts as read
+        self.inbox.mark_read(username, chat, len(history) - start - len(delta))
+        return {"epoch": self.epoch, "messages": delta, "more": start + len(delta) < len(history)}
+    
+    def handle_offline(self, username, ack, addr, request_id=None):
+        # The client acknowledges everything up to `ack` (the number of the last message it got), which
+        # removes it from the queue, and is sent the next window: up to OFFLINE_WINDOW replies at once,
+        # so it catches up in a few round-trips. The last reply of the window has "window_end"; if
+        # "remaining" is not 0 the client asks again, acknowledging what it got.
+        if ack:
+            self.offline.ack(username, ack)
+        batches, remaining = self.offline.window(username, OFFLINE_BATCH, OFFLINE_WINDOW)
+        if not batches:
+            return {"messages": [], "window_end": True, "remaining": 0}
+        for i, batch in enumerate(batches):
+            reply = {"messages": [{"number": number, **message} for number, message in batch],
+                     "window_end": i == len(batches) - 1, "remaining": remaining}
+            self._reply(json.dumps(reply).encode(), addr, request_id)
+        return None
+
+    def handle_inbox(self, username):
+        # One reply for every chat of the user: unread count and a preview of the last message
+        names = self.conversations.names
+        return [{"chat": names[chat], "unread": unread, "last": last} for chat, unread, last in self.inbox.summary(username)]
+    
+    def handle_search(self, username, query, chat_name=None, limit=None, before=None, kind=None):
+        # Searches the chats list:messages would show this user (or just chat_name), newest hits first;
+        # the next page is requested with before=<id of the last hit>
+        if chat_name is not None:
+            chat = self._readable_chat(username, chat_name, kind)
+            chats = [chat] if chat else []
+        else:
+            chats = self.conversations.direct_chats(username)
+            chats += [group["chat"] for group in self.groups.values()
+                      if username in group["members"] or username == group["owner"]]
+        limit = min(int(limit or MAX_SEARCH_RESULTS), MAX_SEARCH_RESULTS)
+        hits, more = self.search_index.search(query, chats, limit, before)
+        names = self.conversations.names
+        return {"hits": [dict(message, chat=names[chat]) for chat, message in hits], "more": more}
+    
+    def _readable_chat(self, username, chat_name, kind=None):
+        # Conversation id of the chat if the user may read it, otherwise None. A group the user is in is
+        # found by its name; a direct chat by the peer's username or by "user1_user2". If a name could be
+        # both, the group wins unless the request says kind="direct".
+        if kind != "direct" and chat_name in self.groups:
             group = self.groups[chat_name]
             if username in group["members"] or username == group["owner"]:
-                return self.messages["group"].get(chat_name, [])
+                return group["chat"]
+        if kind != "group":
+            return self.conversations.find_direct(username, chat_name)
+        return None
+    
+    def handle_send_file(self, username, request, addr):
+        self._close_idle_uploads()
+        previous = self.uploads.pop(addr, None)
+        if previous:
+            previous.close()
+
+        try:
+            # The username and the file name become a path under FILES_DIR: each must be one plain component
+            if not is_safe_filename(username) or not is_safe_filename(request["name"]):
+                raise ValueError("unsafe user or file name")
+            receiver = file_transfer.FileReceiver(
+                os.path.join(FILES_DIR, username),
+                request["name"],
+                int(request["size"]),
+                request["sha256"],
+                int(request.get("chunk_size", file_transfer.FILE_CHUNK_SIZE))
+            )
+        except (KeyError, TypeError, ValueError, OSError) as e:
+            self.log_message("Rejected upload from %s: %s", username, str(e), level=logging.WARNING)
+            return {"ok": False, "error": str(e)}
+
+        # Nothing left to send (empty file or everything received before): verify right away
+        if receiver.complete:
+            ok = receiver.finish()
+            self.log_message("Upload of %s from %s finished, integrity %s", receiver.name, username, 'ok' if ok else 'FAILED')
+            return {"offset": receiver.next_chunk, "ok": ok}
+
+        self.uploads[addr] = receiver
+        if receiver.next_chunk:
+            self.log_message("Resuming upload of %s from %s at chunk %s/%s", receiver.name, username, receiver.next_chunk, receiver.total_chunks)
+        else:
+            self.log_message("Receiving %s from %s (%s bytes)", receiver.name, username, receiver.size)
+        return {"offset": receiver.next_chunk}
+
+    def handle_file_chunk(self, addr, data):
+        receiver = self.uploads.get(addr)
+        if receiver is None:
+            self.log_message("Dropped file chunk from %s: no upload in progress", addr, level=logging.WARNING)
+            return None
+
+        try:
+            index, chunk = file_transfer.parse_chunk(data)
+        except ValueError as e:
+            self.log_message("Damaged file chunk from %s: %s", addr, str(e), level=logging.WARNING)
+            return self._resend_chunks(addr, receiver)
+        if not receiver.write_chunk(index, chunk):
+            # The expected chunk was damaged and dropped before it got here
+            return self._resend_chunks(addr, receiver)
+        if not receiver.complete:
+            return None
+
+        del self.uploads[addr]
+        ok = receiver.finish()
+        self.log_message("Upload of %s finished, integrity %s", receiver.name, 'ok' if ok else 'FAILED')
+        return {"ok": ok, "name": receiver.name}
+
+    def _resend_chunks(self, addr, receiver):
+        # Chunks are only written in order, so the sender restarts from the first missing one with a new
+        # send_file; it is asked once per pass, the rest of the pass is discarded
+        index = receiver.request_resend()
+        if index is None:
+            return None
+        self.log_message("Asking %s to resend %s from chunk %s", addr, receiver.name, index, level=logging.WARNING)
+        return {"resend": index, "name": receiver.name}
+
+    def _damaged_chunk(self, addr, data):
+        # A chunk whose tag byte was corrupted does not look like a chunk, nor like a command (which starts
+        # with "{"): with an upload in progress it is taken as a damaged chunk
+        receiver = self.uploads.get(addr)
+        if receiver is None or data[:1] == b"{":
+            return None
+        return self._resend_chunks(addr, receiver)
+
+    def _close_idle_uploads(self):
+        now = time.time()
+        for addr, receiver in list(self.uploads.items()):
+            if now - receiver.last_activity > UPLOAD_IDLE_TIMEOUT:
+                receiver.close()
+                del self.uploads[addr]
+
+    def handle_datagram(self, data, addr):
+        # Heartbeats arrive as unreliable datagrams: nothing is sent back
+        try:
+            request = json.loads(data.decode())
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            return
+        username = request.get("user", "")
+        if request.get("command") == "heartbeat" and username in self.users and username not in self.banned_users:
+            self._expire_presence()
+            self._mark_online(username, addr)
+    
+    def _mark_online(self, username, addr):
+        self.addresses[username] = addr
+        self.users[username]["online"] = True
+        if self.presence.heartbeat(username):
+            self.log_message("%s is online", username)
+            self._push_presence(username, True)
+    
+    def _expire_presence(self):
+        for username in self.presence.expire():
+            if username in self.users:
+                self.users[username]["online"] = False
+            self.log_message("%s stopped sending heartbeats, now offline", username)
+            self._push_presence(username, False)
+    
+    def _push_presence(self, username, online):
+        # Presence changes are pushed as datagrams to online followers; a lost one is fixed by list:online
+        event = json.dumps({"event": "presence", "user": username, "online": online}).encode()
+        for follower in self.friends.followers_of(username):
+            if self.presence.is_online(follower) and follower in self.addresses:
+                self.socket.send_datagram(event, self.addresses[follower])
+    
+    def _reply(self, reply, addr, request_id=None):
+        if request_id is not None:
+            # Wrapped without parsing the reply again, so cached listings stay serialized once
+            reply = b'{"id": ' + json.dumps(request_id).encode() + b', "reply": ' + reply + b'}'
+        # Replies do not wait for the client's ACK, so a slow client only delays itself. One that stopped
+        # reading its replies altogether has a full queue: the reply is dropped rather than queued without end
+        if not self.socket.send_nowait(reply, addr):
+            self.dropped_replies.inc()
+            self.log_message("Dropped reply to %s: too many unacknowledged replies", addr, level=logging.WARNING)
+    
+    def _throttle(self, username, addr):
+        # 0 if the request may be handled, otherwise the seconds the client should wait
+        retry_after, scope = self.user_limiter.take(username), "user"
+        if not retry_after:
+            retry_after, scope = self.ip_limiter.take(addr[0]), "ip"
+        if retry_after:
+            self.throttled.inc(scope=scope)
+            self.log_message("Throttled %s (%s limit), retry after %.3fs", username, scope, retry_after, level=logging.DEBUG)
+        return retry_after
+    
+    def _record_request(self, command, received_at):
+        self.requests.inc(command=command)
+        self.request_latency.observe(time.perf_counter() - received_at, command=command)
+    
+    def _bump_generation(self, listing):
+        self.generations[listing] += 1
+    
+    def _cached_listing(self, listing, build, version):
+        # Clients that send a version get {"version", "items"}, or just "not modified" if they are up to date.
+        # The version includes the epoch so versions from before a restart never match.
+        current = f"{self.epoch}.{self.generations[listing]}"
+        if version == current:
+            return json.dumps({"version": current, "not_modified": True}).encode()
         
-        return []
+        versioned = version is not None
+        cached = self.response_cache.get((listing, versioned))
+        if cached is None or cached[0] != current:
+            items = build()
+            reply = {"version": current, "items": items} if versioned else items
+            cached = (current, json.dumps(reply).encode())
+            self.response_cache[(listing, versioned)] = cached
+        return cached[1]
     
-    def _get_direct_chat_key(self, user1, user2):
-        # Sort usernames alphabetically to ensure consistency
-        return "_".join(sorted([user1, user2]))
+    def _store_message(self, chat, username, message):
+        history = self.messages.setdefault(chat, [])
+        over_cap = self.retention.over_cap(history)
+        if over_cap:
+            self._evict(chat, history, over_cap, "cap")
+        
+        self.last_message_id += 1
+        stored = {
+            "id": self.last_message_id,
+            "sender": username,
+            "content": message,
+            "timestamp": datetime.now().isoformat()
+        }
+        history.append(stored)
+        self.retention.stored(stored)
+        return stored
+    
+    def _compact(self):
+        # One bounded step every few seconds, so dropping old messages never stalls the requests
+        now = time.time()
+        if not self.retention.due(now):
+            return
+        for chat, count, reason in self.retention.plan(list(self.messages.items()), now):
+            self._evict(chat, self.messages[chat], count, reason)
+    
+    def _evict(self, chat, history, count, reason):
+        # Drop the oldest `count` messages of the chat; the search index forgets them too
+        dropped = history[:count]
+        del history[:count]
+        self.search_index.trim(chat, dropped)
+        self._forget(chat, dropped, reason)
+        self.log_message("Dropped %s old messages of %s %s (%s)", count, self.conversations.kinds[chat],
+                         self.conversations.names[chat], reason, level=logging.DEBUG)
+    
+    def _forget(self, chat, messages, reason):
+        if not messages:
+            return
+        self.retention.dropped(messages)
+        self.evicted.inc(len(messages), reason=reason)
+        if self.archiver:
+            self.archiver.archive((self.conversations.kinds[chat], self.conversations.names[chat]), messages)
 
 # Start the server when run as a script
 if __name__ == "__main__":
-    server = Server()
+    parser = argparse.ArgumentParser(description="Chat server")
+    parser.add_argument("--metrics-port", type=int, help="serve metrics over HTTP on this local port")
+    parser.add_argument("--profile", metavar="FILE", help="run the request loop under cProfile and write its stats here on shutdown")
+    parser.add_argument("--trace", metavar="FILE", help="record tracing spans and write them here on shutdown (Chrome trace JSON, or folded stacks if FILE ends in .folded)")
+    parser.add_argument("--trace-sample", type=float, default=1.0, help="fraction of requests and packets traced (default: 1.0)")
+    parser.add_argument("--archive", metavar="DIR", help="append messages dropped from the histories to JSON-lines files here, one per chat")
+    parser.add_argument("--offline-dir", metavar="DIR", help="keep the messages queued for offline users in JSON-lines files here, so they survive a restart")
+    parser.add_argument("--log-level", help="DEBUG traces every request and packet, e.g. DEBUG or rdt=DEBUG,server=INFO (default: $RDT_LOG_LEVEL or INFO)")
+    args = parser.parse_args()
+    configure_logging(args.log_level)
+    if args.trace:
+        tracing.enable(args.trace_sample)
+
+    server = Server(metrics_port=args.metrics_port, profile_path=args.profile, archive_dir=args.archive, offline_dir=args.offline_dir)
     try:
         server.start()
     except KeyboardInterrupt:
         print("\nServer shutting down...")
+    finally:
+        if args.trace:
+            spans, dropped = tracing.write(args.trace)
+            print(f"Trace written to {args.trace}: {spans} spans, {dropped} dropped")
@@ -0,0 +1,70 @@
+"""
+Compara bytes no fio e tempo de CPU da compressão de payloads (sem compressão, zlib puro e zlib com o
+dicionário pré-carregado) para respostas típicas de list:messages e list:groups de vários tamanhos.
+Serve para ajustar o COMPRESSION_THRESHOLD de rdt/compression.py.
+
+Uso: python -m bench.compression --sizes 1 2 5 10 20 50 --repeat 2000
+"""
+
+import json
+import zlib
+import random
+import timeit
+import argparse
+import datetime
+
+from rdt import compression
+
+WORDS = ["oi", "tudo", "bem", "vamos", "hoje", "amanhã", "reunião", "projeto", "grupo", "ok", "valeu", "rdt",
+         "pacote", "entrega", "prazo", "código", "servidor", "cliente", "teste", "sim", "não", "depois"]
+USERS = ["alice", "bob", "carol", "dave", "erin", "frank"]
+
+def sample_messages(count, rng):
+    """Resposta de list:messages com `count` mensagens"""
+    start = datetime.datetime(2026, 3, 1, 9, 0)
+    messages = []
+    for i in range(count):
+        messages.append({
+            "id": i + 1,
+            "sender": rng.choice(USERS),
+            "content": " ".join(rng.choice(WORDS) for _ in range(rng.randint(2, 10))),
+            "timestamp": (start + datetime.timedelta(seconds=37 * i)).isoformat(),
+        })
+    return json.dumps(messages).encode('utf-8')
+
+def sample_groups(count, rng):
+    """Resposta de list:groups com `count` grupos"""
+    groups = [{"name": f"grupo_{rng.choice(WORDS)}_{i}", "owner": rng.choice(USERS), "key": "",
+               "members": rng.randint(1, 20)} for i in range(count)]
+    return json.dumps(groups).encode('utf-8')
+
+def plain_compress(data):
+    return zlib.compress(data, compression.COMPRESSION_LEVEL)
+
+def measure(payload, repeat):
+    """Retorna (bytes zlib, bytes zlib+dict, µs para comprimir, µs para descomprimir) com o dicionário"""
+    packed = compression.compress(payload)
+    compress_us = timeit.timeit(lambda: compression.compress(payload), number=repeat) / repeat * 1e6
+    decompress_us = timeit.timeit(lambda: compression.decompress(packed), number=repeat) / repeat * 1e6
+    return len(plain_compress(payload)), len(packed), compress_us, decompress_us
+
+def main():
+    parser = argparse.ArgumentParser(description="Bytes e CPU da compressão de payloads por tamanho")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 2, 3, 5, 10, 20, 50],
+                        help="quantidade de mensagens/grupos em cada resposta")
+    parser.add_argument("--repeat", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    print(f"threshold atual: {compression.COMPRESSION_THRESHOLD} bytes")
+    print(f"{'kind':<9} {'items':>5} {'raw':>7} {'zlib':>7} {'zlib+dict':>9} {'ratio':>6} {'comp µs':>8} {'decomp µs':>9}")
+    for kind, make in (("messages", sample_messages), ("groups", sample_groups)):
+        for count in args.sizes:
+            payload = make(count, rng)
+            plain, packed, compress_us, decompress_us = measure(payload, args.repeat)
+            ratio = packed / len(payload)
+            print(f"{kind:<9} {count:>5} {len(payload):>7} {plain:>7} {packed:>9} {ratio:>6.2f} {compress_us:>8.1f} {decompress_us:>9.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Mede a vazão do envio em janela do RDTSocket para várias taxas de perda e exporta o trace de cwnd de cada
+execução em CSV, para plotar vazão x perda e a evolução da janela.
+
+Uso: python -m bench.cwnd_trace --loss 0 0.05 0.1 0.2 --messages 300 --algorithm reno
+"""
+
+import os
+import sys
+import time
+import argparse
+import threading
+import contextlib
+
+import rdt.rdt3 as rdt3
+from rdt import CONGESTION_CONTROLLERS
+
+RECEIVER_PORT = 5101
+OUTPUT_DIR = "./bench_output"
+
+def run_transfer(loss, messages, size, algorithm):
+    """Transfere `messages` mensagens de `size` bytes com a perda dada; retorna (segundos, controlador)"""
+    rdt3.LOSS_PROB = loss
+    rdt3.CORRUPT_PROB = loss
+
+    receiver = rdt3.RDTSocket(port=RECEIVER_PORT)
+    sender = rdt3.RDTSocket(congestion_control=CONGESTION_CONTROLLERS[algorithm])
+
+    def drain():
+        for _ in range(messages):
+            if receiver.recv() is None:
+                return
+
+    receiver_thread = threading.Thread(target=drain, daemon=True)
+    receiver_thread.start()
+
+    sender.connect(('localhost', RECEIVER_PORT))
+    session = sender.sessions[sender.connection.last_remote_addr]
+    payload = os.urandom(size)
+
+    start = time.time()
+    sender.send_window([payload] * messages)
+    receiver_thread.join()
+    elapsed = time.time() - start
+
+    sender.close()
+    receiver.close()
+    return elapsed, session.cc
+
+def main():
+    parser = argparse.ArgumentParser(description="Vazão e trace de cwnd do RDTSocket por taxa de perda")
+    parser.add_argument("--loss", type=float, nargs="+", default=[0.0, 0.05, 0.1, 0.2])
+    parser.add_argument("--messages", type=int, default=300)
+    parser.add_argument("--size", type=int, default=1000)
+    parser.add_argument("--algorithm", choices=sorted(CONGESTION_CONTROLLERS), default="reno")
+    parser.add_argument("--min-delay", type=float, default=0.0)
+    parser.add_argument("--max-delay", type=float, default=0.002)
+    args = parser.parse_args()
+
+    rdt3.MIN_DELAY = args.min_delay
+    rdt3.MAX_DELAY = args.max_delay
+    os.makedirs(os.path.dirname(rdt3.LOG_FILE), exist_ok=True)
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+
+    print(f"{'loss':>6} {'seconds':>8} {'KB/s':>9} {'final cwnd':>11}  trace")
+    for loss in args.loss:
+        # Os logs do socket iriam para o terminal e dominariam o tempo medido
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            elapsed, cc = run_transfer(loss, args.messages, args.size, args.algorithm)
+
+        trace_path = os.path.join(OUTPUT_DIR, f"cwnd_{args.algorithm}_loss{loss:.2f}.csv")
+        cc.export_trace(trace_path)
+        throughput = args.messages * args.size / 1024 / elapsed
+        print(f"{loss:>6.2f} {elapsed:>8.2f} {throughput:>9.1f} {cc.cwnd:>11.2f}  {trace_path}")
+        sys.stdout.flush()
+
+if __name__ == "__main__":
+    main()
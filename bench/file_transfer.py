@@ -0,0 +1,71 @@
+"""
+Mede a vazão (MB/s) do send_file entre um Client e um Server locais para várias taxas de perda,
+conferindo a integridade de cada arquivo recebido.
+
+Uso: python -m bench.file_transfer --loss 0 0.05 0.1 --size-kb 256
+"""
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+import threading
+import contextlib
+
+import rdt.rdt3 as rdt3
+import Server.server as server_module
+from Server.server import Server
+from Client.client import Client
+from rdt import file_transfer
+
+def set_impairments(sock, loss):
+    sock.connection.loss_prob = loss
+    sock.connection.corrupt_prob = loss
+
+def main():
+    parser = argparse.ArgumentParser(description="Vazão do send_file por taxa de perda")
+    parser.add_argument("--loss", type=float, nargs="+", default=[0.0, 0.05, 0.1])
+    parser.add_argument("--size-kb", type=int, default=256)
+    parser.add_argument("--min-delay", type=float, default=0.0)
+    parser.add_argument("--max-delay", type=float, default=0.002)
+    args = parser.parse_args()
+
+    rdt3.MIN_DELAY = args.min_delay
+    rdt3.MAX_DELAY = args.max_delay
+    os.makedirs(os.path.dirname(rdt3.LOG_FILE), exist_ok=True)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        server_module.FILES_DIR = os.path.join(workdir, "received")
+
+        # Os logs do socket iriam para o terminal e dominariam o tempo medido
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            server = Server()
+            threading.Thread(target=server.start, daemon=True).start()
+            client = Client("bench")
+
+        print(f"{'loss':>6} {'seconds':>8} {'MB/s':>8}  integrity")
+        for run, loss in enumerate(args.loss):
+            path = os.path.join(workdir, f"payload_{run}.bin")
+            with open(path, "wb") as f:
+                f.write(os.urandom(args.size_kb * 1024))
+
+            set_impairments(server.socket, loss)
+            set_impairments(client.socket, loss)
+
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                start = time.time()
+                ok = client.send_file(path)
+                elapsed = time.time() - start
+
+            received = os.path.join(server_module.FILES_DIR, "bench", os.path.basename(path))
+            ok = ok and os.path.exists(received) and file_transfer.file_digest(received) == file_transfer.file_digest(path)
+            throughput = args.size_kb / 1024 / elapsed
+            print(f"{loss:>6.2f} {elapsed:>8.2f} {throughput:>8.3f}  {'ok' if ok else 'FAILED'}")
+            sys.stdout.flush()
+
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            client.socket.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,330 @@
+"""
+Gerador de carga para o servidor de chat: N clientes simulados (threads) enviam uma mistura configurável
+de comandos para um Server local, rodando num subprocesso com as probabilidades de perda/corrupção e o
+atraso dados. Mede requisições/s, latência p50/p99 por comando, retransmissões e CPU/memória do servidor,
+e grava tudo em JSON para comparar execuções entre commits.
+
+Com --flooders, usuários extras (noutro processo, num grupo só deles) mandam chat_group em rajadas, sem
+pausa, enquanto os N clientes (de preferência com ritmo, --client-rate) são medidos: com --rate-limit o
+servidor usa os limites por usuário/IP dele, e a latência dos clientes bem-comportados deve continuar a
+mesma de sem flood. Sem --rate-limit o servidor roda praticamente sem limites, para medir a capacidade.
+
+Uso: python -m bench.load --clients 8 --requests 50 --mix chat_group=4 chat_friend=3 list:messages=2 list:cinners=1
+     python -m bench.load --clients 8 --requests 50 --client-rate 5 --flooders 2 --rate-limit
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import signal
+import argparse
+import resource
+import tempfile
+import threading
+import contextlib
+import subprocess
+
+import rdt.rdt3 as rdt3
+
+OUTPUT_DIR = "./bench_output"
+GROUP_NAME = "loadgroup"
+FLOOD_GROUP_NAME = "floodgroup"
+FLOOD_BATCH = 32  # Requisições que cada flooder envia de uma vez antes de ler as respostas
+DEFAULT_MIX = ["chat_group=4", "chat_friend=3", "list:messages=2", "list:cinners=1", "list:groups=1"]
+
+# Cada comando da mistura: função(cliente, chave do grupo, amigo para o chat_friend) -> sucesso
+COMMANDS = {
+    "chat_group": lambda client, key, peer: client.chat_group(GROUP_NAME, key, f"load from {client.username}"),
+    "chat_friend": lambda client, key, peer: client.chat_friend(peer, f"hi {peer}"),
+    "list:messages": lambda client, key, peer: client.sync_messages(GROUP_NAME) is not None,
+    "list:cinners": lambda client, key, peer: client.list_cinners() is not None,
+    "list:groups": lambda client, key, peer: client.list_groups() is not None,
+    "list:friends": lambda client, key, peer: client.list_friends() is not None,
+    "list:online": lambda client, key, peer: client.list_online() is not None,
+}
+
+def set_impairments(loss, corrupt, min_delay, max_delay):
+    rdt3.LOSS_PROB = loss
+    rdt3.CORRUPT_PROB = corrupt
+    rdt3.MIN_DELAY = min_delay
+    rdt3.MAX_DELAY = max_delay
+
+def serve(args):
+    """Modo subprocesso: roda o Server até receber SIGINT e grava as retransmissões dele em --stats-file"""
+    set_impairments(args.loss, args.corrupt, args.min_delay, args.max_delay)
+    import Server.server as server_module
+    if not args.rate_limit:
+        server_module.USER_RATE = server_module.USER_BURST = server_module.IP_RATE = server_module.IP_BURST = 1e9
+
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        server = server_module.Server()
+        open(args.stats_file + ".ready", "w").close()
+        server.start()
+
+    with open(args.stats_file, "w") as stats:
+        json.dump({"retransmissions": server.socket.retransmissions.total(), "throttled": server.throttled.total()}, stats)
+
+def start_server(args, stats_file):
+    command = [sys.executable, "-m", "bench.load", "--serve", "--stats-file", stats_file,
+               "--loss", str(args.loss), "--corrupt", str(args.corrupt),
+               "--min-delay", str(args.min_delay), "--max-delay", str(args.max_delay)]
+    if args.rate_limit:
+        command.append("--rate-limit")
+    process = subprocess.Popen(command)
+    while not os.path.exists(stats_file + ".ready"):
+        if process.poll() is not None:
+            raise RuntimeError("server process exited before starting")
+        time.sleep(0.05)
+    return process
+
+def stop_server(process, stats_file):
+    """Encerra o servidor e retorna (estatísticas gravadas por ele, segundos de CPU, pico de memória em KB)"""
+    before = resource.getrusage(resource.RUSAGE_CHILDREN)  # Inclui os flooders, se já terminaram
+    process.send_signal(signal.SIGINT)
+    process.wait(timeout=30)
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    with open(stats_file) as stats:
+        server_stats = json.load(stats)
+    cpu = usage.ru_utime + usage.ru_stime - before.ru_utime - before.ru_stime
+    return server_stats, cpu, usage.ru_maxrss
+
+def flood(args):
+    """Modo subprocesso: --flooders usuários mandando chat_group sem parar até SIGINT; grava as respostas"""
+    set_impairments(args.loss, args.corrupt, args.min_delay, args.max_delay)
+    from Client.client import Client
+
+    stop = threading.Event()
+    signal.signal(signal.SIGINT, lambda signum, frame: stop.set())
+    replies = {"handled": 0, "busy": 0}
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        flooders = [Client(f"flood{i}") for i in range(args.flooders)]
+        for client in flooders:
+            client.login()
+        flooders[0].create_group(FLOOD_GROUP_NAME)
+        key = next(group["key"] for group in flooders[0].list_mygroups() if group["name"] == FLOOD_GROUP_NAME)
+        for client in flooders[1:]:
+            client.join_group(FLOOD_GROUP_NAME, key)
+        open(args.stats_file + ".ready", "w").close()
+
+        threads = [threading.Thread(target=run_flooder, args=(client, key, stop, replies)) for client in flooders]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for client in flooders:
+            client.socket.close()
+
+    with open(args.stats_file, "w") as stats:
+        json.dump(replies, stats)
+
+def start_flooders(args, stats_file):
+    command = [sys.executable, "-m", "bench.load", "--flood", "--flooders", str(args.flooders),
+               "--stats-file", stats_file, "--loss", str(args.loss), "--corrupt", str(args.corrupt),
+               "--min-delay", str(args.min_delay), "--max-delay", str(args.max_delay)]
+    process = subprocess.Popen(command)
+    while not os.path.exists(stats_file + ".ready"):
+        if process.poll() is not None:
+            raise RuntimeError("flood process exited before starting")
+        time.sleep(0.05)
+    return process
+
+def stop_flooders(process, stats_file):
+    """Para os flooders e retorna quantas requisições deles foram atendidas e quantas receberam busy"""
+    process.send_signal(signal.SIGINT)
+    process.wait(timeout=30)
+    with open(stats_file) as stats:
+        return json.load(stats)
+
+def parse_mix(entries, clients):
+    mix = {}
+    for entry in entries:
+        name, _, weight = entry.partition("=")
+        if name not in COMMANDS:
+            raise SystemExit(f"unknown command in mix: {name} (options: {', '.join(sorted(COMMANDS))})")
+        mix[name] = float(weight or 1)
+    if clients < 2:
+        mix.pop("chat_friend", None)  # Precisa de um amigo
+    return mix
+
+def setup_clients(count):
+    """Loga os clientes, cria o grupo comum e encadeia os follows (cada um segue o próximo)"""
+    from Client.client import Client
+
+    clients = [Client(f"load{i}") for i in range(count)]
+    for client in clients:
+        client.login()
+    clients[0].create_group(GROUP_NAME)
+    key = next(group["key"] for group in clients[0].list_mygroups() if group["name"] == GROUP_NAME)
+    for client in clients[1:]:
+        client.join_group(GROUP_NAME, key)
+    for i, client in enumerate(clients):
+        if count > 1:
+            client.follow(clients[(i + 1) % count].username)
+    return clients, key
+
+def run_client(client, key, peer, mix, requests, seed, samples, rate=0):
+    """Executa `requests` comandos sorteados da mistura, guardando (comando, segundos, sucesso).
+
+    Com `rate`, começa um comando a cada 1/rate segundos (ou logo que o anterior terminar, se atrasou).
+    """
+    rng = random.Random(seed)
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    next_start = time.perf_counter()
+    for _ in range(requests):
+        if rate:
+            time.sleep(max(0.0, next_start - time.perf_counter()))
+            next_start += 1 / rate
+        name = rng.choices(names, weights)[0]
+        start = time.perf_counter()
+        try:
+            ok = bool(COMMANDS[name](client, key, peer))
+        except Exception:
+            ok = False
+        samples.append((name, time.perf_counter() - start, ok))
+
+def run_flooder(client, key, stop, replies):
+    """Manda chat_group em rajadas de FLOOD_BATCH sem esperar cada resposta, até `stop`; conta as respostas"""
+    request = json.dumps({"command": "chat_group", "user": client.username, "group": FLOOD_GROUP_NAME, "key": key,
+                          "message": "flood"}).encode()
+    while not stop.is_set():
+        if client.socket.send_window([request] * FLOOD_BATCH) is False:
+            return
+        for _ in range(FLOOD_BATCH):
+            reply = client.socket.recv()
+            if reply is None:
+                return
+            replies["busy" if b"busy" in reply else "handled"] += 1
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+def summarize(samples, elapsed):
+    def stats(latencies, errors):
+        return {
+            "count": len(latencies),
+            "errors": errors,
+            "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+            "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+            "mean_ms": round(sum(latencies) / len(latencies) * 1000, 3),
+        }
+
+    by_command = {}
+    for name in sorted({name for name, _, _ in samples}):
+        latencies = [latency for command, latency, _ in samples if command == name]
+        errors = sum(1 for command, _, ok in samples if command == name and not ok)
+        by_command[name] = stats(latencies, errors)
+
+    total = stats([latency for _, latency, _ in samples], sum(1 for _, _, ok in samples if not ok))
+    total["requests_per_s"] = round(len(samples) / elapsed, 2)
+    return total, by_command
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description="Carga de N clientes contra um Server local")
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=50, help="comandos por cliente")
+    parser.add_argument("--mix", nargs="+", default=DEFAULT_MIX, help="comando=peso")
+    parser.add_argument("--loss", type=float, default=0.0)
+    parser.add_argument("--corrupt", type=float, default=0.0)
+    parser.add_argument("--min-delay", type=float, default=0.0)
+    parser.add_argument("--max-delay", type=float, default=0.002)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--client-rate", type=float, default=0, help="comandos/s de cada cliente (0: sem pausa)")
+    parser.add_argument("--flooders", type=int, default=0, help="usuários extras mandando chat_group sem parar")
+    parser.add_argument("--rate-limit", action="store_true", help="servidor com os limites por usuário/IP padrão")
+    parser.add_argument("--output", help="arquivo JSON (padrão: bench_output/load_<timestamp>.json)")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--flood", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--stats-file", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    os.makedirs(os.path.dirname(rdt3.LOG_FILE), exist_ok=True)
+    if args.serve:
+        serve(args)
+        return
+    if args.flood:
+        flood(args)
+        return
+
+    mix = parse_mix(args.mix, args.clients)
+    set_impairments(args.loss, args.corrupt, args.min_delay, args.max_delay)
+
+    import Client.client as client_module
+    with tempfile.TemporaryDirectory() as workdir:
+        client_module.CACHE_DIR = os.path.join(workdir, "cache")
+        stats_file = os.path.join(workdir, "server_stats.json")
+        server = start_server(args, stats_file)
+        flooders = start_flooders(args, stats_file + ".flood") if args.flooders else None
+        flood_replies = {"handled": 0, "busy": 0}
+        samples = []
+
+        try:
+            # Os logs do socket iriam para o terminal e dominariam o tempo medido
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                clients, key = setup_clients(args.clients)
+                threads = [
+                    threading.Thread(target=run_client, args=(client, key, clients[i - 1].username, mix,
+                                                              args.requests, args.seed + i, samples, args.client_rate))
+                    for i, client in enumerate(clients)
+                ]
+                start = time.perf_counter()
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+                elapsed = time.perf_counter() - start
+
+                # Os sockets dos clientes compartilham o registro padrão de métricas: o contador já é a soma
+                client_retransmissions = rdt3.REGISTRY.counter("rdt_retransmissions_total").total()
+                for client in clients:
+                    client.logout()
+                    client.socket.close()
+        finally:
+            if flooders:
+                flood_replies = stop_flooders(flooders, stats_file + ".flood")
+            server_stats, server_cpu, server_maxrss = stop_server(server, stats_file)
+
+    total, by_command = summarize(samples, elapsed)
+    report = {
+        "revision": git_revision(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {
+            "clients": args.clients, "requests_per_client": args.requests, "mix": mix,
+            "loss": args.loss, "corrupt": args.corrupt, "min_delay": args.min_delay, "max_delay": args.max_delay,
+            "seed": args.seed, "client_rate": args.client_rate, "flooders": args.flooders,
+            "rate_limit": args.rate_limit,
+        },
+        "elapsed_s": round(elapsed, 3),
+        "total": total,
+        "commands": by_command,
+        "retransmissions": {"clients": client_retransmissions, "server": server_stats["retransmissions"]},
+        "flood": dict(flood_replies, throttled=server_stats["throttled"]),
+        "server": {"cpu_s": round(server_cpu, 3), "max_rss_kb": server_maxrss},
+    }
+
+    print(f"{'command':<14} {'count':>6} {'errors':>6} {'p50 ms':>8} {'p99 ms':>8}")
+    for name, stats in list(by_command.items()) + [("total", total)]:
+        print(f"{name:<14} {stats['count']:>6} {stats['errors']:>6} {stats['p50_ms']:>8.2f} {stats['p99_ms']:>8.2f}")
+    print(f"{total['requests_per_s']:.1f} req/s, retransmissions {report['retransmissions']}, "
+          f"server cpu {report['server']['cpu_s']}s, max rss {server_maxrss} KB")
+    if args.flooders or server_stats["throttled"]:
+        print(f"flood: {report['flood']}")
+
+    output = args.output or os.path.join(OUTPUT_DIR, f"load_{time.strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"report: {output}")
+
+if __name__ == "__main__":
+    main()
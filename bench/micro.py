@@ -0,0 +1,157 @@
+"""
+Microbenchmarks das funções quentes do rdt3 (checksum, montagem/desmontagem de pacotes, corrupção simulada)
+para vários tamanhos de payload, e de uma troca completa send/recv entre dois RDTSockets locais, com e sem
+as perdas simuladas. Cada medida é o mínimo de várias repetições (estilo timeit), para variar pouco entre
+execuções. Com --compare, falha (código de saída 1) se algum benchmark ficou mais lento que o limite.
+
+Uso: python -m bench.micro --save bench_output/micro_base.json
+     python -m bench.micro --compare bench_output/micro_base.json --threshold 0.2
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import timeit
+import argparse
+import threading
+import contextlib
+import statistics
+
+import rdt.rdt3 as rdt3
+
+OUTPUT_DIR = "./bench_output"
+PAYLOAD_SIZES = [0, 64, 512, 1024]
+
+def payload(size, seed=42):
+    return random.Random(seed).randbytes(size)
+
+def time_call(func, repeat, min_time):
+    """ns por chamada: mínimo e mediana entre `repeat` rodadas de pelo menos `min_time` segundos cada"""
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    number = max(1, int(number * min_time / 0.2))
+    runs = [elapsed / number * 1e9 for elapsed in timer.repeat(repeat=repeat, number=number)]
+    return min(runs), statistics.median(runs)
+
+def primitive_benchmarks(sock, sizes):
+    """(nome, função) das funções puras do protocolo"""
+    benchmarks = []
+    for size in sizes:
+        data = payload(size)
+        packet = sock._make_pkt(1234, 7, rdt3.DATA_PKT, data, ack=6)
+        benchmarks += [
+            (f"calculate_checksum[{size}]", lambda data=data: rdt3.calculate_checksum(data)),
+            (f"_make_pkt[{size}]", lambda data=data: sock._make_pkt(1234, 7, rdt3.DATA_PKT, data, ack=6)),
+            (f"_unpack[{size}]", lambda packet=packet: sock._unpack(packet)),
+            (f"_corrupt_packet[{size}]", lambda packet=packet: sock.connection._corrupt_packet(packet)),
+        ]
+    benchmarks.append(("_make_ack", lambda: sock._make_ack(1234, 7)))
+    return benchmarks
+
+def loopback_exchange(size, exchanges, loss):
+    """ns por troca: o cliente envia `size` bytes e espera o eco (o ACK de cada lado vai de carona nos dados)"""
+    rdt3.LOSS_PROB = rdt3.CORRUPT_PROB = loss
+    server = rdt3.RDTSocket()
+    client = rdt3.RDTSocket()
+    client.connect(server.connection.local_addr)
+    data = payload(size)
+
+    def echo():
+        for _ in range(exchanges):
+            message, addr = server.recvfrom()
+            if message is None:
+                return
+            server.send(message)
+
+    thread = threading.Thread(target=echo, daemon=True)
+    thread.start()
+    start = time.perf_counter()
+    for _ in range(exchanges):
+        client.send(data)
+        client.recv()
+    elapsed = time.perf_counter() - start
+    thread.join()
+    client.close()
+    server.close()
+    return elapsed / exchanges * 1e9
+
+def run(args):
+    results = {}
+    rdt3.LOSS_PROB = rdt3.CORRUPT_PROB = 0.0
+    rdt3.MIN_DELAY = rdt3.MAX_DELAY = 0.0
+    random.seed(args.seed)
+
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        sock = rdt3.RDTSocket()
+        for name, func in primitive_benchmarks(sock, args.sizes):
+            best, median = time_call(func, args.repeat, args.min_time)
+            results[name] = {"ns": round(best, 1), "median_ns": round(median, 1), "noisy": False}
+        sock.close()
+
+        # As perdas simuladas dependem de sorteios e de timeouts: o resultado varia e não entra no --compare
+        for loss in (0.0, args.loss):
+            for size in (64, 1024):
+                runs = [loopback_exchange(size, args.exchanges, loss) for _ in range(args.loopback_repeat)]
+                results[f"loopback[{size},loss={loss}]"] = {
+                    "ns": round(min(runs), 1), "median_ns": round(statistics.median(runs), 1), "noisy": loss > 0,
+                }
+    return results
+
+def compare(results, baseline, threshold, include_noisy):
+    """Lista de (nome, razão) dos benchmarks mais lentos que a base além do limite"""
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None or (result["noisy"] and not include_noisy):
+            continue
+        ratio = result["ns"] / base["ns"] if base["ns"] else 1.0
+        if ratio > 1 + threshold:
+            regressions.append((name, ratio))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Microbenchmarks das primitivas do rdt3")
+    parser.add_argument("--sizes", type=int, nargs="+", default=PAYLOAD_SIZES, help="tamanhos de payload (bytes)")
+    parser.add_argument("--repeat", type=int, default=5, help="rodadas por benchmark (vale a mínima)")
+    parser.add_argument("--min-time", type=float, default=0.1, help="segundos por rodada")
+    parser.add_argument("--exchanges", type=int, default=50, help="trocas por rodada do loopback")
+    parser.add_argument("--loopback-repeat", type=int, default=3)
+    parser.add_argument("--loss", type=float, default=0.1, help="perda e corrupção simuladas no loopback com perdas")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--save", help="arquivo JSON (padrão: bench_output/micro_<timestamp>.json)")
+    parser.add_argument("--compare", help="JSON de uma execução anterior para comparar")
+    parser.add_argument("--threshold", type=float, default=0.2, help="lentidão máxima aceita no --compare (0.2 = 20%%)")
+    parser.add_argument("--include-noisy", action="store_true", help="também compara os loopbacks com perdas")
+    args = parser.parse_args()
+
+    results = run(args)
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+
+    print(f"{'benchmark':<28} {'ns/op':>12} {'median':>12} {'vs base':>8}")
+    for name, result in results.items():
+        base = baseline.get(name)
+        change = f"{result['ns'] / base['ns'] - 1:>+8.1%}" if base and base["ns"] else ""
+        print(f"{name:<28} {result['ns']:>12.1f} {result['median_ns']:>12.1f} {change}")
+
+    output = args.save or os.path.join(OUTPUT_DIR, f"micro_{time.strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump({"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": sys.version.split()[0],
+                   "results": results}, f, indent=2)
+    print(f"results: {output}")
+
+    if args.compare:
+        regressions = compare(results, baseline, args.threshold, args.include_noisy)
+        for name, ratio in regressions:
+            print(f"REGRESSION {name}: {ratio:.2f}x the baseline (limit {1 + args.threshold:.2f}x)")
+        if regressions:
+            sys.exit(1)
+        print(f"no regressions above {args.threshold:.0%}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+Latência do comando search: monta o índice invertido do servidor com N mensagens sintéticas espalhadas em
+vários chats (palavras com frequência de Zipf, como texto real) e mede p50/p99 de buscas por palavras
+comuns, raras e combinadas, para um usuário que lê parte dos chats. Mede também o custo de indexar.
+
+Uso: python -m bench.search --messages 1000000 --chats 200 --readable 20
+"""
+
+import time
+import random
+import argparse
+import itertools
+
+from Server.search import SearchIndex
+
+def vocabulary(size):
+    return [f"w{i}" for i in range(size)]
+
+def build(index, messages, chats, words, rng):
+    """Indexa as mensagens e retorna os segundos gastos só no index.add"""
+    cumulative = list(itertools.accumulate(1 / (rank + 1) for rank in range(len(words))))
+    elapsed = 0.0
+    for message_id in range(1, messages + 1):
+        content = " ".join(rng.choices(words, cum_weights=cumulative, k=rng.randint(3, 12)))
+        chat = rng.randrange(chats)
+        start = time.perf_counter()
+        index.add(chat, {"id": message_id, "sender": "u", "content": content})
+        elapsed += time.perf_counter() - start
+    return elapsed
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+def main():
+    parser = argparse.ArgumentParser(description="Latência de busca no índice invertido")
+    parser.add_argument("--messages", type=int, default=1000000)
+    parser.add_argument("--chats", type=int, default=200)
+    parser.add_argument("--readable", type=int, default=20, help="chats que o usuário da busca pode ler")
+    parser.add_argument("--vocabulary", type=int, default=20000)
+    parser.add_argument("--queries", type=int, default=500, help="buscas por tipo")
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    words = vocabulary(args.vocabulary)
+    index = SearchIndex()
+    elapsed = build(index, args.messages, args.chats, words, rng)
+    print(f"indexed {args.messages} messages in {elapsed:.1f}s ({elapsed / args.messages * 1e6:.1f} µs/message)")
+
+    chats = rng.sample(range(args.chats), args.readable)
+    kinds = {
+        "common": lambda: rng.choice(words[:10]),
+        "rare": lambda: rng.choice(words[-1000:]),
+        "two words": lambda: f"{rng.choice(words[:50])} {rng.choice(words[:500])}",
+        "next page": lambda: rng.choice(words[:10]),
+    }
+
+    print(f"{'query':<10} {'p50 ms':>8} {'p99 ms':>8} {'hits':>6}")
+    for kind, make_query in kinds.items():
+        latencies, total_hits = [], 0
+        for _ in range(args.queries):
+            query = make_query()
+            before = rng.randint(1, args.messages) if kind == "next page" else None
+            start = time.perf_counter()
+            hits, _ = index.search(query, chats, args.limit, before)
+            latencies.append(time.perf_counter() - start)
+            total_hits += len(hits)
+        print(f"{kind:<10} {percentile(latencies, 0.5) * 1000:>8.3f} {percentile(latencies, 0.99) * 1000:>8.3f} "
+              f"{total_hits / args.queries:>6.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+Mede o custo dos logs com o trace desligado (nível INFO, o padrão) e ligado (DEBUG): pacotes por segundo num
+par de RDTSockets locais, comandos por segundo no Server (sem rede) e o custo de uma única chamada de log.
+Com o trace ligado a saída vai para /dev/null, então o número mede a formatação, não o terminal.
+
+Uso: python -m bench.tracing --messages 2000 --commands 20000
+"""
+
+import os
+import time
+import argparse
+import threading
+import contextlib
+
+import rdt.rdt3 as rdt3
+from rdt.log import configure
+
+LEVELS = {"off": "INFO", "on": "DEBUG"}
+
+def measure(func):
+    """(segundos de relógio, segundos de CPU) de func()"""
+    wall, cpu = time.perf_counter(), time.process_time()
+    func()
+    return time.perf_counter() - wall, time.process_time() - cpu
+
+def bench_rdt(messages, batch):
+    """Envia `messages` pacotes de um RDTSocket para outro, em janelas de `batch`"""
+    receiver = rdt3.RDTSocket()
+    sender = rdt3.RDTSocket()
+    sender.connect(receiver.connection.local_addr)
+    payload = b"x" * 200
+
+    def receive():
+        for _ in range(messages):
+            receiver.recv()
+
+    def send():
+        thread = threading.Thread(target=receive)
+        thread.start()
+        for start in range(0, messages, batch):
+            sender.send_window([payload] * min(batch, messages - start))
+        thread.join()
+
+    elapsed = measure(send)
+    sender.close()
+    receiver.close()
+    return elapsed
+
+def bench_server(commands):
+    """Chama handle_command direto, com uma mistura de mensagens e listagens"""
+    from Server.server import Server
+
+    server = Server()
+    users = [f"user{i}" for i in range(10)]
+    for user in users:
+        server.handle_command({"command": "login", "user": user})
+        server.handle_command({"command": "follow", "user": user, "friend": users[0]})
+    server.handle_command({"command": "create_group", "user": users[0], "group": "bench"})
+    key = server.groups["bench"]["key"]
+    mix = [
+        {"command": "chat_group", "group": "bench", "key": key, "message": "hello group"},
+        {"command": "chat_friend", "friend": users[0], "message": "hello friend"},
+        {"command": "list:cinners"},
+        {"command": "list:messages", "chat": "bench", "since": 0},
+    ]
+
+    def run():
+        for i in range(commands):
+            server.handle_command(dict(mix[i % len(mix)], user=users[1 + i % (len(users) - 1)]))
+
+    elapsed = measure(run)
+    server.socket.close()
+    return elapsed
+
+def bench_call(calls):
+    """Uma chamada de log típica do caminho de envio, com os mesmos argumentos"""
+    seq, in_flight, window = 42, 7, 16
+
+    def run():
+        for _ in range(calls):
+            rdt3.sender_log.debug("RDTSocket: Pacote SEQ=%s enviado, %s/%s em trânsito", seq, in_flight, window)
+
+    return measure(run)
+
+def main():
+    parser = argparse.ArgumentParser(description="Custo dos logs com trace ligado e desligado")
+    parser.add_argument("--messages", type=int, default=2000, help="pacotes enviados no par de RDTSockets")
+    parser.add_argument("--batch", type=int, default=32)
+    parser.add_argument("--commands", type=int, default=20000, help="comandos chamados no Server")
+    parser.add_argument("--calls", type=int, default=200000, help="chamadas de log isoladas")
+    args = parser.parse_args()
+
+    rdt3.LOSS_PROB = rdt3.CORRUPT_PROB = 0.0
+    rdt3.MIN_DELAY = rdt3.MAX_DELAY = 0.0
+
+    results = {}
+    for name, level in LEVELS.items():
+        configure(level)
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            results[name] = {
+                "rdt": bench_rdt(args.messages, args.batch),
+                "server": bench_server(args.commands),
+                "call": bench_call(args.calls),
+            }
+    configure()
+
+    rows = [("rdt", args.messages, "pkt/s"), ("server", args.commands, "cmd/s"), ("call", args.calls, "ns/call")]
+    print(f"{'scenario':<8} {'trace':<5} {'rate':>12} {'unit':<8} {'cpu s':>8} {'overhead':>9}")
+    for scenario, count, unit in rows:
+        for name in LEVELS:
+            wall, cpu = results[name][scenario]
+            rate = wall / count * 1e9 if unit == "ns/call" else count / wall
+            overhead = cpu / results["off"][scenario][1] - 1
+            print(f"{scenario:<8} {name:<5} {rate:>12.1f} {unit:<8} {cpu:>8.3f} {overhead:>+8.0%}")
+
+if __name__ == "__main__":
+    main()
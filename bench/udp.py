@@ -0,0 +1,136 @@
+"""
+Pacotes por segundo por núcleo no lado que recebe: remetentes em outros processos mandam sem parar para
+um socket local, e medimos quantos pacotes ele tratou por segundo de CPU gasto (o processo do receptor
+usa um núcleo por vez, então isso é o pps que um núcleo aguenta).
+
+Dois níveis, cada um com vários tamanhos de lote (--batch 1 é o caminho de um pacote por vez):
+  udt: UDTSocket.receive_batch() sobre datagramas crus, o custo só da leitura;
+  rdt: RDTSocket.recv() com remetentes em send_window, que inclui checksum, ACKs e janela.
+
+Uso: python -m bench.udp --senders 2 --seconds 3 --batch 1 64 --recv-buffer 4194304
+"""
+
+import os
+import sys
+import time
+import socket
+import struct
+import argparse
+import contextlib
+import subprocess
+
+import rdt.rdt3 as rdt3
+
+PAYLOAD = b"x" * 200
+WARMUP = 0.5  # Segundos antes de começar a medir, para os remetentes chegarem ao ritmo
+
+def no_impairments():
+    rdt3.LOSS_PROB = rdt3.CORRUPT_PROB = 0.0
+    rdt3.MIN_DELAY = rdt3.MAX_DELAY = 0.0
+
+def send(args):
+    """Modo subprocesso: manda para --port até passar --seconds"""
+    no_impairments()
+    deadline = time.time() + args.seconds
+    addr = ("127.0.0.1", args.port)
+    if args.sender == "udt":
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        header = (rdt3.DATA_PKT, 0, 1, 0, 0, rdt3.calculate_checksum(PAYLOAD), len(PAYLOAD))
+        packet = struct.pack(rdt3.HEADER_FORMAT, *header) + PAYLOAD
+        while time.time() < deadline:
+            for _ in range(rdt3.MAX_WINDOW):
+                sock.sendto(packet, addr)
+        return
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        sock = rdt3.RDTSocket(send_buffer=args.send_buffer)
+        sock.connect(addr)
+        while time.time() < deadline:
+            if not sock.send_window([PAYLOAD] * rdt3.MAX_WINDOW):
+                break
+
+def start_senders(args, level, port):
+    command = [sys.executable, "-m", "bench.udp", "--sender", level, "--port", str(port),
+               "--seconds", str(args.seconds + WARMUP + 1)]
+    if args.send_buffer:
+        command += ["--send-buffer", str(args.send_buffer)]
+    return [subprocess.Popen(command) for _ in range(args.senders)]
+
+def receive_udt(args, batch):
+    """(pacotes, segundos, segundos de CPU) lendo datagramas crus em lotes de até `batch`"""
+    udt = rdt3.UDTSocket(local_addr=("127.0.0.1", 0), recv_buffer=args.recv_buffer)
+    senders = start_senders(args, "udt", udt.local_addr[1])
+
+    def receive():
+        try:
+            return len(udt.receive_batch(batch))
+        except socket.timeout:
+            return 0
+
+    try:
+        return measure(receive, args.seconds)
+    finally:
+        stop(senders)
+        udt.close()
+
+def receive_rdt(args, batch):
+    """(mensagens, segundos, segundos de CPU) entregues pelo recv() de um RDTSocket"""
+    rdt3.RECV_BATCH = batch
+    sock = rdt3.RDTSocket(host="127.0.0.1", recv_buffer=args.recv_buffer)
+    senders = start_senders(args, "rdt", sock.connection.local_addr[1])
+
+    def receive():
+        data, _ = sock.recvfrom()
+        return 0 if data is None else 1
+
+    try:
+        return measure(receive, args.seconds)
+    finally:
+        stop(senders)
+        sock.close()
+
+def measure(receive, seconds):
+    """Chama receive() (que retorna quantos pacotes tratou) por `seconds` depois do aquecimento"""
+    warmup_end = time.perf_counter() + WARMUP
+    while time.perf_counter() < warmup_end:
+        receive()
+    packets = 0
+    wall, cpu = time.perf_counter(), time.process_time()
+    while time.perf_counter() - wall < seconds:
+        packets += receive()
+    return packets, time.perf_counter() - wall, time.process_time() - cpu
+
+def stop(senders):
+    for process in senders:
+        process.terminate()
+    for process in senders:
+        process.wait()
+
+def main():
+    parser = argparse.ArgumentParser(description="Pacotes/s por núcleo do lado que recebe")
+    parser.add_argument("--senders", type=int, default=2, help="processos remetentes")
+    parser.add_argument("--seconds", type=float, default=3.0, help="duração de cada medida")
+    parser.add_argument("--batch", type=int, nargs="+", default=[1, rdt3.RECV_BATCH], help="pacotes lidos por vez")
+    parser.add_argument("--levels", nargs="+", default=["udt", "rdt"], choices=["udt", "rdt"])
+    parser.add_argument("--recv-buffer", type=int, help="SO_RCVBUF do receptor, em bytes")
+    parser.add_argument("--send-buffer", type=int, help="SO_SNDBUF dos remetentes, em bytes")
+    parser.add_argument("--sender", choices=["udt", "rdt"], help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.sender:
+        send(args)
+        return
+
+    no_impairments()
+    os.makedirs(os.path.dirname(rdt3.LOG_FILE), exist_ok=True)
+    receivers = {"udt": receive_udt, "rdt": receive_rdt}
+    print(f"{'level':<6} {'batch':>6} {'pkt/s':>10} {'cpu':>6} {'pkt/s/core':>11}")
+    for level in args.levels:
+        for batch in args.batch:
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                packets, elapsed, cpu = receivers[level](args, batch)
+            per_core = packets / cpu if cpu else 0
+            print(f"{level:<6} {batch:>6} {packets / elapsed:>10.0f} {cpu / elapsed:>6.0%} {per_core:>11.0f}")
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,18 @@
-from .rdt3 import RDTSocket
+from .rdt3 import RDTSocket, MAX_SESSION_BACKLOG
+from .group import DeliveryGroup, GroupMessage
+from .congestion import CongestionController, Reno, Cubic, CONGESTION_CONTROLLERS
+from .metrics import MetricsRegistry, REGISTRY, serve_metrics
 
 __all__ = [
-    "RDTSocket"
+    "RDTSocket",
+    "MAX_SESSION_BACKLOG",
+    "DeliveryGroup",
+    "GroupMessage",
+    "CongestionController",
+    "Reno",
+    "Cubic",
+    "CONGESTION_CONTROLLERS",
+    "MetricsRegistry",
+    "REGISTRY",
+    "serve_metrics",
 ]
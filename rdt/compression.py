@@ -0,0 +1,57 @@
+"""
+Compressão opcional de payloads do RDTSocket.
+
+Payloads a partir de COMPRESSION_THRESHOLD bytes são comprimidos com zlib usando um dicionário pré-carregado
+com os trechos que mais se repetem nas mensagens do chat (chaves do JSON de mensagens, grupos e comandos).
+Com o dicionário, mesmo respostas pequenas comprimem bem, porque as chaves já são conhecidas pelos dois lados.
+O pacote comprimido é marcado com FLAG_COMPRESSED no cabeçalho, e só é usado se ficar menor que o original.
+"""
+
+import json
+import zlib
+
+# Payloads menores que isso vão sem compressão (ver bench/compression.py)
+COMPRESSION_THRESHOLD = 64
+COMPRESSION_LEVEL = 6
+
+# Versão do PRESET_DICTIONARY: os dois lados precisam do mesmo, então ela é anunciada no handshake (ver
+# FLAG_COMPRESSION_OK em rdt3.py). Qualquer mudança no dicionário exige uma versão nova
+DICTIONARY_VERSION = 2
+
+COMMANDS = ["login", "logout", "follow", "unfollow", "create_group", "delete_group", "join", "leave",
+            "list:cinners", "list:friends", "list:mygroups", "list:groups", "list:messages", "chat_friend",
+            "chat_group", "search", "inbox", "offline", "send_file"]
+
+def _shapes(*objects):
+    """O JSON dos objetos como o json.dumps os escreve (ordem das chaves, espaços), com valores de exemplo"""
+    return b"".join(json.dumps(obj).encode('utf-8') for obj in objects)
+
+# O zlib dá preferência aos trechos do fim do dicionário, então os mais frequentes ficam por último:
+# pedidos, respostas de arquivos e grupos e, no fim, respostas com mensagens. Os valores de exemplo não
+# têm data: o dicionário não pode mudar com o tempo
+MESSAGE = {"id": 1, "sender": "", "content": "", "timestamp": "T12:00:00.000000"}
+PRESET_DICTIONARY = (
+    _shapes(*({"command": command, "user": ""} for command in COMMANDS))
+    + _shapes({"chat": "", "friend": "", "group": "", "key": "", "message": "", "id": 1})
+    + _shapes({"offset": 0, "ok": True, "name": ""}, {"resend": 0, "name": ""})
+    + _shapes([{"name": "", "owner": "", "key": "", "members": 1}, {"name": "", "owner": "", "members": 1}])
+    + _shapes({"version": "", "items": [], "not_modified": True}, {"epoch": "", "messages": [], "more": False})
+    + _shapes({"id": 1, "reply": [MESSAGE, MESSAGE]})
+)
+
+def compress(data):
+    compressor = zlib.compressobj(COMPRESSION_LEVEL, zlib.DEFLATED, zlib.MAX_WBITS, zdict=PRESET_DICTIONARY)
+    return compressor.compress(data) + compressor.flush()
+
+def decompress(data):
+    decompressor = zlib.decompressobj(zlib.MAX_WBITS, zdict=PRESET_DICTIONARY)
+    return decompressor.decompress(data) + decompressor.flush()
+
+def maybe_compress(data):
+    """Retorna (payload, comprimido?) usando a versão comprimida só quando ela vale a pena"""
+    if len(data) < COMPRESSION_THRESHOLD:
+        return data, False
+    compressed = compress(data)
+    if len(compressed) >= len(data):
+        return data, False
+    return compressed, True
@@ -0,0 +1,127 @@
+"""
+Controle de congestionamento para o envio em janela do RDTSocket.
+
+Cada sessão tem o seu controlador, que decide quantos pacotes podem ficar em trânsito (cwnd, em pacotes).
+O RDTSocket avisa o controlador sobre ACKs novos, ACKs triplicados e timeouts; os algoritmos só precisam
+implementar essas três reações. Toda mudança de cwnd fica registrada num trace que pode ser exportado em CSV.
+"""
+
+import csv
+import time
+from collections import deque
+
+# Janela inicial e limiar inicial do slow start (em pacotes)
+INITIAL_CWND = 1.0
+INITIAL_SSTHRESH = 64.0
+MIN_SSTHRESH = 2.0
+
+# Quantidade máxima de pontos guardados no trace de cada controlador
+TRACE_LIMIT = 10000
+
+class CongestionController:
+    """Interface dos algoritmos de controle de congestionamento"""
+    name = "base"
+
+    def __init__(self):
+        self.cwnd = INITIAL_CWND
+        self.ssthresh = INITIAL_SSTHRESH
+        self.start_time = time.time()
+        self.trace = deque(maxlen=TRACE_LIMIT)
+        self._record("init")
+
+    def window(self):
+        """Quantidade de pacotes que podem ficar em trânsito"""
+        return max(1, int(self.cwnd))
+
+    def on_ack(self, acked):
+        """Chamado quando `acked` pacotes novos foram confirmados"""
+        raise NotImplementedError
+
+    def on_triple_dup_ack(self):
+        """Chamado no terceiro ACK duplicado, antes da retransmissão rápida"""
+        raise NotImplementedError
+
+    def on_timeout(self):
+        """Chamado quando o temporizador do pacote mais antigo expira"""
+        raise NotImplementedError
+
+    def _record(self, event):
+        self.trace.append((time.time() - self.start_time, self.cwnd, self.ssthresh, event))
+
+    def export_trace(self, path):
+        """Salva o trace de cwnd em CSV (tempo, cwnd, ssthresh, evento)"""
+        with open(path, "w", newline="") as trace_file:
+            writer = csv.writer(trace_file)
+            writer.writerow(["time", "cwnd", "ssthresh", "event"])
+            for t, cwnd, ssthresh, event in self.trace:
+                writer.writerow([f"{t:.6f}", f"{cwnd:.3f}", f"{ssthresh:.3f}", event])
+
+class Reno(CongestionController):
+    """TCP Reno: slow start, AIMD em congestion avoidance e corte pela metade na perda"""
+    name = "reno"
+
+    def on_ack(self, acked):
+        for _ in range(acked):
+            if self.cwnd < self.ssthresh:
+                self.cwnd += 1  # Slow start: dobra a cada RTT
+            else:
+                self.cwnd += 1 / self.cwnd  # Congestion avoidance: +1 pacote por RTT
+        self._record("ack")
+
+    def on_triple_dup_ack(self):
+        self.ssthresh = max(self.cwnd / 2, MIN_SSTHRESH)
+        self.cwnd = self.ssthresh
+        self._record("dupack")
+
+    def on_timeout(self):
+        self.ssthresh = max(self.cwnd / 2, MIN_SSTHRESH)
+        self.cwnd = INITIAL_CWND
+        self._record("timeout")
+
+class Cubic(CongestionController):
+    """CUBIC: a janela cresce como uma cúbica do tempo desde a última perda, centrada em w_max"""
+    name = "cubic"
+    C = 0.4
+    BETA = 0.7
+
+    def __init__(self):
+        super().__init__()
+        self.w_max = 0.0
+        self.epoch_start = None
+
+    def on_ack(self, acked):
+        for _ in range(acked):
+            if self.cwnd < self.ssthresh:
+                self.cwnd += 1
+                continue
+
+            now = time.time()
+            if self.epoch_start is None:
+                self.epoch_start = now
+                self.w_max = max(self.w_max, self.cwnd)
+            k = (self.w_max * (1 - self.BETA) / self.C) ** (1 / 3)
+            target = self.C * (now - self.epoch_start - k) ** 3 + self.w_max
+            if target > self.cwnd:
+                self.cwnd += (target - self.cwnd) / self.cwnd
+            else:
+                self.cwnd += 0.01 / self.cwnd
+        self._record("ack")
+
+    def on_triple_dup_ack(self):
+        self.w_max = self.cwnd
+        self.cwnd = max(self.cwnd * self.BETA, MIN_SSTHRESH)
+        self.ssthresh = self.cwnd
+        self.epoch_start = None
+        self._record("dupack")
+
+    def on_timeout(self):
+        self.w_max = self.cwnd
+        self.ssthresh = max(self.cwnd * self.BETA, MIN_SSTHRESH)
+        self.cwnd = INITIAL_CWND
+        self.epoch_start = None
+        self._record("timeout")
+
+CONGESTION_CONTROLLERS = {
+    Reno.name: Reno,
+    Cubic.name: Cubic,
+}
@@ -0,0 +1,159 @@
+"""
+Transferência de arquivos sobre o RDTSocket.
+
+O arquivo é quebrado em chunks numerados e enviados em janela. Nome, tamanho e hash seguem antes, numa
+mensagem de metadados separada, então o fim do arquivo é conhecido pelo tamanho e nenhum conteúdo pode ser
+confundido com um marcador (como os antigos __EOF__/__EOT__). O receptor mantém o arquivo parcial em disco
+e informa a partir de qual chunk retomar, o que permite continuar uma transferência interrompida.
+
+Cada chunk leva um CRC32 do índice e dos dados: o checksum do RDT (8 bits) deixa passar cerca de um
+pacote corrompido em 256. O receptor só grava chunks íntegros e em ordem; quando falta um (corrompido ou
+descartado), pede ao remetente que recomece a partir dele com um novo send_file.
+"""
+
+import os
+import json
+import time
+import zlib
+import struct
+import hashlib
+
+# Primeiro byte das mensagens de chunk. Nunca inicia um JSON, então chunks e comandos não se confundem
+FILE_CHUNK_TAG = b"\x00"
+CHUNK_HEADER_FORMAT = '!cII'  # [tag (1 byte), índice do chunk (4 bytes), CRC32 do índice e dos dados (4 bytes)]
+CHUNK_HEADER_SIZE = struct.calcsize(CHUNK_HEADER_FORMAT)
+
+# Cabe num pacote RDT junto com os cabeçalhos
+FILE_CHUNK_SIZE = 1000
+
+# Quantos chunks são entregues ao send_window de cada vez
+FILE_WINDOW_BATCH = 128
+
+def file_digest(path):
+    """SHA-256 do arquivo, lido em blocos"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(64 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def chunk_count(size, chunk_size=FILE_CHUNK_SIZE):
+    return (size + chunk_size - 1) // chunk_size
+
+def is_chunk(message):
+    return message[:1] == FILE_CHUNK_TAG
+
+def chunk_crc(index, data):
+    return zlib.crc32(data, zlib.crc32(struct.pack('!I', index)))
+
+def make_chunk(index, data):
+    return struct.pack(CHUNK_HEADER_FORMAT, FILE_CHUNK_TAG, index, chunk_crc(index, data)) + data
+
+def parse_chunk(message):
+    """Retorna (índice, dados) de uma mensagem de chunk; ValueError se ela chegou corrompida"""
+    if len(message) < CHUNK_HEADER_SIZE:
+        raise ValueError("chunk truncado")
+    _, index, crc = struct.unpack(CHUNK_HEADER_FORMAT, message[:CHUNK_HEADER_SIZE])
+    data = message[CHUNK_HEADER_SIZE:]
+    if crc != chunk_crc(index, data):
+        raise ValueError(f"CRC inválido no chunk {index}")
+    return index, data
+
+def iter_chunk_batches(path, start_chunk=0, chunk_size=FILE_CHUNK_SIZE, batch=FILE_WINDOW_BATCH):
+    """Lê o arquivo a partir do chunk dado e gera listas de mensagens de chunk prontas para envio"""
+    with open(path, "rb") as f:
+        f.seek(start_chunk * chunk_size)
+        index = start_chunk
+        messages = []
+        while True:
+            data = f.read(chunk_size)
+            if not data:
+                break
+            messages.append(make_chunk(index, data))
+            index += 1
+            if len(messages) == batch:
+                yield messages
+                messages = []
+        if messages:
+            yield messages
+
+class FileReceiver:
+    """Recebe um arquivo em disco, retomando de um .part anterior com o mesmo hash"""
+    def __init__(self, dest_dir, name, size, sha256, chunk_size=FILE_CHUNK_SIZE):
+        if size < 0 or chunk_size <= 0:
+            raise ValueError(f"tamanho {size} ou chunk_size {chunk_size} inválido")
+        self.name = os.path.basename(name)
+        self.size = size
+        self.sha256 = sha256
+        self.chunk_size = chunk_size
+        self.total_chunks = chunk_count(size, chunk_size)
+
+        os.makedirs(dest_dir, exist_ok=True)
+        self.path = os.path.join(dest_dir, self.name)
+        self.part_path = self.path + ".part"
+        self.meta_path = self.part_path + ".json"
+
+        self.next_chunk = self._resume_point()
+        self.file = open(self.part_path, "r+b" if self.next_chunk else "wb")
+        self.file.truncate(self.next_chunk * chunk_size)
+        self.file.seek(self.next_chunk * chunk_size)
+        with open(self.meta_path, "w") as meta:
+            json.dump({"size": size, "sha256": sha256, "chunk_size": chunk_size}, meta)
+        self.last_activity = time.time()
+        self.resend_requested = False
+
+    def _resume_point(self):
+        """Quantos chunks completos do mesmo arquivo já estão no .part"""
+        try:
+            with open(self.meta_path) as meta:
+                previous = json.load(meta)
+        except (OSError, ValueError):
+            return 0
+        if previous != {"size": self.size, "sha256": self.sha256, "chunk_size": self.chunk_size}:
+            return 0
+        try:
+            return min(os.path.getsize(self.part_path) // self.chunk_size, self.total_chunks)
+        except OSError:
+            return 0
+
+    @property
+    def complete(self):
+        return self.next_chunk >= self.total_chunks
+
+    def write_chunk(self, index, data):
+        """Grava o chunk se for o próximo esperado; duplicatas são ignoradas. Um chunk adiante do esperado
+        quer dizer que o esperado se perdeu: retorna False e o remetente deve recomeçar (ver request_resend)"""
+        self.last_activity = time.time()
+        if index > self.next_chunk:
+            return False
+        if index == self.next_chunk:
+            self.file.write(data)
+            self.next_chunk += 1
+        return True
+
+    def request_resend(self):
+        """Chunk faltando ou corrompido: o índice a partir do qual o remetente deve reenviar, ou None se já
+        foi pedido (os chunks seguintes desta passada não servem, o remetente recomeça com um novo send_file)"""
+        self.last_activity = time.time()
+        if self.resend_requested:
+            return None
+        self.resend_requested = True
+        return self.next_chunk
+
+    def finish(self):
+        """Fecha o arquivo e verifica tamanho e hash; se baterem, o .part vira o arquivo final.
+
+        Se não baterem, o .part fica: todos os chunks dele passaram pelo CRC, então o provável é o arquivo
+        ter mudado no remetente, e um novo envio (com outro hash) recomeça do zero de qualquer forma.
+        """
+        self.close()
+        ok = os.path.getsize(self.part_path) == self.size and file_digest(self.part_path) == self.sha256
+        if ok:
+            os.replace(self.part_path, self.path)
+            os.remove(self.meta_path)
+        return ok
+
+    def close(self):
+        """Fecha o arquivo mantendo o .part para uma retomada futura"""
+        if not self.file.closed:
+            self.file.close()
@@ -0,0 +1,134 @@
+"""
+Entrega confiável de uma mensagem a um grupo de peers, no estilo multicast: em vez de uma sessão
+Go-Back-N por membro, a mensagem ganha um número no grupo e o mesmo pacote vai para todos os membros.
+Cada um confirma com um GROUP-ACK, e a mensagem guarda só um bitmap (um int) de quem já confirmou:
+na retransmissão, o pacote vai apenas para quem ainda falta. Um único heap de prazos no RDTSocket
+serve de timer para todas as mensagens de todos os grupos, então o estado por mensagem é o pacote,
+o bitmap e um prazo, com 10 membros ou com 1000.
+
+Quem recebe entrega cada mensagem uma vez (descarta as duplicatas pelo número), como um datagrama:
+pelo datagram_handler ou pelo recv_datagram(). Não há ordem garantida entre mensagens diferentes.
+"""
+
+import struct
+
+# Prefixo do payload de um GROUP_PKT: número da mensagem no grupo e o menor número ainda pendente no
+# remetente (quem recebe nunca mais verá números abaixo dele, então pode esquecê-los)
+GROUP_HEADER_FORMAT = '!II'
+GROUP_HEADER_SIZE = struct.calcsize(GROUP_HEADER_FORMAT)
+
+# Payload de um GROUP_ACK_PKT: os números confirmados, um ou mais (os que chegaram no mesmo lote)
+GROUP_ACK_FORMAT = '!I'
+GROUP_ACK_SIZE = struct.calcsize(GROUP_ACK_FORMAT)
+MAX_GROUP_ACK_NUMBERS = 128
+
+# O id do grupo vai no campo de sessão do cabeçalho (2 bytes)
+MAX_GROUP_ID = 0xFFFF
+
+class DeliveryGroup:
+    """Membros de um grupo de entrega e as mensagens dele ainda sem todos os ACKs.
+
+    Cada membro tem um índice fixo, que é o seu bit nos bitmaps das mensagens. Quem sai deixa o índice
+    vago e quem entra ocupa o menor índice vago, então os bitmaps não passam do maior número de membros
+    que o grupo já teve de uma vez, por mais que os membros mudem. As mensagens enviadas antes de ele
+    entrar não esperam o ACK dele: nelas o índice já conta como confirmado, seja porque estava vago no
+    envio, seja porque remove() confirmou no lugar de quem saiu.
+    """
+    def __init__(self, group_id, members=()):
+        self.group_id = group_id
+        self.members = []  # índice -> endereço, ou None se o membro saiu
+        self.index = {}  # endereço -> índice
+        self.removed = 0  # Bitmap dos índices vagos
+        self.next_number = 1
+        self.pending = {}  # número -> GroupMessage, da mais antiga para a mais nova
+        for addr in members:
+            self.add(addr)
+
+    def __len__(self):
+        return len(self.index)
+
+    def add(self, addr):
+        if addr in self.index:
+            return
+        if self.removed:
+            index = (self.removed & -self.removed).bit_length() - 1
+            self.removed &= ~(1 << index)
+            self.members[index] = addr
+        else:
+            index = len(self.members)
+            self.members.append(addr)
+        self.index[addr] = index
+
+    def remove(self, addr):
+        """Tira o membro do grupo; as mensagens pendentes deixam de esperar por ele"""
+        index = self.index.pop(addr, None)
+        if index is None:
+            return
+        self.members[index] = None
+        self.removed |= 1 << index
+        for message in list(self.pending.values()):
+            message.ack(index)
+            if message.done:
+                del self.pending[message.number]
+
+    def low_watermark(self):
+        """Menor número de mensagem que ainda pode ser (re)enviado"""
+        return next(iter(self.pending), self.next_number)
+
+    def missing(self, message):
+        """Endereços dos membros que ainda não confirmaram a mensagem"""
+        missing = ((1 << message.size) - 1) & ~message.acked & ~self.removed
+        while missing:
+            bit = missing & -missing
+            yield self.members[bit.bit_length() - 1]
+            missing ^= bit
+
+class GroupMessage:
+    """Uma mensagem enviada a um grupo: o pacote (o mesmo para todos), quem confirmou e o prazo"""
+    __slots__ = ("number", "packet", "size", "acked", "remaining", "deadline", "last_progress", "failed")
+
+    def __init__(self, number, packet, members, removed, deadline, now):
+        self.number = number
+        self.packet = packet
+        self.size = members  # Membros (índices) existentes no envio; os que entrarem depois não contam
+        self.acked = removed  # Índices vagos contam como confirmados
+        self.remaining = members - bin(removed & ((1 << members) - 1)).count("1")
+        self.deadline = deadline
+        self.last_progress = now
+        self.failed = False  # Desistimos com membros ainda sem confirmar
+
+    @property
+    def done(self):
+        return self.remaining == 0 or self.failed
+
+    def ack(self, index):
+        """Marca o ACK do membro; False se ele já tinha confirmado (ou não esperávamos por ele)"""
+        bit = 1 << index
+        if index >= self.size or self.acked & bit:
+            return False
+        self.acked |= bit
+        self.remaining -= 1
+        return True
+
+class SeenNumbers:
+    """Números de mensagem já entregues de um grupo, do lado de quem recebe.
+
+    Tudo até `floor` já foi visto; acima dele, só os números avulsos (chegaram fora de ordem). O limite
+    que vem em cada pacote deixa o floor subir, então o conjunto fica pequeno.
+    """
+    def __init__(self):
+        self.floor = None
+        self.above = set()
+
+    def accept(self, number, low_watermark):
+        """True se a mensagem é nova (deve ser entregue), False se é duplicata"""
+        if self.floor is None or low_watermark - 1 > self.floor:
+            self.floor = low_watermark - 1
+            self.above = {seen for seen in self.above if seen > self.floor}
+        if number <= self.floor or number in self.above:
+            return False
+        self.above.add(number)
+        while self.floor + 1 in self.above:
+            self.floor += 1
+            self.above.remove(self.floor)
+        return True
@@ -0,0 +1,90 @@
+"""
+Logs do RDTSocket, do Server e do Client, com níveis (usando o logging da biblioteca padrão).
+
+Os traces por pacote e por requisição ficam em DEBUG e vêm desligados: abaixo do nível configurado, uma chamada
+como log.debug("SEQ=%d", seq) só faz uma comparação, sem formatar nada nem escrever no terminal.
+O nível vem da variável de ambiente RDT_LOG_LEVEL ou de configure(), e pode ser dado por família de logs:
+    RDT_LOG_LEVEL=DEBUG                 todos os traces, menos o arquivo de pacotes
+    RDT_LOG_LEVEL=rdt=DEBUG,server=INFO traces do RDT, servidor só no nível normal
+    RDT_LOG_LEVEL=rdt.packets=DEBUG     só o arquivo com uma linha por pacote
+O arquivo de pacotes custa uma escrita em disco por pacote, então só liga quando rdt.packets é pedido pelo
+nome (RDT_LOG_LEVEL=DEBUG,rdt.packets=DEBUG liga tudo).
+"""
+
+import os
+import sys
+import logging
+
+LOG_LEVEL_ENV = "RDT_LOG_LEVEL"
+DEFAULT_LEVEL = "INFO"
+PACKET_LOGGER = "rdt.packets"  # Log estilo Wireshark de cada pacote, gravado no LOG_FILE do rdt3
+
+# Famílias de logs: cada uma tem seu formato; o nível pode ser ajustado separadamente
+FORMATS = {
+    "rdt": "%(message)s",
+    "server": "[%(asctime)s] SERVER: %(message)s",
+    "client": "Client %(user)s: %(message)s",
+}
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# Cores por logger (o mais específico vence): sender em azul, receiver em verde, como no estilo antigo
+COLORS = {
+    "rdt.sender": "\033[34m",
+    "rdt.receiver": "\033[32m",
+    "server": "\033[36m",
+    "client": "\033[33m",
+}
+RESET = "\033[0m"
+
+class ColorFormatter(logging.Formatter):
+    def format(self, record):
+        message = super().format(record)
+        name = record.name
+        while name and name not in COLORS:
+            name = name.rpartition(".")[0]
+        return f"{COLORS[name]}{message}{RESET}" if name else message
+
+class StdoutHandler(logging.StreamHandler):
+    """Escreve no sys.stdout atual, para que redirect_stdout (usado nos benchmarks) continue funcionando"""
+    def __init__(self):
+        super().__init__(sys.stdout)
+
+    @property
+    def stream(self):
+        return sys.stdout
+
+    @stream.setter
+    def stream(self, value):
+        pass
+
+def parse_levels(spec):
+    """'DEBUG' ou 'rdt=DEBUG,server=INFO' -> {família: nível}; um nível sem família vale para todas"""
+    levels = {}
+    for part in filter(None, (part.strip() for part in spec.split(","))):
+        family, _, level = part.rpartition("=")
+        level = logging.getLevelName(level.upper())
+        if not isinstance(level, int):
+            raise ValueError(f"unknown log level in {spec!r}")
+        for name in ([family] if family else FORMATS):
+            levels[name] = level
+    return levels
+
+def configure(level=None):
+    """Instala os handlers (uma vez) e define os níveis; sem argumento, usa RDT_LOG_LEVEL ou INFO"""
+    levels = parse_levels(level or os.environ.get(LOG_LEVEL_ENV) or DEFAULT_LEVEL)
+    for family, format in FORMATS.items():
+        logger = logging.getLogger(family)
+        if not logger.handlers:
+            handler = StdoutHandler()
+            handler.setFormatter(ColorFormatter(format, DATE_FORMAT))
+            logger.addHandler(handler)
+            logger.propagate = False
+    for name, value in levels.items():
+        logging.getLogger(name).setLevel(value)
+    # O arquivo com uma linha por pacote custa uma escrita em disco por pacote: só liga se pedido pelo nome
+    logging.getLogger(PACKET_LOGGER).setLevel(levels.get(PACKET_LOGGER, logging.INFO))
+
+def get_logger(name):
+    return logging.getLogger(name)
+
+configure()
@@ -0,0 +1,218 @@
+"""
+Métricas do RDTSocket e de quem o usa (contadores, gauges e histogramas com labels).
+
+Cada métrica guarda um valor por combinação de labels e pode ser lida como um dicionário (snapshot) ou no
+formato texto do Prometheus, inclusive por HTTP local com serve_metrics(). Os sockets usam o REGISTRY global, a menos que recebam um registro próprio;
+o Server cria o seu, para que as métricas de transporte e de comandos fiquem juntas.
+"""
+
+import json
+import bisect
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Limites (em segundos) dos baldes dos histogramas de tempo
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in pairs) + "}"
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name, help=""):
+        self.name = name
+        self.help = help
+        self.lock = threading.Lock()
+        self.values = {}  # labels (tupla ordenada) -> valor
+
+    def items(self):
+        """Pares (labels, valor) atuais"""
+        with self.lock:
+            return list(self.values.items())
+
+    def value(self, **labels):
+        return dict(self.items()).get(_label_key(labels), 0)
+
+    def total(self):
+        """Soma de todas as combinações de labels"""
+        return sum(value for _, value in self.items())
+
+    def snapshot(self):
+        return {_format_labels(key): value for key, value in self.items()}
+
+    def prometheus(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for key, value in sorted(self.items()):
+            lines.append(f"{self.name}{_format_labels(key)} {value}")
+        return lines
+
+class Counter(Metric):
+    """Valor que só cresce (pacotes enviados, retransmissões...)"""
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+class Gauge(Metric):
+    """Valor que sobe e desce (bytes em trânsito, tamanho de filas...)"""
+    kind = "gauge"
+
+    def __init__(self, name, help=""):
+        super().__init__(name, help)
+        self.functions = {}  # labels -> função que calcula o valor
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[_label_key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, func, **labels):
+        """Faz o valor destes labels ser func(), calculado a cada leitura (estado que já existe em outro lugar)"""
+        with self.lock:
+            self.functions[_label_key(labels)] = func
+
+    def remove(self, **labels):
+        key = _label_key(labels)
+        with self.lock:
+            self.values.pop(key, None)
+            self.functions.pop(key, None)
+
+    def items(self):
+        with self.lock:
+            functions = list(self.functions.items())
+            items = list(self.values.items())
+        return items + [(key, func()) for key, func in functions]
+
+class Histogram(Metric):
+    """Distribuição de valores em baldes cumulativos, com soma e contagem"""
+    kind = "histogram"
+
+    def __init__(self, name, help="", buckets=LATENCY_BUCKETS):
+        super().__init__(name, help)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        with self.lock:
+            entry = self.values.get(key)
+            if entry is None:
+                entry = self.values[key] = {"counts": [0] * (len(self.buckets) + 1), "sum": 0.0, "count": 0}
+            entry["counts"][bisect.bisect_left(self.buckets, value)] += 1
+            entry["sum"] += value
+            entry["count"] += 1
+
+    def value(self, **labels):
+        """Quantidade de observações"""
+        with self.lock:
+            entry = self.values.get(_label_key(labels))
+            return entry["count"] if entry else 0
+
+    def total(self):
+        with self.lock:
+            return sum(entry["count"] for entry in self.values.values())
+
+    def snapshot(self):
+        with self.lock:
+            result = {}
+            for key, entry in self.values.items():
+                buckets = {}
+                running = 0
+                for bound, count in zip(list(self.buckets) + ["+Inf"], entry["counts"]):
+                    running += count
+                    buckets[str(bound)] = running
+                result[_format_labels(key)] = {"count": entry["count"], "sum": round(entry["sum"], 6),
+                                                     "buckets": buckets}
+            return result
+
+    def prometheus(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for key, entry in sorted(self.values.items()):
+                running = 0
+                for bound, count in zip(list(self.buckets) + ["+Inf"], entry["counts"]):
+                    running += count
+                    lines.append(f"{self.name}_bucket{_format_labels(key, [('le', bound)])} {running}")
+                lines.append(f"{self.name}_sum{_format_labels(key)} {entry['sum']}")
+                lines.append(f"{self.name}_count{_format_labels(key)} {entry['count']}")
+        return lines
+
+class MetricsRegistry:
+    """Conjunto de métricas por nome; pedir a mesma métrica duas vezes retorna a mesma instância"""
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def _get(self, cls, name, help, **kwargs):
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = cls(name, help, **kwargs)
+            return metric
+
+    def counter(self, name, help=""):
+        return self._get(Counter, name, help)
+
+    def gauge(self, name, help=""):
+        return self._get(Gauge, name, help)
+
+    def histogram(self, name, help="", buckets=LATENCY_BUCKETS):
+        return self._get(Histogram, name, help, buckets=buckets)
+
+    def snapshot(self):
+        """Todas as métricas como dicionário serializável em JSON"""
+        with self.lock:
+            metrics = list(self.metrics.values())
+        return {metric.name: metric.snapshot() for metric in metrics}
+
+    def prometheus(self):
+        """Todas as métricas no formato texto do Prometheus"""
+        with self.lock:
+            metrics = sorted(self.metrics.values(), key=lambda metric: metric.name)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.prometheus())
+        return "\n".join(lines) + "\n"
+
+# Registro padrão dos sockets
+REGISTRY = MetricsRegistry()
+
+def serve_metrics(registry, port, host="127.0.0.1"):
+    """Serve o registro por HTTP numa thread: /metrics no formato do Prometheus, /metrics.json em JSON"""
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == "/metrics":
+                body, content_type = registry.prometheus().encode(), "text/plain; version=0.0.4"
+            elif self.path == "/metrics.json":
+                body, content_type = json.dumps(registry.snapshot()).encode(), "application/json"
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # Cada consulta não precisa poluir o terminal
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -1,8 +1,22 @@
 import time
+import zlib
+import heapq
 import random
 import socket
+import select
 import struct
+import logging
+import contextlib
 import datetime
+import threading
+from collections import deque
+
+from . import compression, tracing
+from .congestion import Reno
+from .group import (DeliveryGroup, GroupMessage, SeenNumbers, GROUP_HEADER_FORMAT, GROUP_HEADER_SIZE,
+                    GROUP_ACK_FORMAT, GROUP_ACK_SIZE, MAX_GROUP_ACK_NUMBERS, MAX_GROUP_ID)
+from .metrics import REGISTRY
+from .log import PACKET_LOGGER, get_logger
 
 """
 RDT 3.0 (Reliable Data Transfer) usando UDP com simulação de latência, perda de pacotes e corrupção.
@@ -12,16 +26,17 @@ Implementei usando threads, ou seja, Sender e Receiver enviam logs no mesmo term
 o terminal ficou um pouco poluído, portanto fiz os logs serem no estilo Wireshark para facilitar identificação.
 """
 
-# Cores para os logs
-BLUE = "\033[34m"  # Logs do sender
-GREEN = "\033[32m" # Logs do receiver
-RESET = "\033[0m"
+# Logs (ver log.py): o sender sai em azul, o receiver em verde; traces de pacotes ficam em DEBUG
+log = get_logger("rdt")
+sender_log = get_logger("rdt.sender")
+receiver_log = get_logger("rdt.receiver")
+packet_log = get_logger(PACKET_LOGGER)
 
 # Pastas com os arquivos
 SOURCE_DIR = "./Client"
 DEST_DIR = "./Server"
 
-# Logs de pacotes individuais
+# Logs de pacotes individuais (só gravados com RDT_LOG_LEVEL=rdt.packets=DEBUG)
 LOG_FILE = "./Logs/logs.txt"
 
 # Configurações de rede
@@ -30,6 +45,14 @@ RECEIVER_PORT = 5000
 
 SOCKET_TIMEOUT = 0.1
 
+# Buffers do socket UDP no kernel (SO_SNDBUF/SO_RCVBUF), em bytes; None deixa o padrão do sistema.
+# Um servidor com muitos clientes precisa de um buffer de recepção maior para não perder rajadas.
+SOCKET_SEND_BUFFER = None
+SOCKET_RECV_BUFFER = None
+
+# Pacotes lidos de uma vez quando o socket acorda: depois do primeiro, lê sem esperar até o EAGAIN
+RECV_BATCH = 64
+
 SENDER_ADDR = ('localhost', SENDER_PORT)
 RECEIVER_ADDR = ('localhost', RECEIVER_PORT)
 
@@ -50,18 +73,66 @@ MAX_RDT_WAIT_TIME = 5.0
 # Ajustar o tamanho máximo de transmissão para evitar estouro de buffer UDP
 MAX_UDP_PACKET_SIZE = 1024
 
-# Estados do Remetente
-WAIT_FOR_DATA = "WAIT_FOR_DATA"
-WAIT_FOR_ACK0 = "WAIT_FOR_ACK0"
-WAIT_FOR_ACK1 = "WAIT_FOR_ACK1"
-
-# Estados do Receptor
-WAIT_FOR_PKT0 = "WAIT_FOR_PKT0"
-WAIT_FOR_PKT1 = "WAIT_FOR_PKT1"
+# Números de sequência (1 byte) e tamanho máximo da janela de envio (Go-Back-N exige janela < SEQ_SPACE)
+SEQ_SPACE = 256
+MAX_WINDOW = 64
 
 # Tipos de pacotes
 DATA_PKT = 0
 ACK_PKT = 1
+SYN_PKT = 2      # Abre uma sessão: carrega o id da sessão e o número de sequência inicial
+SYN_ACK_PKT = 3  # Aceita a sessão: carrega o número de sequência inicial do outro lado
+FIN_PKT = 4      # Encerra a sessão
+FIN_ACK_PKT = 5
+RST_PKT = 6      # Pacote para uma sessão desconhecida: o remetente deve refazer o handshake
+DATAGRAM_PKT = 7 # Dados não confiáveis: sem seq, sem ACK e sem retransmissão (heartbeats, avisos)
+GROUP_PKT = 8    # Mensagem de um grupo de entrega (ver group.py): o campo de sessão leva o id do grupo
+GROUP_ACK_PKT = 9
+
+PKT_TYPE_NAMES = {
+    DATA_PKT: "DATA",
+    ACK_PKT: "ACK",
+    SYN_PKT: "SYN",
+    SYN_ACK_PKT: "SYN-ACK",
+    FIN_PKT: "FIN",
+    FIN_ACK_PKT: "FIN-ACK",
+    RST_PKT: "RST",
+    DATAGRAM_PKT: "DGRAM",
+    GROUP_PKT: "GROUP",
+    GROUP_ACK_PKT: "GACK",
+}
+
+# Flags do cabeçalho
+FLAG_ACK = 0x01  # O campo ack é válido (ACK puro ou de carona num pacote de dados)
+FLAG_COMPRESSED = 0x02  # O payload está comprimido (ver compression.py)
+# No SYN/SYN-ACK: este lado sabe descomprimir payloads com o dicionário desta versão (ver compression.py).
+# Cada versão tem o seu bit: peers com dicionários diferentes seguem sem compressão
+COMPRESSION_FLAGS = {1: 0x04, 2: 0x08}
+FLAG_COMPRESSION_OK = COMPRESSION_FLAGS[compression.DICTIONARY_VERSION]
+
+# Formato do pacote: [tipo (1 byte), flags (1 byte), sessão (2 bytes), seq (1 byte), ack (1 byte), checksum (1 byte), tamanho (4 bytes), dados]
+HEADER_FORMAT = '!BBHBBBi'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+
+# Tempo máximo que um ACK fica retido esperando carona num pacote de dados
+DELAYED_ACK_TIMEOUT = 0.1
+
+# Sessões sem tráfego por mais que isso são descartadas (em segundos)
+SESSION_IDLE_TIMEOUT = 300.0
+SESSION_REAP_INTERVAL = 10.0
+
+# Tempo máximo esperando o FIN-ACK ao fechar o socket
+FIN_WAIT_TIME = 1.0
+
+# Datagramas recebidos e ainda não lidos; os mais antigos são descartados
+DATAGRAM_BUFFER_SIZE = 256
+
+# Limite sugerido para os dados aceitos e ainda não lidos de cada sessão (ver RDTSocket(backlog_limit=...)),
+# e limite das mensagens do send_nowait() esperando janela numa sessão
+MAX_SESSION_BACKLOG = MAX_WINDOW
+
+# De quanto em quanto tempo o recvfrom() verifica os timers e as filas dos envios do send_nowait()
+SEND_SERVICE_INTERVAL = 0.01
 
 # Marcadores
 END_OF_FILE_MARKER = "__EOF__"
@@ -75,17 +146,21 @@ def calculate_checksum(data):
         return sum(data) % 256
     return 0
 
-def log_action(action, pkt_type, seq_num, origin=None, dest=None, data_len=None):
+def log_action(action, pkt_type, seq_num, origin=None, dest=None, data_len=None, ack_num=None):
     """Log estilo Wireshark"""
+    if not packet_log.isEnabledFor(logging.DEBUG):
+        return
     timestamp = datetime.datetime.now().strftime("%H:%M:%S.%f")[:-3]
     src = f"{origin[0]}:{origin[1]}" if origin else "Unknown"
     dst = f"{dest[0]}:{dest[1]}" if dest else "Unknown"
     
-    type_str = "DATA" if pkt_type == DATA_PKT else "ACK"
+    type_str = PKT_TYPE_NAMES.get(pkt_type, "?")
     
     flags = []
-    if seq_num is not None:
+    if seq_num is not None and pkt_type == DATA_PKT:
         flags.append(f"SEQ={seq_num}")
+    if ack_num is not None:
+        flags.append(f"ACK={ack_num}")
     if data_len is not None:
         flags.append(f"LEN={data_len}")
     
@@ -98,8 +173,13 @@ def log_action(action, pkt_type, seq_num, origin=None, dest=None, data_len=None)
         log_file.write(log_message)
 
 class UDTSocket:
-    """Wrapper no Socket UDP para logar, simular latência, perda de pacotes e corrupção"""
-    def __init__(self, local_addr=None, remote_addr=None):
+    """Wrapper no Socket UDP para logar, simular latência, perda de pacotes e corrupção.
+    
+    O socket fica não bloqueante: a espera é um select() com SOCKET_TIMEOUT, e cada vez que ele acorda
+    o receive_batch() lê tudo o que já chegou. Dentro de batch(), os envios da thread ficam numa fila e
+    saem todos juntos no fim, numa passada só.
+    """
+    def __init__(self, local_addr=None, remote_addr=None, metrics=REGISTRY, send_buffer=None, recv_buffer=None):
         self.loss_prob = LOSS_PROB
         self.corrupt_prob = CORRUPT_PROB
         self.min_delay = MIN_DELAY
@@ -114,19 +194,42 @@ class UDTSocket:
         else:
             self.socket.bind(('localhost', 0))
         
-        self.socket.settimeout(SOCKET_TIMEOUT)
+        # Sem valor explícito vale o do módulo. O kernel pode arredondar (o Linux dobra o valor pedido):
+        # buffer_sizes guarda o que valeu
+        send_buffer = send_buffer or SOCKET_SEND_BUFFER
+        recv_buffer = recv_buffer or SOCKET_RECV_BUFFER
+        if send_buffer:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, send_buffer)
+        if recv_buffer:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, recv_buffer)
+        self.buffer_sizes = (self.socket.getsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF),
+                             self.socket.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF))
+        
+        self.socket.setblocking(False)
         self.local_addr = self.socket.getsockname()
         self.last_remote_addr = remote_addr
         
-        print(f"RDTConnection: Bound to {self.local_addr}")
+        # Envios adiados pelo batch(), só da thread que o abriu (as dos timers de ACK enviam na hora)
+        self.outgoing = deque()
+        self.batch_thread = None
+        
+        # Pacotes por tipo, e quantos a simulação perdeu ou corrompeu
+        self.packets_sent = metrics.counter("rdt_packets_sent_total", "Pacotes enviados, por tipo")
+        self.packets_received = metrics.counter("rdt_packets_received_total", "Pacotes recebidos, por tipo")
+        self.packets_dropped = metrics.counter("rdt_packets_dropped_total", "Pacotes descartados pela perda simulada")
+        self.packets_corrupted = metrics.counter("rdt_packets_corrupted_total", "Pacotes corrompidos pela simulação")
+        self.batches = metrics.histogram("rdt_recv_batch_packets", "Pacotes lidos por vez que o socket acordou",
+                                         buckets=(1, 2, 4, 8, 16, 32, 64))
+        
+        log.debug("RDTConnection: Bound to %s", self.local_addr)
     
     def _extract_packet_info(self, packet):
         """Extrai informações básicas do pacote para log"""
-        if len(packet) < 7:
-            return None, None, None
+        if len(packet) < HEADER_SIZE:
+            return None, None, None, None
             
-        pkt_type, seq, _, data_len = struct.unpack('!BBBi', packet[:7])
-        return pkt_type, seq, data_len
+        pkt_type, flags, _, seq, ack, _, data_len = struct.unpack(HEADER_FORMAT, packet[:HEADER_SIZE])
+        return pkt_type, seq, (ack if flags & FLAG_ACK else None), data_len
     
     def _simulate_delay(self):
         """Simula um atraso de rede aleatório"""
@@ -136,11 +239,11 @@ class UDTSocket:
     
     def _corrupt_packet(self, packet):
         """Corrompe um pacote modificando seu conteúdo"""
-        if len(packet) < 7:
+        if len(packet) < HEADER_SIZE:
             return packet
             
-        header = packet[:7]
-        payload = packet[7:]
+        header = packet[:HEADER_SIZE]
+        payload = packet[HEADER_SIZE:]
         
         # Corrompe aproximadamente metade do payload
         payload_bytearray = bytearray(payload)
@@ -151,286 +254,1125 @@ class UDTSocket:
         
         return header + corrupted_payload
     
-    def send(self, packet):
-        """Envia um pacote para o endereço remoto"""
-        if not self.last_remote_addr:
-            print("Não é possível enviar sem um endereço remoto.")
+    def send(self, packet, addr=None):
+        """Envia um pacote para o endereço remoto (por padrão, o último com quem falamos)"""
+        addr = addr or self.last_remote_addr
+        if not addr:
+            log.warning("Não é possível enviar sem um endereço remoto.")
+            return
+        
+        if self.batch_thread == threading.get_ident():
+            self.outgoing.append((packet, addr))
             return
             
-        # Extrai informações para log
-        pkt_type, seq, data_len = self._extract_packet_info(packet)
-            
+        with tracing.span("udt.send"):
+            packet = self._impair(packet, addr)
+            if packet is None:
+                return
+                
+            # Simula atraso de rede
+            with tracing.span("udt.delay"):
+                self._simulate_delay()
+                
+            self._sendto(packet, addr)
+    
+    @contextlib.contextmanager
+    def batch(self):
+        """Adia os envios desta thread até o fim do bloco e então os envia todos com flush()"""
+        if self.batch_thread == threading.get_ident():
+            # Já dentro de um lote: os envios saem no fim do lote de fora
+            yield
+            return
+        self.batch_thread = threading.get_ident()
+        try:
+            yield
+        finally:
+            self.batch_thread = None
+            self.flush()
+    
+    def flush(self):
+        """Envia numa passada os pacotes adiados, com um só atraso simulado para todos"""
+        if not self.outgoing:
+            return
+        with tracing.span("udt.flush", packets=len(self.outgoing)):
+            packets = []
+            while self.outgoing:
+                packet, addr = self.outgoing.popleft()
+                packet = self._impair(packet, addr)
+                if packet is not None:
+                    packets.append((packet, addr))
+            if not packets:
+                return
+            with tracing.span("udt.delay"):
+                self._simulate_delay()
+            for packet, addr in packets:
+                self._sendto(packet, addr)
+    
+    def _impair(self, packet, addr):
+        """Aplica a perda e a corrupção simuladas: o pacote a enviar, ou None se ele se perdeu"""
+        pkt_type, seq, ack, data_len = self._extract_packet_info(packet)
+        
         # Simula perda de pacote
+        type_name = PKT_TYPE_NAMES.get(pkt_type, "?")
         if random.random() < self.loss_prob:
-            log_action("DROPPED", pkt_type, seq, self.local_addr, self.last_remote_addr, data_len)
-            return
+            log_action("DROPPED", pkt_type, seq, self.local_addr, addr, data_len, ack)
+            self.packets_dropped.inc(type=type_name)
+            return None
             
         # Simula corrupção de pacote
-        is_corrupt = random.random() < self.corrupt_prob
-        if is_corrupt:
+        if random.random() < self.corrupt_prob:
             packet = self._corrupt_packet(packet)
-            
-        # Simula atraso de rede
-        self._simulate_delay()
-            
-        # Envia o pacote para o endereço remoto
-        self.socket.sendto(packet, self.last_remote_addr)
-        log_action("SENT", pkt_type, seq, self.local_addr, self.last_remote_addr, data_len)
+            self.packets_corrupted.inc(type=type_name)
+        return packet
+    
+    def _sendto(self, packet, addr):
+        try:
+            self.socket.sendto(packet, addr)
+        except BlockingIOError:
+            # Buffer de envio cheio: esperamos ele esvaziar um pouco; se não esvaziar, o pacote se perde
+            # como se fosse na rede, e a retransmissão cuida dele
+            if not select.select([], [self.socket], [], SOCKET_TIMEOUT)[1]:
+                log.debug("Buffer de envio cheio, pacote para %s descartado", addr)
+                return
+            self.socket.sendto(packet, addr)
+        pkt_type, seq, ack, data_len = self._extract_packet_info(packet)
+        self.packets_sent.inc(type=PKT_TYPE_NAMES.get(pkt_type, "?"))
+        log_action("SENT", pkt_type, seq, self.local_addr, addr, data_len, ack)
     
     def receive(self):
         """Recebe um pacote com condições de rede simuladas"""
+        packets = self.receive_batch(1)
+        if not packets:
+            raise socket.timeout()
+        return packets[0]
+    
+    def receive_batch(self, max_packets=RECV_BATCH, timeout=None):
+        """Espera até `timeout` (por padrão SOCKET_TIMEOUT) pelo primeiro pacote e lê, sem esperar, os que já chegaram com ele.
+        
+        Retorna [(data, addr)], que pode vir vazio se o select() acordou à toa; sem nenhum pacote no
+        prazo, levanta socket.timeout. O atraso simulado vale para o lote inteiro: pacotes que chegam
+        juntos atrasam juntos.
+        """
         try:
-            # Usar um buffer maior do que o MAX_UDP_PACKET_SIZE para evitar overflow
-            data, addr = self.socket.recvfrom(4096)
+            if not select.select([self.socket], [], [], SOCKET_TIMEOUT if timeout is None else timeout)[0]:
+                raise socket.timeout()
+            packets = []
+            while len(packets) < max_packets:
+                try:
+                    # Usar um buffer maior do que o MAX_UDP_PACKET_SIZE para evitar overflow
+                    packets.append(self.socket.recvfrom(4096))
+                except BlockingIOError:
+                    break
+            if not packets:
+                return packets
+            self.batches.observe(len(packets))
             
             # Atualiza o endereço remoto
-            self.last_remote_addr = addr
+            self.last_remote_addr = packets[-1][1]
             
             # Simula atraso de rede
-            self._simulate_delay()
+            with tracing.span("udt.delay"):
+                self._simulate_delay()
             
-            # Extrai informações para log
-            pkt_type, seq, data_len = self._extract_packet_info(data)
-            log_action("RECEIVED", pkt_type, seq, addr, self.local_addr, data_len)
+            for data, addr in packets:
+                # Extrai informações para log
+                pkt_type, seq, ack, data_len = self._extract_packet_info(data)
+                log_action("RECEIVED", pkt_type, seq, addr, self.local_addr, data_len, ack)
+                self.packets_received.inc(type=PKT_TYPE_NAMES.get(pkt_type, "?"))
             
-            return data, addr
+            return packets
         except socket.timeout:
             raise
         except Exception as e:
-            print(f"Erro ao receber dados: {e}")
+            log.warning("Erro ao receber dados: %s", e)
             raise
     
     def close(self):
         """Fecha o socket UDP"""
         self.socket.close()
-        print(f"RDTConnection: Closed {self.local_addr}")
+        log.debug("RDTConnection: Closed %s", self.local_addr)
+
+class Session:
+    """Estado RDT de uma conversa com um peer: janela de envio, próximo seq esperado, ACK atrasado e atividade"""
+    def __init__(self, session_id, addr, send_seq, recv_seq, congestion_control=Reno):
+        self.session_id = session_id
+        self.addr = addr
+        self.established = False
+        self.reset = False  # O peer respondeu RST: precisamos refazer o handshake
+        self.compression = False  # Os dois lados aceitaram compressão no handshake
+        
+        # Números de sequência iniciais acordados no handshake
+        self.local_isn = send_seq
+        self.remote_isn = recv_seq
+        
+        # Estado para envio (Go-Back-N): pacotes enviados e ainda sem ACK, em ordem de seq
+        self.send_base = send_seq  # seq do pacote mais antigo sem ACK
+        self.send_next = send_seq  # seq do próximo pacote novo
+        self.in_flight = deque()
+        self.send_times = deque()  # Quando cada pacote em trânsito foi enviado (None se retransmitido)
+        self.outbox = deque()  # Mensagens do send_nowait() esperando espaço na janela
+        self.last_progress = 0  # Último ACK novo (ou início do envio): sem progresso por muito tempo, desistimos
+        self.acked_total = 0
+        self.dup_acks = 0
+        self.timer_start = 0
+        self.cc = congestion_control()
+        
+        # Estado para recebimento
+        self.recv_expected = recv_seq
+        self.backlog = deque()  # Dados em ordem que o recv() ainda não entregou
+        self.held_until = 0  # Ver RDTSocket.hold()
+        
+        # ACK atrasado: seq do último pacote aceito que ainda não foi confirmado
+        self.pending_ack = None
+        self.ack_deadline = 0
+        
+        self.last_activity = time.time()
+    
+    def touch(self):
+        self.last_activity = time.time()
+    
+    def window(self):
+        """Quantos pacotes podem ficar em trânsito agora"""
+        return min(self.cc.window(), MAX_WINDOW)
 
 class RDTSocket:
     """Socket RDT bidirecional. API similar ao Socket UDP"""
-    def __init__(self, port=0, host='localhost'):
+    def __init__(self, port=0, host='localhost', congestion_control=Reno, compression=True, metrics=REGISTRY,
+                 backlog_limit=None, send_buffer=None, recv_buffer=None):
         # Cria uma conexão para a rede subjacente
-        self.connection = UDTSocket(local_addr=(host, port))
+        self.metrics = metrics
+        self.buffers = {"send_buffer": send_buffer, "recv_buffer": recv_buffer}
+        self.connection = UDTSocket(local_addr=(host, port), metrics=metrics, **self.buffers)
         
-        # Estado para envio
-        self.send_state = WAIT_FOR_DATA
-        self.send_seq = 0
-        self.last_pkt = None
-        self.last_send_time = 0
+        # Sessões por endereço remoto, cada uma com seu controlador de congestionamento
+        self.sessions = {}
+        self.last_reap = time.time()
+        self.congestion_control = congestion_control
+        self.compression = compression  # Oferecer/aceitar compressão de payloads nas novas sessões
         self.timeout = RDT_TIMEOUT  # Use o valor aumentado
         
-        # Estado para recebimento
-        self.recv_state = WAIT_FOR_PKT0
+        # Sessões com dados aceitos que o recv() ainda não entregou, atendidas em rodízio: um peer que
+        # envia sem parar não passa na frente dos outros. Com backlog_limit, uma sessão com tantos dados
+        # por ler deixa de receber (e de confirmar) os novos, e a janela do remetente para de andar.
+        self.ready = deque()
+        self.backlog_limit = backlog_limit
+        self.last_delivered = None  # Sessão da última mensagem entregue pelo recv()
+        self.held = []  # Sessões com dados que o recv() só entrega depois de held_until
+        
+        # Sessões com envios do send_nowait() pendentes; seus timers são verificados a cada volta do recvfrom()
+        self.sending = set()
+        self.last_service = 0
+        
+        # Grupos de entrega (ver group.py). Um só heap de (prazo, id do grupo, número) é o timer de todas
+        # as mensagens pendentes; entradas de mensagens já confirmadas ou reagendadas são só ignoradas
+        self.groups = {}  # id -> DeliveryGroup
+        self.next_group_id = 1
+        self.group_timers = []
+        self.groups_seen = {}  # (endereço do remetente, id do grupo) -> SeenNumbers
+        self.group_acks = {}  # (endereço, id do grupo) -> números a confirmar no fim do lote de pacotes
+        
+        # Datagramas não confiáveis: entregues ao datagram_handler, se houver, ou guardados para o recv_datagram()
+        self.datagram_buffer = deque(maxlen=DATAGRAM_BUFFER_SIZE)
+        self.datagram_handler = None
+        
+        # ACKs atrasados: sessões com ACK pendente, em ordem de prazo. Quem está lendo os envia a cada
+        # _poll(); uma única thread do socket cobre quem leu e parou (ex.: o cliente esperando o usuário)
+        self.ack_lock = threading.Lock()
+        self.ack_wakeup = threading.Condition(self.ack_lock)
+        self.delayed_acks = {}  # Session -> None
+        self.ack_thread = None
+        self.closed = False
+        self.close_lock = threading.Lock()  # O envio de um ACK pela thread não cruza com o close()
+        
+        # Métricas; o estado que já existe no socket (filas, janelas) é lido só quando alguém consulta
+        self.retransmissions = metrics.counter("rdt_retransmissions_total", "Pacotes de dados reenviados, por motivo")
+        self.checksum_errors = metrics.counter("rdt_checksum_errors_total", "Pacotes recebidos com checksum inválido")
+        self.backlog_drops = metrics.counter("rdt_backlog_drops_total", "Pacotes descartados porque a sessão tinha dados demais por ler")
+        self.rtt = metrics.histogram("rdt_rtt_seconds", "Tempo entre enviar um pacote de dados e receber seu ACK")
+        self._register_gauges()
         
-        print(f"RDTSocket criado em {self.connection.local_addr}")
+        log.debug("RDTSocket criado em %s", self.connection.local_addr)
+    
+    def _register_gauges(self):
+        """Expõe o estado deste socket, identificado pela porta local"""
+        self.metrics_label = str(self.connection.local_addr[1])
+        gauges = {
+            "rdt_sessions": ("Sessões abertas", lambda: len(self.sessions)),
+            "rdt_bytes_in_flight": ("Bytes enviados e ainda sem ACK",
+                                    lambda: sum(len(packet) for session in list(self.sessions.values())
+                                                for packet in list(session.in_flight))),
+            "rdt_recv_queue_depth": ("Dados aceitos que o recv() ainda não entregou",
+                                     lambda: sum(len(session.backlog) for session in list(self.ready) + list(self.held))),
+            "rdt_datagram_queue_depth": ("Datagramas esperando o recv_datagram()", lambda: len(self.datagram_buffer)),
+            "rdt_send_queue_depth": ("Mensagens do send_nowait() esperando janela",
+                                     lambda: sum(len(session.outbox) for session in list(self.sending))),
+            "rdt_group_pending": ("Mensagens de grupo esperando ACK de algum membro",
+                                  lambda: sum(len(group.pending) for group in list(self.groups.values()))),
+        }
+        for name, (help, func) in gauges.items():
+            self.metrics.gauge(name, help).set_function(func, socket=self.metrics_label)
+    
+    def _unregister_gauges(self):
+        for name in ("rdt_sessions", "rdt_bytes_in_flight", "rdt_recv_queue_depth", "rdt_datagram_queue_depth",
+                     "rdt_send_queue_depth", "rdt_group_pending"):
+            self.metrics.gauge(name).remove(socket=self.metrics_label)
     
     def bind(self, address):
         """Vincula o socket a um endereço específico"""
         # Fecha a conexão existente e cria uma nova com o endereço especificado
         if self.connection:
             self.connection.close()
-        self.connection = UDTSocket(local_addr=address)
+        self.connection = UDTSocket(local_addr=address, metrics=self.metrics, **self.buffers)
+        self._unregister_gauges()
+        self._register_gauges()
     
     def connect(self, address):
-        """Conecta a um endereço remoto"""
+        """Conecta a um endereço remoto, abrindo uma sessão com handshake SYN/SYN-ACK"""
+        # Sessões são indexadas pelo endereço de origem dos pacotes, que vem sempre resolvido
+        address = (socket.gethostbyname(address[0]), address[1])
         self.connection.last_remote_addr = address
-        print(f"RDTSocket: Conectado a {address}")
+        if not self._handshake(address):
+            log.warning("RDTSocket: Sem resposta de %s, o handshake será refeito no próximo envio", address)
+            return False
+        log.debug("RDTSocket: Conectado a %s", address)
+        return True
     
-    def _make_pkt(self, seq, pkt_type, data):
-        """Cria um pacote com os dados, tipo e sequência especificados"""
+    def _make_pkt(self, session_id, seq, pkt_type, data, ack=None, flags=0):
+        """Cria um pacote com os dados, tipo e sequência especificados (e um ACK de carona, se houver)"""
         if isinstance(data, str):
             data = data.encode('utf-8')
         
         checksum = calculate_checksum(data)
+        if ack is not None:
+            flags |= FLAG_ACK
         
-        # Formato do pacote: [tipo (1 byte), seq (1 byte), checksum (1 byte), tamanho (4 bytes), dados]
-        header = struct.pack('!BBBi', pkt_type, seq, checksum, len(data))
+        header = struct.pack(HEADER_FORMAT, pkt_type, flags, session_id, seq, ack or 0, checksum, len(data))
         return header + data
     
-    def _make_ack(self, seq):
-        """Cria um pacote ACK com o número de sequência especificado"""
-        dummy_payload = b"ACK"
-        checksum = calculate_checksum(dummy_payload)
-        
-        header = struct.pack('!BBBi', ACK_PKT, seq, checksum, len(dummy_payload))
-        return header + dummy_payload
+    def _make_ack(self, session_id, seq):
+        """Cria um pacote ACK puro (sem payload) com o número de sequência especificado"""
+        return self._make_pkt(session_id, 0, ACK_PKT, b"", ack=seq)
+    
+    def _make_control(self, pkt_type, session_id, seq=0, ack=None, flags=0):
+        """Cria um pacote de controle de sessão (SYN, SYN-ACK, FIN, FIN-ACK, RST)"""
+        return self._make_pkt(session_id, seq, pkt_type, b"", ack, flags)
     
     def _unpack(self, packet):
         """Extrai informações de um pacote"""
-        if len(packet) < 7:
-            return None, None, None, None
+        if len(packet) < HEADER_SIZE:
+            return None, None, None, None, None, None, None
         
         try:
-            pkt_type, seq, checksum, data_len = struct.unpack('!BBBi', packet[:7])
-            data = packet[7:]
-            return pkt_type, seq, checksum, data
+            pkt_type, flags, session_id, seq, ack, checksum, data_len = struct.unpack(HEADER_FORMAT, packet[:HEADER_SIZE])
+            data = packet[HEADER_SIZE:]
+            return pkt_type, flags, session_id, seq, ack, checksum, data
         except Exception:
-            return None, None, None, None
+            return None, None, None, None, None, None, None
+    
+    def _new_session(self, session_id, addr, send_seq, recv_seq):
+        return Session(session_id, addr, send_seq, recv_seq, self.congestion_control)
+    
+    def _handshake(self, address):
+        """Abre uma nova sessão com o peer, acordando o id da sessão e as sequências iniciais"""
+        session = self._new_session(random.randint(1, 0xFFFF), address, send_seq=random.randrange(SEQ_SPACE), recv_seq=0)
+        self._drop_session(address)
+        self.sessions[address] = session
+        
+        syn = self._make_control(SYN_PKT, session.session_id, seq=session.local_isn,
+                                 flags=FLAG_COMPRESSION_OK if self.compression else 0)
+        start_time = time.time()
+        sender_log.debug("RDTSocket: Enviando SYN para %s (sessão %s, ISN=%s)", address, session.session_id, session.local_isn)
+        self.connection.send(syn, address)
+        last_send_time = time.time()
+        
+        while not session.established:
+            if time.time() - start_time > MAX_RDT_WAIT_TIME:
+                sender_log.warning("RDTSocket: Timeout após %ss de espera por SYN-ACK, desistindo", MAX_RDT_WAIT_TIME)
+                self.sessions.pop(address, None)
+                return False
+            
+            self._poll()
+            
+            if not session.established and time.time() - last_send_time >= self.timeout:
+                sender_log.debug("RDTSocket: TIMEOUT no handshake, retransmitindo SYN")
+                self.connection.send(syn, address)
+                last_send_time = time.time()
+        
+        return True
+    
+    def _give_up(self, session):
+        """Descarta o que falta enviar e a própria sessão: o próximo envio refaz o handshake.
+        
+        Só pular as sequências sem ACK não basta: o receptor continuaria esperando por elas e
+        descartaria tudo o que viesse depois como fora de ordem.
+        """
+        session.outbox.clear()
+        session.in_flight.clear()
+        session.send_times.clear()
+        if self.sessions.get(session.addr) is session:
+            self._drop_session(session.addr)
+    
+    def _drop_session(self, addr):
+        """Descarta a sessão com o peer, liberando o timer do ACK pendente"""
+        session = self.sessions.pop(addr, None)
+        if session is None:
+            return None
+        self.sending.discard(session)
+        with self.ack_lock:
+            session.pending_ack = None
+            self.delayed_acks.pop(session, None)
+        return session
+    
+    def _reap_idle_sessions(self):
+        """Descarta as sessões sem tráfego há mais de SESSION_IDLE_TIMEOUT segundos"""
+        now = time.time()
+        if now - self.last_reap < SESSION_REAP_INTERVAL:
+            return
+        self.last_reap = now
+        
+        idle = [addr for addr, session in self.sessions.items() if now - session.last_activity > SESSION_IDLE_TIMEOUT]
+        for addr in idle:
+            self._drop_session(addr)
+        # O que já vimos de grupos de um peer sem sessão não serve mais
+        for key in [key for key in self.groups_seen if key[0] not in self.sessions]:
+            del self.groups_seen[key]
+        if idle:
+            log.info("RDTSocket: %s sessões ociosas descartadas, %s ativas", len(idle), len(self.sessions))
+    
+    def _schedule_ack(self, session, seq):
+        """Adia o ACK na esperança de mandá-lo de carona no próximo pacote de dados"""
+        with self.ack_lock:
+            if self.closed:
+                return
+            session.pending_ack = seq
+            session.ack_deadline = time.time() + DELAYED_ACK_TIMEOUT
+            # Reinserida no fim, a sessão mantém o dicionário em ordem de prazo
+            self.delayed_acks.pop(session, None)
+            self.delayed_acks[session] = None
+            if self.ack_thread is None:
+                self.ack_thread = threading.Thread(target=self._ack_loop, daemon=True)
+                self.ack_thread.start()
+            elif len(self.delayed_acks) == 1:
+                self.ack_wakeup.notify()
+    
+    def _take_pending_ack(self, session):
+        """Remove e retorna o ACK pendente da sessão"""
+        with self.ack_lock:
+            pending, session.pending_ack = session.pending_ack, None
+            self.delayed_acks.pop(session, None)
+            return pending
+    
+    def _flush_due_acks(self):
+        """Envia como ACK puro os ACKs pendentes cujo prazo passou"""
+        if not self.delayed_acks:
+            return
+        now = time.time()
+        with self.ack_lock:
+            due = []
+            for session in self.delayed_acks:
+                if session.ack_deadline > now:
+                    break
+                due.append(session)
+        for session in due:
+            self._flush_ack(session)
+    
+    def _ack_loop(self):
+        """Thread do socket para os ACKs atrasados: dorme até o prazo do mais antigo"""
+        while True:
+            with self.ack_lock:
+                if self.closed:
+                    return
+                if not self.delayed_acks:
+                    self.ack_wakeup.wait()
+                    continue
+                delay = next(iter(self.delayed_acks)).ack_deadline - time.time()
+                if delay > 0:
+                    self.ack_wakeup.wait(delay)
+                    continue
+            self._flush_due_acks()
+    
+    def _flush_ack(self, session):
+        """Envia como ACK puro o ACK pendente que não conseguiu carona a tempo"""
+        seq = self._take_pending_ack(session)
+        if seq is None:
+            return
+        with self.close_lock:
+            if self.connection is None:
+                return
+            receiver_log.debug("RDTSocket: ACK atrasado expirou, enviando ACK%s puro", seq)
+            self.connection.send(self._make_ack(session.session_id, seq), session.addr)
+    
+    def _session_for_send(self):
+        """Sessão com o destino atual, abrindo uma nova se ainda não houver"""
+        addr = self.connection.last_remote_addr
+        session = self.sessions.get(addr)
+        if session is None or not session.established or session.reset:
+            if not self._handshake(addr):
+                return None
+            session = self.sessions[addr]
+        return session
     
     def send(self, data):
         """Envia dados e espera pelo ACK"""
-        if self.send_state != WAIT_FOR_DATA:
-            print(f"{BLUE}RDTSocket: ERRO - Tentativa de enviar dados enquanto em estado {self.send_state}{RESET}")
-            return False
-
-        # Cria um pacote com os dados
-        packet = self._make_pkt(self.send_seq, DATA_PKT, data)
-        self.last_pkt = packet
+        return self.send_window([data])
+    
+    def send_window(self, messages):
+        """Envia várias mensagens em pipeline (Go-Back-N) e espera pelo ACK de todas.
         
-        # Envia através da conexão
-        self.connection.send(packet)
+        Quantas ficam em trânsito ao mesmo tempo é decidido pelo controle de congestionamento da sessão;
+        cada mensagem é entregue separadamente pelo recv() do outro lado, na mesma ordem.
+        """
+        with tracing.span("rdt.send_window", messages=len(messages)):
+            return self._send_window(messages)
+    
+    def _send_window(self, messages):
+        session = self._session_for_send()
+        if session is None:
+            return False
         
-        # Atualiza o timestamp de último envio
-        self.last_send_time = time.time()
-        start_time = time.time()
+        if session.in_flight:
+            sender_log.error("RDTSocket: ERRO - Tentativa de enviar dados com %s pacotes ainda em trânsito", len(session.in_flight))
+            return False
         
-        # Muda o estado para aguardar ACK
-        self.send_state = WAIT_FOR_ACK0 if (self.send_seq == 0) else WAIT_FOR_ACK1
-        print(f"{BLUE}RDTSocket: Transição para estado {self.send_state}{RESET}")
+        start_acked = session.acked_total
+        next_index = 0
+        last_progress = time.time()
         
-        # Busy wait for ACK with timeout
-        while self.send_state != WAIT_FOR_DATA:
-            # Verifica timeout global
-            if time.time() - start_time > MAX_RDT_WAIT_TIME:
-                print(f"{BLUE}RDTSocket: Timeout após {MAX_RDT_WAIT_TIME}s de espera por ACK, desistindo{RESET}")
-                self.send_state = WAIT_FOR_DATA
-                self.last_pkt = None 
+        while session.acked_total - start_acked < len(messages):
+            acked = session.acked_total - start_acked
+            
+            # Verifica timeout global (sem nenhum ACK novo)
+            if time.time() - last_progress > MAX_RDT_WAIT_TIME:
+                sender_log.warning("RDTSocket: Timeout após %ss de espera por ACK, desistindo", MAX_RDT_WAIT_TIME)
+                self._give_up(session)
                 return False
             
+            # Preenche a janela com pacotes novos
+            while next_index < len(messages) and len(session.in_flight) < session.window():
+                self._send_data(session, messages[next_index])
+                next_index += 1
+            
             # Try to receive an ACK
-            if self._check_for_ack():
-                return True
+            self._check_for_ack(session)
+            if session.acked_total - start_acked > acked:
+                last_progress = time.time()
+                continue
+            
+            # O peer não reconhece a sessão (reiniciou): refaz o handshake e reenvia o que faltava
+            if session.reset:
+                sender_log.info("RDTSocket: Sessão %s rejeitada pelo peer, refazendo handshake", session.session_id)
+                addr = session.addr
+                if not self._handshake(addr):
+                    return False
+                messages = messages[acked:]
+                session = self.sessions[addr]
+                start_acked = session.acked_total
+                next_index = 0
+                continue
             
             # Check for timeout and retransmit if necessary
-            self._check_timeout()
+            self._check_timeout(session)
             
             # Small sleep to prevent CPU hogging
-            time.sleep(0.01)
+            with tracing.span("rdt.ack_wait"):
+                time.sleep(0.01)
+        
+        return True
     
+    def send_nowait(self, data, addr=None):
+        """Envia dados sem esperar pelo ACK: o que não cabe na janela fica na fila da sessão.
+        
+        Para quem atende vários peers numa thread só (o servidor): um peer lento para confirmar não segura
+        os outros. Retransmissões e o resto da fila andam a cada volta do recvfrom(). Retorna False, sem
+        enfileirar, se a sessão já tem MAX_SESSION_BACKLOG mensagens esperando (o peer não está lendo).
+        """
+        if addr is not None:
+            self.connection.last_remote_addr = addr
+        session = self._session_for_send()
+        if session is None:
+            return False
+        if len(session.outbox) >= MAX_SESSION_BACKLOG:
+            sender_log.debug("RDTSocket: Fila de envio para %s cheia, mensagem recusada", session.addr)
+            return False
+        
+        if not session.in_flight and not session.outbox:
+            session.last_progress = time.time()
+        session.outbox.append(data)
+        self.sending.add(session)
+        self._fill_window(session)
         return True
     
-    def _check_for_ack(self):
-        """Verifica se um ACK foi recebido"""
+    def send_mark(self, addr=None):
+        """Marca do que já foi enviado ou enfileirado para o peer até agora, para o is_acked()"""
+        session = self.sessions.get(addr or self.connection.last_remote_addr)
+        if session is None:
+            return None
+        return session, session.acked_total + len(session.in_flight) + len(session.outbox)
+    
+    def is_acked(self, mark):
+        """Se tudo o que havia sido enviado quando a marca foi tirada já tem ACK. None se a sessão foi
+        descartada antes disso: o peer pode não ter recebido tudo"""
+        if mark is None:
+            return None
+        session, total = mark
+        if session.acked_total >= total:
+            return True
+        if self.sessions.get(session.addr) is not session:
+            return None
+        return False
+    
+    def _fill_window(self, session):
+        """Envia as mensagens da fila da sessão que couberem na janela"""
+        while session.outbox and len(session.in_flight) < session.window():
+            self._send_data(session, session.outbox.popleft())
+    
+    def _service_sends(self):
+        """Retransmissões e fila dos envios do send_nowait()"""
+        now = self.last_service = time.time()
+        for session in list(self.sending):
+            if session.reset or now - session.last_progress > MAX_RDT_WAIT_TIME:
+                # O peer reiniciou ou parou de confirmar: o que faltava enviar é descartado com a sessão
+                sender_log.warning("RDTSocket: Desistindo de %s mensagens para %s", len(session.in_flight) + len(session.outbox), session.addr)
+                self._give_up(session)
+                continue
+            self._check_timeout(session)
+            self._fill_window(session)
+            if not session.in_flight and not session.outbox:
+                self.sending.discard(session)
+    
+    def _send_data(self, session, data):
+        """Monta e envia um pacote de dados novo, levando de carona o ACK pendente"""
+        ack = self._take_pending_ack(session)
+        
+        # Payloads grandes vão comprimidos se o peer aceitou no handshake
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        flags = 0
+        if session.compression:
+            with tracing.span("rdt.compress"):
+                data, compressed = compression.maybe_compress(data)
+            if compressed:
+                flags = FLAG_COMPRESSED
+        
+        # Cria um pacote com os dados
+        seq = session.send_next
+        packet = self._make_pkt(session.session_id, seq, DATA_PKT, data, ack, flags)
+        session.in_flight.append(packet)
+        session.send_times.append(time.time())
+        session.send_next = (seq + 1) % SEQ_SPACE
+        
+        # O temporizador acompanha o pacote mais antigo sem ACK
+        if len(session.in_flight) == 1:
+            session.timer_start = time.time()
+        session.touch()
+        
+        # Envia através da conexão
+        self.connection.send(packet, session.addr)
+        if ack is not None:
+            sender_log.debug("RDTSocket: ACK%s enviado de carona no pacote SEQ=%s", ack, seq)
+        sender_log.debug("RDTSocket: Pacote SEQ=%s enviado, %s/%s em trânsito", seq, len(session.in_flight), session.window())
+    
+    def _poll(self, timeout=None):
+        """Recebe e trata os pacotes disponíveis; o que eles geram (ACKs, respostas...) sai junto no fim"""
+        self._flush_due_acks()
         try:
-            data, addr = self.connection.receive()
-            
-            # Extrai o tipo de pacote, sequência e checksum
-            pkt_type, seq, checksum, payload = self._unpack(data)
-            
-            # Verifica se é um ACK
-            if pkt_type != ACK_PKT:
-                return False
-            
-            # Verifica checksum
-            if checksum != calculate_checksum(payload):
-                print(f"{BLUE}RDTSocket: ACK corrompido recebido{RESET}")
-                return False
-            
-            expected_seq = 0 if self.send_state == WAIT_FOR_ACK0 else 1
-            
-            # Se for o ACK esperado
-            if seq == expected_seq:
-                old_state = self.send_state
-                self.send_state = WAIT_FOR_DATA
-                self.send_seq = 1 - self.send_seq  # Alterna entre 0 e 1
-                print(f"{BLUE}RDTSocket: ACK{seq} correto recebido, transição de {old_state} → {self.send_state}{RESET}")
-                return True
-            else:
-                print(f"{BLUE}RDTSocket: ACK{seq} inesperado recebido (esperava {expected_seq}){RESET}")
-                return False
-                
+            packets = self.connection.receive_batch(RECV_BATCH, timeout)
         except socket.timeout:
-            return False
+            return
+        with self.connection.batch():
+            for data, addr in packets:
+                # Um pacote que dá erro não leva junto os outros do lote
+                try:
+                    with tracing.span("rdt.packet"):
+                        self._process_packet(data, addr)
+                except Exception as e:
+                    receiver_log.warning("RDTSocket: ERRO ao tratar pacote de %s: %s", addr, e)
+            if self.group_acks:
+                self._flush_group_acks()
+    
+    def _check_for_ack(self, session):
+        """Verifica se um ACK foi recebido (puro ou de carona num pacote de dados)"""
+        try:
+            self._poll()
         except Exception as e:
-            print(f"{BLUE}RDTSocket: ERRO ao receber ACK: {e}{RESET}")
-            return False
+            sender_log.warning("RDTSocket: ERRO ao receber ACK: %s", e)
+    
+    def _process_packet(self, packet, addr):
+        """Trata um pacote recebido: controle de sessão, confirmação de envios pendentes e/ou dados"""
+        pkt_type, flags, session_id, seq, ack, checksum, data = self._unpack(packet)
+        if pkt_type is None:
+            return
+        
+        if pkt_type in (SYN_PKT, SYN_ACK_PKT, FIN_PKT, FIN_ACK_PKT, RST_PKT):
+            self._process_control(pkt_type, flags, session_id, seq, addr)
+            return
+        
+        if pkt_type == DATAGRAM_PKT:
+            self._process_datagram(session_id, checksum, data, addr)
+            return
+        
+        if pkt_type in (GROUP_PKT, GROUP_ACK_PKT):
+            if checksum != calculate_checksum(data):
+                self.checksum_errors.inc()
+                receiver_log.debug("RDTSocket: Pacote de grupo corrompido de %s descartado", addr)
+            elif pkt_type == GROUP_PKT:
+                self._process_group(session_id, data, addr)
+            else:
+                self._process_group_ack(session_id, data, addr)
+            return
+        
+        session = self.sessions.get(addr)
+        if session is None or session.session_id != session_id or not session.established:
+            # Sessão desconhecida (ex.: reiniciamos): pedimos ao remetente que refaça o handshake
+            if pkt_type == DATA_PKT:
+                receiver_log.info("RDTSocket: Pacote de sessão desconhecida %s de %s, enviando RST", session_id, addr)
+                self.connection.send(self._make_control(RST_PKT, session_id), addr)
+            return
+        session.touch()
+        
+        # Verifica se o checksum está correto
+        with tracing.span("rdt.checksum"):
+            valid = checksum == calculate_checksum(data)
+        if not valid:
+            self.checksum_errors.inc()
+            if pkt_type == DATA_PKT:
+                # Reenviamos ACK para o último pacote recebido em ordem
+                self._take_pending_ack(session)
+                self.connection.send(self._make_ack(session_id, (session.recv_expected - 1) % SEQ_SPACE), addr)
+                receiver_log.debug("RDTSocket: Pacote corrompido recebido, ainda esperando SEQ=%s", session.recv_expected)
+            else:
+                sender_log.debug("RDTSocket: ACK corrompido recebido")
+            return
+        
+        # ACK puro ou de carona num pacote de dados
+        if flags & FLAG_ACK:
+            self._process_ack(session, ack, duplicate_counts=(pkt_type == ACK_PKT))
+        
+        if pkt_type != DATA_PKT:
+            return
+        
+        if seq == session.recv_expected and self.backlog_limit is not None and len(session.backlog) >= self.backlog_limit:
+            # Sem ACK o remetente retransmite depois, com a janela reduzida pelo timeout
+            self.backlog_drops.inc()
+            receiver_log.debug("RDTSocket: Pacote SEQ=%s descartado, %s mensagens de %s por ler", seq, len(session.backlog), addr)
+            return
+        
+        if seq == session.recv_expected and flags & FLAG_COMPRESSED:
+            try:
+                with tracing.span("rdt.decompress"):
+                    data = compression.decompress(data)
+            except zlib.error:
+                # Passou pelo checksum fraco mas não descomprime: tratamos como corrompido
+                self._take_pending_ack(session)
+                self.connection.send(self._make_ack(session_id, (session.recv_expected - 1) % SEQ_SPACE), addr)
+                receiver_log.debug("RDTSocket: Pacote SEQ=%s não pôde ser descomprimido, descartado", seq)
+                return
+        
+        if seq == session.recv_expected:
+            # Pacote em ordem: guardamos os dados e adiamos o ACK
+            session.recv_expected = (seq + 1) % SEQ_SPACE
+            if not session.backlog:
+                self.ready.append(session)
+            session.backlog.append(data)
+            if self._take_pending_ack(session) is not None:
+                # Já havia um ACK retido: confirma os dois de uma vez, sem esperar
+                self.connection.send(self._make_ack(session_id, seq), addr)
+                receiver_log.debug("RDTSocket: Pacote SEQ=%s recebido, ACK%s cumulativo enviado", seq, seq)
+            else:
+                self._schedule_ack(session, seq)
+                receiver_log.debug("RDTSocket: Pacote SEQ=%s recebido, ACK%s adiado", seq, seq)
+        else:
+            # Duplicata ou fora de ordem: reenviamos imediatamente o ACK do último pacote em ordem
+            last_seq = (session.recv_expected - 1) % SEQ_SPACE
+            self._take_pending_ack(session)
+            self.connection.send(self._make_ack(session_id, last_seq), addr)
+            receiver_log.debug("RDTSocket: Pacote SEQ=%s fora de ordem (esperava %s), reenviando ACK%s", seq, session.recv_expected, last_seq)
+    
+    def _process_ack(self, session, ack, duplicate_counts):
+        """Desliza a janela com um ACK cumulativo; três ACKs duplicados disparam a retransmissão rápida"""
+        if not session.in_flight:
+            return
+        
+        distance = (ack - session.send_base) % SEQ_SPACE
+        if distance < len(session.in_flight):
+            # ACK novo: confirma todos os pacotes até `ack`
+            for _ in range(distance + 1):
+                session.in_flight.popleft()
+                sent_at = session.send_times.popleft()
+            # RTT pelo pacote confirmado exatamente por este ACK; retransmitidos são ambíguos (Karn) e ficam de fora
+            if sent_at is not None:
+                self.rtt.observe(time.time() - sent_at)
+            session.send_base = (ack + 1) % SEQ_SPACE
+            session.acked_total += distance + 1
+            session.last_progress = time.time()
+            session.dup_acks = 0
+            session.timer_start = time.time()
+            session.cc.on_ack(distance + 1)
+            sender_log.debug("RDTSocket: ACK%s recebido, %s em trânsito, cwnd=%.2f", ack, len(session.in_flight), session.cc.cwnd)
+            if session.outbox:
+                self._fill_window(session)
+        
+        elif ack == (session.send_base - 1) % SEQ_SPACE and duplicate_counts:
+            session.dup_acks += 1
+            if session.dup_acks == 3:
+                session.cc.on_triple_dup_ack()
+                sender_log.debug("RDTSocket: 3 ACKs duplicados, retransmissão rápida de SEQ=%s, cwnd=%.2f", session.send_base, session.cc.cwnd)
+                self.connection.send(session.in_flight[0], session.addr)
+                session.send_times[0] = None
+                self.retransmissions.inc(reason="fast")
+                session.timer_start = time.time()
+        
+        else:
+            sender_log.debug("RDTSocket: ACK%s inesperado recebido (janela %s..%s)", ack, session.send_base, session.send_next)
     
-    def _check_timeout(self):
-        """Verifica se houve timeout e retransmite se necessário"""
-        if time.time() - self.last_send_time < self.timeout:
+    def _process_control(self, pkt_type, flags, session_id, seq, addr):
+        """Trata os pacotes de abertura e encerramento de sessão"""
+        session = self.sessions.get(addr)
+        
+        if pkt_type == SYN_PKT:
+            if session is None or session.session_id != session_id:
+                # Nova sessão (ou o peer reiniciou): o estado anterior é descartado
+                self._drop_session(addr)
+                session = self._new_session(session_id, addr, send_seq=random.randrange(SEQ_SPACE), recv_seq=seq)
+                session.established = True
+                session.compression = self.compression and bool(flags & FLAG_COMPRESSION_OK)
+                self.sessions[addr] = session
+                receiver_log.debug("RDTSocket: Sessão %s aberta por %s (ISN remoto=%s, local=%s)", session_id, addr, seq, session.local_isn)
+            # SYN repetido (nosso SYN-ACK se perdeu) apenas recebe o mesmo SYN-ACK
+            session.touch()
+            self.connection.send(self._make_control(SYN_ACK_PKT, session_id, seq=session.local_isn, ack=session.remote_isn,
+                                                    flags=FLAG_COMPRESSION_OK if session.compression else 0), addr)
+        
+        elif pkt_type == SYN_ACK_PKT:
+            if session is not None and session.session_id == session_id and not session.established:
+                session.remote_isn = seq
+                session.recv_expected = seq
+                session.established = True
+                session.compression = self.compression and bool(flags & FLAG_COMPRESSION_OK)
+                session.touch()
+                sender_log.debug("RDTSocket: SYN-ACK recebido, sessão %s estabelecida (ISN remoto=%s, compressão=%s)", session_id, seq, session.compression)
+        
+        elif pkt_type == FIN_PKT:
+            if session is not None and session.session_id == session_id:
+                self._drop_session(addr)
+                receiver_log.debug("RDTSocket: Sessão %s encerrada por %s", session_id, addr)
+            self.connection.send(self._make_control(FIN_ACK_PKT, session_id), addr)
+        
+        elif pkt_type == FIN_ACK_PKT:
+            if session is not None and session.session_id == session_id:
+                self._drop_session(addr)
+        
+        elif pkt_type == RST_PKT:
+            if session is not None and session.session_id == session_id:
+                session.reset = True
+    
+    def _process_datagram(self, session_id, checksum, data, addr):
+        """Entrega um datagrama não confiável; não depende de sessão e nunca é confirmado"""
+        if checksum != calculate_checksum(data):
+            self.checksum_errors.inc()
+            receiver_log.debug("RDTSocket: Datagrama corrompido de %s descartado", addr)
+            return
+        
+        session = self.sessions.get(addr)
+        if session is not None and session.session_id == session_id:
+            session.touch()
+        
+        if self.datagram_handler:
+            self.datagram_handler(data, addr)
+        else:
+            self.datagram_buffer.append((data, addr))
+    
+    def send_datagram(self, data, addr=None):
+        """Envia dados sem confiabilidade: um único pacote, sem esperar ACK nem retransmitir"""
+        addr = addr or self.connection.last_remote_addr
+        session = self.sessions.get(addr)
+        session_id = session.session_id if session else 0
+        self.connection.send(self._make_pkt(session_id, 0, DATAGRAM_PKT, data), addr)
+    
+    def recv_datagram(self, timeout=0):
+        """Retorna o próximo (dados, endereço) não confiável, esperando até `timeout` segundos por um, ou (None, None)"""
+        deadline = time.time() + timeout
+        while not self.datagram_buffer:
+            # Lê o que já chegou antes de olhar o prazo: com timeout=0 o socket ainda é lido uma vez
+            try:
+                self._poll(timeout=max(0, min(deadline - time.time(), SOCKET_TIMEOUT)))
+            except Exception as e:
+                receiver_log.warning("RDTSocket: ERRO ao receber datagrama: %s", e)
+                return None, None
+            if not self.datagram_buffer and time.time() >= deadline:
+                return None, None
+        return self.datagram_buffer.popleft()
+    
+    def open_group(self, members=()):
+        """Novo grupo de entrega com os endereços dados; membros entram e saem com add() e remove()"""
+        group_id = self.next_group_id
+        while group_id in self.groups:
+            group_id = group_id % MAX_GROUP_ID + 1
+        self.next_group_id = group_id % MAX_GROUP_ID + 1
+        group = self.groups[group_id] = DeliveryGroup(group_id, members)
+        return group
+    
+    def close_group(self, group):
+        """Esquece o grupo e as mensagens dele ainda sem ACK"""
+        group.pending.clear()
+        self.groups.pop(group.group_id, None)
+    
+    def send_group(self, group, data):
+        """Envia os dados a todos os membros do grupo sem esperar pelos ACKs.
+        
+        Retorna a GroupMessage: `done` fica verdadeiro quando todos confirmaram ou quando desistimos
+        (`failed`, sem ACK novo por MAX_RDT_WAIT_TIME). As retransmissões andam a cada volta do
+        recvfrom(), ou no wait_group().
+        """
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        number = group.next_number
+        header = struct.pack(GROUP_HEADER_FORMAT, number, group.low_watermark())
+        group.next_number += 1
+        packet = self._make_pkt(group.group_id, 0, GROUP_PKT, header + data)
+        
+        now = time.time()
+        message = GroupMessage(number, packet, len(group.members), group.removed, now + self.timeout, now)
+        if message.done:
+            return message
+        group.pending[number] = message
+        heapq.heappush(self.group_timers, (message.deadline, group.group_id, number))
+        with tracing.span("rdt.send_group", members=message.remaining), self.connection.batch():
+            for addr in group.missing(message):
+                self.connection.send(packet, addr)
+        sender_log.debug("RDTSocket: Mensagem %s do grupo %s enviada a %s membros", number, group.group_id, message.remaining)
+        return message
+    
+    def wait_group(self, message, timeout=MAX_RDT_WAIT_TIME):
+        """Espera até a mensagem de grupo terminar (ver send_group); True se todos confirmaram"""
+        start_time = time.time()
+        while not message.done and time.time() - start_time < timeout:
+            try:
+                self._poll()
+            except Exception as e:
+                sender_log.warning("RDTSocket: ERRO ao receber ACK de grupo: %s", e)
+            if self.group_timers and self.group_timers[0][0] <= time.time():
+                self._service_groups()
+        return message.done and not message.failed
+    
+    def _service_groups(self):
+        """Timer compartilhado das mensagens de grupo: retransmite as vencidas só para quem não confirmou"""
+        now = time.time()
+        while self.group_timers and self.group_timers[0][0] <= now:
+            deadline, group_id, number = heapq.heappop(self.group_timers)
+            group = self.groups.get(group_id)
+            message = group.pending.get(number) if group else None
+            if message is None or message.deadline != deadline:
+                continue
+            
+            if now - message.last_progress > MAX_RDT_WAIT_TIME:
+                message.failed = True
+                del group.pending[number]
+                sender_log.warning("RDTSocket: Desistindo da mensagem %s do grupo %s, %s membros sem confirmar",
+                                   number, group_id, message.remaining)
+                continue
+            
+            with tracing.span("rdt.retransmit", packets=message.remaining), self.connection.batch():
+                for addr in group.missing(message):
+                    self.connection.send(message.packet, addr)
+            self.retransmissions.inc(message.remaining, reason="group")
+            message.deadline = now + self.timeout
+            heapq.heappush(self.group_timers, (message.deadline, group_id, number))
+    
+    def _process_group(self, group_id, data, addr):
+        """Confirma uma mensagem de grupo e a entrega como datagrama, se ainda não foi entregue"""
+        if len(data) < GROUP_HEADER_SIZE:
+            return
+        number, low_watermark = struct.unpack(GROUP_HEADER_FORMAT, data[:GROUP_HEADER_SIZE])
+        # Confirmado no fim do lote, junto com as outras mensagens do mesmo grupo que chegaram com esta
+        self.group_acks.setdefault((addr, group_id), []).append(number)
+        
+        seen = self.groups_seen.get((addr, group_id))
+        if seen is None:
+            seen = self.groups_seen[(addr, group_id)] = SeenNumbers()
+        if not seen.accept(number, low_watermark):
+            receiver_log.debug("RDTSocket: Mensagem %s do grupo %s duplicada, reenviando ACK", number, group_id)
+            return
+        
+        session = self.sessions.get(addr)
+        if session is not None:
+            session.touch()
+        if self.datagram_handler:
+            self.datagram_handler(data[GROUP_HEADER_SIZE:], addr)
+        else:
+            self.datagram_buffer.append((data[GROUP_HEADER_SIZE:], addr))
+    
+    def _flush_group_acks(self):
+        """Um GROUP-ACK por remetente e grupo com todos os números recebidos no lote"""
+        for (addr, group_id), numbers in self.group_acks.items():
+            for start in range(0, len(numbers), MAX_GROUP_ACK_NUMBERS):
+                chunk = numbers[start:start + MAX_GROUP_ACK_NUMBERS]
+                data = b"".join(struct.pack(GROUP_ACK_FORMAT, number) for number in chunk)
+                self.connection.send(self._make_pkt(group_id, 0, GROUP_ACK_PKT, data), addr)
+        self.group_acks.clear()
+    
+    def _process_group_ack(self, group_id, data, addr):
+        group = self.groups.get(group_id)
+        index = group.index.get(addr) if group else None
+        if index is None or not data or len(data) % GROUP_ACK_SIZE:
+            return
+        now = time.time()
+        for number, in struct.iter_unpack(GROUP_ACK_FORMAT, data):
+            message = group.pending.get(number)
+            if message is None or not message.ack(index):
+                continue
+            message.last_progress = now
+            if message.done:
+                del group.pending[number]
+                sender_log.debug("RDTSocket: Mensagem %s do grupo %s confirmada por todos", number, group_id)
+    
+    def _check_timeout(self, session):
+        """Verifica se houve timeout e retransmite a janela inteira se necessário (Go-Back-N)"""
+        if not session.in_flight or time.time() - session.timer_start < self.timeout:
             return False
         
-        seq_num = 0 if self.send_state == WAIT_FOR_ACK0 else 1
-        print(f"{BLUE}RDTSocket: TIMEOUT detectado, retransmitindo pacote SEQ={seq_num}{RESET}")
+        session.cc.on_timeout()
+        sender_log.debug("RDTSocket: TIMEOUT detectado, retransmitindo %s pacotes a partir de SEQ=%s, cwnd=%.2f", len(session.in_flight), session.send_base, session.cc.cwnd)
         
-        # Retransmite o pacote
-        self.connection.send(self.last_pkt)
-        self.last_send_time = time.time()
+        # Retransmite os pacotes em trânsito
+        with tracing.span("rdt.retransmit", packets=len(session.in_flight)):
+            for packet in session.in_flight:
+                self.connection.send(packet, session.addr)
+        session.send_times = deque([None] * len(session.in_flight))
+        self.retransmissions.inc(len(session.in_flight), reason="timeout")
+        session.dup_acks = 0
+        session.timer_start = time.time()
         return True
     
     def recv(self):
         """Recebe dados"""
+        data, _ = self.recvfrom()
+        return data
+    
+    def recvfrom(self):
+        """Recebe dados e o endereço de quem os enviou"""
         start_time = time.time()
         
         while True:
+            delivered = self._deliver()
+            if delivered is not None:
+                return delivered
+            
             # Check if we've exceeded maximum wait time
             if time.time() - start_time > MAX_RDT_WAIT_TIME:
-                print(f"{GREEN}RDTSocket: Timeout após {MAX_RDT_WAIT_TIME}s de espera por pacote, desistindo{RESET}")
-                return None
-                
-            try:
-                packet, addr = self.connection.receive()
-                
-                pkt_type, seq, checksum, data = self._unpack(packet)
-                
-                # Verifica se o checksum está correto
-                is_corrupt = (checksum != calculate_checksum(data))
-                
-                # Ignora pacotes que não sejam de dados
-                if not is_corrupt and pkt_type != DATA_PKT:
-                    continue
-                
-                # Processa de acordo com o estado
-                if self.recv_state == WAIT_FOR_PKT0:
-                    if not is_corrupt and seq == 0:
-                        # Pacote válido com seq=0, processamos e mudamos de estado
-                        ack_packet = self._make_ack(0)
-                        self.connection.send(ack_packet)
-                        
-                        old_state = self.recv_state
-                        self.recv_state = WAIT_FOR_PKT1
-                        print(f"{GREEN}RDTSocket: Pacote SEQ=0 recebido, enviando ACK0, transição de {old_state} → {self.recv_state}{RESET}")
-                        
-                        return data  # Retorna os dados diretamente como bytes
-                    else:
-                        # Pacote corrompido ou com seq=1 quando esperávamos seq=0
-                        # Reenviamos ACK para o último pacote recebido com sucesso (seq=1)
-                        ack_packet = self._make_ack(1)
-                        self.connection.send(ack_packet)
-                        if is_corrupt:
-                            print(f"{GREEN}RDTSocket: Pacote corrompido recebido, permanece em {self.recv_state}{RESET}")
-                        else:
-                            print(f"{GREEN}RDTSocket: Pacote inválido recebido (seq incorreta), permanece em {self.recv_state}{RESET}")
-                
-                elif self.recv_state == WAIT_FOR_PKT1:
-                    if not is_corrupt and seq == 1:
-                        # Pacote válido com seq=1, processamos e mudamos de estado
-                        ack_packet = self._make_ack(1)
-                        self.connection.send(ack_packet)
-                        
-                        old_state = self.recv_state
-                        self.recv_state = WAIT_FOR_PKT0
-                        print(f"{GREEN}RDTSocket: Pacote SEQ=1 recebido, enviando ACK1, transição de {old_state} → {self.recv_state}{RESET}")
-                        
-                        return data  # Retorna os dados diretamente como bytes
-                    else:
-                        # Pacote corrompido ou com seq=0 quando esperávamos seq=1
-                        # Reenviamos ACK para o último pacote recebido com sucesso (seq=0)
-                        ack_packet = self._make_ack(0)
-                        self.connection.send(ack_packet)
-                        if is_corrupt:
-                            print(f"{GREEN}RDTSocket: Pacote corrompido recebido, permanece em {self.recv_state}{RESET}")
-                        else:
-                            print(f"{GREEN}RDTSocket: Pacote inválido recebido (seq incorreta), permanece em {self.recv_state}{RESET}")
+                receiver_log.debug("RDTSocket: Timeout após %ss de espera por pacote, desistindo", MAX_RDT_WAIT_TIME)
+                return None, None
             
-            except socket.timeout:
-                continue
+            try:
+                self._poll()
+                self._reap_idle_sessions()
             except Exception as e:
-                print(f"{GREEN}RDTSocket: ERRO ao receber pacote: {e}{RESET}")
+                receiver_log.warning("RDTSocket: ERRO ao receber pacote: %s", e)
                 time.sleep(0.1)  # Adicionar pequena pausa para evitar loop infinito
     
+    def recvfrom_nowait(self):
+        """Como o recvfrom(), mas sem esperar: (dados, endereço) se já há o que entregar, senão (None, None).
+        
+        Para quem tem o próprio laço de eventos (asyncio): ele espera o fileno() ficar legível e chama
+        este método até vir (None, None). Cada chamada também faz andar retransmissões e filas de envio,
+        então ele deve ser chamado de tempos em tempos enquanto houver envios sem ACK.
+        """
+        delivered = self._deliver()
+        if delivered is None:
+            try:
+                self._poll(timeout=0)
+                self._reap_idle_sessions()
+            except Exception as e:
+                receiver_log.warning("RDTSocket: ERRO ao receber pacote: %s", e)
+            delivered = self._deliver()
+        return delivered or (None, None)
+    
+    def _deliver(self):
+        """Uma volta do recvfrom() sem ler a rede: (dados, endereço) da próxima mensagem aceita, ou None"""
+        # Com a fila cheia de pedidos não chegamos a esperar pacotes: os envios pendentes andam mesmo assim
+        if self.sending and time.time() - self.last_service >= SEND_SERVICE_INTERVAL:
+            self._service_sends()
+        if self.group_timers and self.group_timers[0][0] <= time.time():
+            self._service_groups()
+        
+        # Dados que chegaram enquanto esperávamos um ACK já foram aceitos; uma mensagem por sessão a cada vez
+        session = self._next_ready()
+        if session is not None:
+            data = session.backlog.popleft()
+            if session.backlog:
+                self.ready.append(session)
+            self.last_delivered = session
+            # Respostas vão para quem enviou estes dados
+            self.connection.last_remote_addr = session.addr
+            return data, session.addr  # Retorna os dados diretamente como bytes
+        
+        # Quem volta a ler sem ter enviado nada não vai dar carona ao ACK do que acabou de ler (ex.: várias
+        # respostas a pedidos em pipeline). Esperar o ACK atrasado travaria o peer, que espera esse ACK
+        # para mandar o próximo: confirmamos já
+        if self.last_delivered is not None:
+            self._flush_ack(self.last_delivered)
+            self.last_delivered = None
+        return None
+    
+    def fileno(self):
+        """Descritor do socket UDP, para esperar pacotes num select() ou laço de eventos"""
+        return self.connection.socket.fileno()
+    
+    def hold(self, addr, seconds):
+        """Deixa de entregar dados do peer pelos próximos `seconds` segundos.
+        
+        Backpressure para quem manda mais do que deve: os dados dele esperam na fila da sessão e, se ela
+        encher (backlog_limit), os pacotes seguintes são descartados sem ACK e a janela do remetente encolhe.
+        """
+        session = self.sessions.get(addr)
+        if session is not None:
+            session.held_until = time.time() + seconds
+    
+    def _next_ready(self):
+        """Próxima sessão com dados a entregar, deixando de lado as retidas por hold()"""
+        now = time.time()
+        if self.held:
+            released = [session for session in self.held if session.held_until <= now]
+            if released:
+                self.held = [session for session in self.held if session.held_until > now]
+                self.ready.extend(released)
+        while self.ready:
+            session = self.ready.popleft()
+            if session.held_until <= now:
+                return session
+            self.held.append(session)
+        return None
+    
     def close(self):
-        """Fecha o socket"""
+        """Fecha o socket, encerrando as sessões abertas com FIN"""
         if self.connection:
-            print(f"RDTSocket {self.connection.local_addr} fechado")   
-            self.connection.close()
-            self.connection = None
+            for session in list(self.sessions.values()):
+                # Não deixa o outro lado retransmitindo à espera do nosso último ACK
+                self._flush_ack(session)
+                if session.established:
+                    self._finish(session)
+            with self.ack_lock:
+                self.closed = True
+                self.delayed_acks.clear()
+                self.ack_wakeup.notify_all()
+            log.debug("RDTSocket %s fechado", self.connection.local_addr)
+            self._unregister_gauges()
+            with self.close_lock:
+                self.connection.close()
+                self.connection = None
+    
+    def _finish(self, session):
+        """Envia FIN e espera brevemente pelo FIN-ACK para que o peer libere a sessão"""
+        fin = self._make_control(FIN_PKT, session.session_id)
+        start_time = last_send_time = time.time()
+        self.connection.send(fin, session.addr)
+        
+        while session.addr in self.sessions and time.time() - start_time < FIN_WAIT_TIME:
+            try:
+                self._poll()
+            except Exception:
+                break
+            if time.time() - last_send_time >= self.timeout:
+                self.connection.send(fin, session.addr)
+                last_send_time = time.time()
+        self._drop_session(session.addr)
\ No newline at end of file
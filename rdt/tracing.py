@@ -0,0 +1,143 @@
+"""
+Spans de tempo opcionais nos caminhos quentes (envio/recebimento de pacotes, checksum, servidor...).
+
+Desligado por padrão: span() devolve um contexto vazio e não mede nada. Ligado com enable(), cada span
+mede o próprio trecho; a decisão de amostragem é tomada no span raiz e vale para todos os filhos, então
+um trace é gravado inteiro ou não é gravado. O resultado pode ser exportado como Chrome trace
+(chrome://tracing, Perfetto) ou em stacks "folded" (flamegraph.pl, speedscope).
+
+    with tracing.span("rdt.checksum"):
+        ...
+"""
+
+import json
+import time
+import random
+import threading
+
+# Quantidade máxima de spans guardados; os seguintes são contados mas descartados
+TRACE_LIMIT = 200000
+
+class _NoSpan:
+    """Contexto que não faz nada: o que span() devolve com o tracing desligado ou fora da amostra"""
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+NO_SPAN = _NoSpan()
+
+class _Unsampled:
+    """Raiz fora da amostra: marca a pilha para que os filhos também não sejam medidos"""
+    def __init__(self, stack):
+        self.stack = stack
+
+    def __enter__(self):
+        self.stack.append(None)
+        return self
+
+    def __exit__(self, *exc):
+        self.stack.pop()
+        return False
+
+class _Span:
+    def __init__(self, tracer, stack, name, args):
+        self.tracer = tracer
+        self.stack = stack
+        self.name = name
+        self.args = args
+        self.child_ns = 0
+
+    def __enter__(self):
+        self.stack.append(self)
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        duration = time.perf_counter_ns() - self.start
+        self.stack.pop()
+        if self.stack:
+            self.stack[-1].child_ns += duration
+        self.tracer._record(self, duration)
+        return False
+
+class Tracer:
+    def __init__(self):
+        self.enabled = False
+        self.sample_rate = 1.0
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.events = []  # (nome, args, início ns, duração ns, tempo próprio ns, stack, thread)
+        self.dropped = 0
+
+    def enable(self, sample_rate=1.0):
+        self.sample_rate = sample_rate
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def clear(self):
+        with self.lock:
+            self.events = []
+            self.dropped = 0
+
+    def span(self, name, **args):
+        if not self.enabled:
+            return NO_SPAN
+        stack = getattr(self.local, "stack", None)
+        if stack is None:
+            stack = self.local.stack = []
+        if stack:
+            if stack[-1] is None:
+                return NO_SPAN
+        elif random.random() >= self.sample_rate:
+            return _Unsampled(stack)
+        return _Span(self, stack, name, args)
+
+    def _record(self, span, duration):
+        path = ";".join(parent.name for parent in span.stack) + (";" if span.stack else "") + span.name
+        event = (span.name, span.args, span.start, duration, duration - span.child_ns, path, threading.get_ident())
+        with self.lock:
+            if len(self.events) < TRACE_LIMIT:
+                self.events.append(event)
+            else:
+                self.dropped += 1
+
+    def chrome_trace(self):
+        """Eventos completos ("X") no formato do Chrome trace, com tempos em microssegundos"""
+        with self.lock:
+            events = list(self.events)
+        return {
+            "traceEvents": [
+                {"name": name, "ph": "X", "ts": start / 1000, "dur": duration / 1000, "pid": 0, "tid": thread,
+                 "args": args}
+                for name, args, start, duration, _, _, thread in events
+            ],
+            "displayTimeUnit": "ms",
+        }
+
+    def folded(self):
+        """Linhas "raiz;filho;neto microssegundos" com o tempo próprio de cada stack, somado"""
+        totals = {}
+        with self.lock:
+            for _, _, _, _, self_ns, path, _ in self.events:
+                totals[path] = totals.get(path, 0) + self_ns
+        return "".join(f"{path} {self_ns // 1000}\n" for path, self_ns in sorted(totals.items()))
+
+    def write(self, path):
+        """Grava em stacks folded se o arquivo terminar em .folded, senão como Chrome trace (JSON)"""
+        with open(path, "w") as f:
+            if path.endswith(".folded"):
+                f.write(self.folded())
+            else:
+                json.dump(self.chrome_trace(), f)
+        return len(self.events), self.dropped
+
+# Tracer do processo, usado pelo rdt3 e pelo Server
+TRACER = Tracer()
+span = TRACER.span
+enable = TRACER.enable
+disable = TRACER.disable
+write = TRACER.write
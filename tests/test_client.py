@@ -0,0 +1,16 @@
+from Client.client import busy_retry_after
+
+
+def test_busy_retry_after():
+    assert busy_retry_after(b'{"busy": true, "retry_after": 0.25}') == 0.25
+    assert busy_retry_after(b'{"retry_after": 0.5, "busy": true}') == 0.5
+    assert busy_retry_after(b'{"busy":true,"retry_after":1}') == 1
+    assert busy_retry_after(b'{"id": 3, "reply": {"busy": true, "retry_after": 0.1}}') == 0.1
+
+
+def test_not_busy():
+    assert busy_retry_after(None) is None
+    assert busy_retry_after(b'true') is None
+    assert busy_retry_after(b'["busy"]') is None
+    assert busy_retry_after(b'{"hits": [], "more": false}') is None
+    assert busy_retry_after(b'\x00\xff') is None
@@ -0,0 +1,32 @@
+from Server.offline import OfflineQueue
+
+
+def journal_lines(directory, username):
+    with open(directory / f"{username}.jsonl") as f:
+        return sum(1 for _ in f)
+
+
+def test_journal_stays_bounded_without_acks(tmp_path):
+    queue = OfflineQueue(str(tmp_path), max_messages=5)
+    for i in range(100):
+        queue.add("bob", {"content": f"m{i}"})
+
+    assert queue.pending("bob") == 5
+    assert journal_lines(tmp_path, "bob") <= 10
+
+    reloaded = OfflineQueue(str(tmp_path), max_messages=5)
+    batches, remaining = reloaded.window("bob")
+    assert [message["content"] for batch in batches for _, message in batch] == [f"m{i}" for i in range(95, 100)]
+    assert remaining == 0
+    reloaded.add("bob", {"content": "m100"})
+    assert reloaded.window("bob")[0][-1][-1] == (101, {"content": "m100"})
+
+
+def test_ack_rewrites_journal(tmp_path):
+    queue = OfflineQueue(str(tmp_path), max_messages=5)
+    for i in range(3):
+        queue.add("bob", {"content": f"m{i}"})
+    assert queue.ack("bob", 2) == 2
+    assert journal_lines(tmp_path, "bob") == 1
+    assert queue.ack("bob", 3) == 1
+    assert not (tmp_path / "bob.jsonl").exists()
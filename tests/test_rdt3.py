@@ -0,0 +1,93 @@
+import time
+import threading
+
+import pytest
+
+from rdt import rdt3
+
+
+@pytest.fixture
+def pair(monkeypatch):
+    """Um remetente conectado a um receptor sem perdas, com o receptor lendo numa thread"""
+    monkeypatch.setattr(rdt3, "MAX_RDT_WAIT_TIME", 0.5)
+    sender, receiver = rdt3.RDTSocket(), rdt3.RDTSocket()
+    for sock in (sender, receiver):
+        sock.connection.loss_prob = sock.connection.corrupt_prob = 0
+        sock.connection.min_delay = sock.connection.max_delay = 0
+    received = []
+    stop = threading.Event()
+
+    def read():
+        while not stop.is_set():
+            data = receiver.recv()
+            if data is not None:
+                received.append(data)
+
+    thread = threading.Thread(target=read, daemon=True)
+    thread.start()
+    assert sender.connect(receiver.connection.local_addr)
+    yield sender, received
+    stop.set()
+    thread.join()
+    sender.close()
+    receiver.close()
+
+
+def test_send_after_give_up(pair):
+    sender, received = pair
+    assert sender.send(b"antes")
+
+    # Uma queda da rede faz o remetente desistir com pacotes que o receptor nunca viu
+    sender.connection.loss_prob = 1
+    assert not sender.send(b"perdida")
+    sender.connection.loss_prob = 0
+
+    for message in (b"depois 1", b"depois 2", b"depois 3"):
+        assert sender.send(message)
+    # O ACK sai quando o pacote é aceito, antes de a thread o ler
+    deadline = time.time() + 1
+    while len(received) < 4 and time.time() < deadline:
+        time.sleep(0.01)
+    assert received == [b"antes", b"depois 1", b"depois 2", b"depois 3"]
+
+
+def test_send_nowait_after_give_up(pair):
+    sender, received = pair
+    assert sender.send_nowait(b"antes")
+
+    sender.connection.loss_prob = 1
+    assert sender.send_nowait(b"perdida")
+    deadline = time.time() + 2
+    while sender.sending and time.time() < deadline:
+        sender.recvfrom_nowait()
+        time.sleep(0.01)
+    assert not sender.sending
+    sender.connection.loss_prob = 0
+
+    for message in (b"depois 1", b"depois 2"):
+        assert sender.send_nowait(message)
+    deadline = time.time() + 2
+    while len(received) < 3 and time.time() < deadline:
+        sender.recvfrom_nowait()
+        time.sleep(0.01)
+    assert received == [b"antes", b"depois 1", b"depois 2"]
+
+
+def test_is_acked(pair):
+    sender, received = pair
+    assert sender.send_nowait(b"login")
+    mark = sender.send_mark()
+    deadline = time.time() + 2
+    while not sender.is_acked(mark) and time.time() < deadline:
+        sender.recvfrom_nowait()
+        time.sleep(0.01)
+    assert sender.is_acked(mark) is True
+
+    sender.connection.loss_prob = 1
+    assert sender.send_nowait(b"perdida")
+    mark = sender.send_mark()
+    deadline = time.time() + 2
+    while sender.is_acked(mark) is False and time.time() < deadline:
+        sender.recvfrom_nowait()
+        time.sleep(0.01)
+    assert sender.is_acked(mark) is None
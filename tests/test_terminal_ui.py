@@ -0,0 +1,35 @@
+from Client.terminal_ui import AppState, MenuComponent
+
+
+def make_menu():
+    menu_structure = {"Menu": ["Grupos", "Amigos"], "Grupos": [], "Amigos": [],
+                      "Descobrir.Usuários": [], "Descobrir.Grupos": []}
+    return MenuComponent(AppState(), "Menu", menu_structure, {"Chat Geral": "Chat"})
+
+
+def test_apply_menus_with_groups():
+    menu = make_menu()
+    menu.apply_menus({
+        "friends": ["bob"],
+        "mygroups": [{"name": "team", "owner": "alice", "key": "K3Y", "members": 2}],
+        "cinners": ["alice", "bob", "carol"],
+        "groups": [{"name": "team", "owner": "alice", "members": 2},
+                   {"name": "open", "owner": "carol", "members": 1}],
+        "online": ["bob"],
+    })
+
+    assert menu.menu_structure["Grupos"] == ["team"]
+    assert menu.menu_structure["Amigos"] == ["bob"]
+    assert menu.menu_structure["Descobrir.Grupos"] == ["open"]
+    assert menu.menu_structure["Descobrir.Usuários"] == ["alice", "carol"]
+    assert menu.content_mapping["team"] == "Chat"
+    assert menu.content_mapping["bob"] == "Chat"
+    assert menu.state.online == {"bob"}
+
+
+def test_apply_menus_empty():
+    menu = make_menu()
+    menu.apply_menus({"friends": [], "mygroups": [], "cinners": [], "groups": [], "online": []})
+
+    assert menu.menu_structure["Grupos"] == ["Nenhum grupo ainda"]
+    assert menu.menu_structure["Amigos"] == ["Nenhum amigo ainda"]